@@ -1,20 +1,49 @@
 from django.contrib import admin
+from django.db.models import Q
 from reversion.admin import VersionAdmin
 
 from .models import Event, EventType, Shift, ShiftEquipment, ShiftQualification,\
-                    QuickQuote
-
-
-class EventModelAdmin(VersionAdmin):
+                    ShiftRecurrence, QuickQuote
+from .search import is_search_supported, search_queryset
+
+
+class IndexedSearchAdminMixin:
+    """ Admin search on the search vector and trigram indexes, a number also
+        matches `search_exact_fields`; `search_fields` are used on other
+        databases
+    """
+    search_trigram_fields = ('name', )
+    search_exact_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not is_search_supported():
+            return super().get_search_results(request, queryset, search_term)
+        extra = None
+        if search_term.strip().isdigit() and self.search_exact_fields:
+            extra = Q()
+            for field in self.search_exact_fields:
+                extra |= Q(**{field: int(search_term)})
+        return search_queryset(queryset, search_term, self.search_trigram_fields, extra, rank=False), False
+
+
+class EventModelAdmin(IndexedSearchAdminMixin, VersionAdmin):
     list_display = ('name', 'client', 'status',)
     list_filter = ('status', 'client')
     search_fields = ('name', 'status')
+    search_exact_fields = ('status', )
 
 
-class ShiftModelAdmin(VersionAdmin):
+class ShiftModelAdmin(IndexedSearchAdminMixin, VersionAdmin):
     list_display = ('name', 'event', 'status', )
     list_filter = ('event', 'status')
     search_fields = ('event__name', 'name', 'status')
+    search_exact_fields = ('status', )
+
+
+class QuickQuoteModelAdmin(IndexedSearchAdminMixin, admin.ModelAdmin):
+    list_display = ('first_name', 'last_name', 'email', 'phone', )
+    search_fields = ('first_name', 'last_name', 'phone', 'email')
+    search_trigram_fields = ('first_name', 'last_name', 'phone', 'email')
 
 
 class EventTypeModelAdmin(VersionAdmin):
@@ -27,4 +56,5 @@ admin.site.register(Shift, ShiftModelAdmin)
 admin.site.register(EventType, EventTypeModelAdmin)
 admin.site.register(ShiftEquipment)
 admin.site.register(ShiftQualification)
-admin.site.register(QuickQuote)
+admin.site.register(ShiftRecurrence)
+admin.site.register(QuickQuote, QuickQuoteModelAdmin)
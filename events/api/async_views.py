@@ -0,0 +1,65 @@
+""" Async variants of the read-only crew endpoints polled by the mobile app.
+
+    The Django/DRF stack of this project has no async ORM, so the views run
+    the existing DRF views (same authentication, serializers and response
+    shapes) on a bounded thread pool of `EVENTS_ASYNC_DB_THREADS` workers.
+    Under ASGI a waiting poller then holds a coroutine instead of a worker,
+    and the pool size caps the database connections used by these endpoints.
+    Django runs coroutine views from 3.1 on, `ASYNC_VIEWS_SUPPORTED` gates
+    their routes in `apps.events.urls`.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .views import CrewShiftRetrieveAPIView, UpcomingAllShiftView, UpcomingShiftView
+
+ASYNC_VIEWS_SUPPORTED = django.VERSION >= (3, 1)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'EVENTS_ASYNC_DB_THREADS', 8),
+                                           thread_name_prefix='events-db')
+        return _executor
+
+
+def run_view(view, request, *args, **kwargs):
+    """ Runs a sync view on a pool thread, the thread has its own connection
+        so the tenant set by the middleware is set again on it
+    """
+    close_old_connections()
+    tenant = getattr(request, 'tenant', None)
+    if tenant is not None:
+        connection.set_tenant(tenant)
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+def async_view(view_class):
+    view = view_class.as_view()
+
+    async def handler(request, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), functools.partial(run_view, view, request, *args, **kwargs))
+    # `csrf_exempt()` would wrap the coroutine in a sync function
+    handler.csrf_exempt = True
+    handler.view_class = view_class
+    return handler
+
+
+upcoming_shift = async_view(UpcomingShiftView)
+all_upcoming_shift = async_view(UpcomingAllShiftView)
+crew_shift_detail = async_view(CrewShiftRetrieveAPIView)
@@ -0,0 +1,83 @@
+""" Sparse fieldsets for the heavy event/shift serializers.
+
+    `?fields=id,name,status` keeps only the listed fields, `?omit=actions_needed`
+    drops fields. Dropped `SerializerMethodField`s are never evaluated and
+    `plan_queryset` only adds the joins, prefetches and annotations of the
+    fields that are rendered.
+"""
+
+
+def parse_field_list(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+def get_field_selection(request):
+    """ `(fields, omit)`, `fields` is None when every field is requested
+    """
+    if request is None:
+        return None, set()
+    params = getattr(request, 'query_params', request.GET)
+    fields = parse_field_list(params.get('fields'))
+    return fields or None, parse_field_list(params.get('omit'))
+
+
+def get_reverse_accessor(model, field_name):
+    """ Name of the reverse accessor of `model.field_name` on the related model
+    """
+    return model._meta.get_field(field_name).remote_field.get_accessor_name()
+
+
+class SparseFieldsetMixin:
+    """ Serializer mixin, the field maps tell `plan_queryset` what each field
+        needs on the queryset:
+            field_select_related = {'event_name': ('event',)}
+            field_prefetch_related = {'qualifications': (Prefetch(...),)}
+            field_annotations = {'total': lambda: {'total': Count(...)}}
+    """
+    field_select_related = {}
+    field_prefetch_related = {}
+    field_annotations = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields, omit = get_field_selection(self.context.get('request'))
+        for name in list(self.fields):
+            if (fields is not None and name not in fields) or name in omit:
+                self.fields.pop(name)
+
+    @classmethod
+    def plan_queryset(cls, queryset, request):
+        fields, omit = get_field_selection(request)
+
+        def is_selected(name):
+            return (fields is None or name in fields) and name not in omit
+
+        select_related, prefetch_related, annotations = [], [], {}
+        for name, lookups in cls.field_select_related.items():
+            if is_selected(name):
+                select_related.extend(lookups)
+        for name, lookups in cls.field_prefetch_related.items():
+            if is_selected(name):
+                prefetch_related.extend(lookups() if callable(lookups) else lookups)
+        for name, expressions in cls.field_annotations.items():
+            if is_selected(name):
+                annotations.update(expressions())
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        if annotations:
+            queryset = queryset.annotate(**annotations)
+        return queryset
+
+
+class SparseFieldsetViewMixin:
+    """ Plans the filtered queryset for the serializer of the request
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        if hasattr(serializer_class, 'plan_queryset'):
+            queryset = serializer_class.plan_queryset(queryset, self.request)
+        return queryset
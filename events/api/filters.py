@@ -1,5 +1,8 @@
 from django_filters import rest_framework as filters
-from apps.events.models import (Shift, Event)
+from django.db.models import Q
+from rest_framework.filters import OrderingFilter, SearchFilter
+from apps.events.models import (CrewShiftFeed, Shift, Event)
+from apps.events.search import is_search_supported, search_queryset
 
 
 class ShiftFilter(filters.FilterSet):
@@ -30,3 +33,57 @@ class EventFilter(filters.FilterSet):
         model = Event
         fields = ['id', 'event_type', 'status',
         'client', 'start_date', 'end_date', 'location']
+
+
+class CrewShiftFeedFilter(filters.FilterSet):
+    """ `ShiftFilter` for the crew shift feed, `id` is the shift id
+    """
+    id = filters.NumberFilter(field_name="shift")
+    start_date_gte = filters.DateFilter(
+        field_name="start_date", lookup_expr='gte')
+    start_date_lte = filters.DateFilter(
+        field_name="start_date", lookup_expr='lte')
+    start_date_time_gte = filters.DateTimeFilter(
+        field_name="start_date", lookup_expr='gte')
+    start_date_time_lte = filters.DateTimeFilter(
+        field_name="start_date", lookup_expr='lte')
+    status = filters.MultipleChoiceFilter(choices=Shift.STATUS, )
+
+    class Meta:
+        model = CrewShiftFeed
+        fields = ['id', 'name', 'event', 'location', 'start_date', 'end_date',
+                  'start_date_gte', 'start_date_lte', 'status', 'start_date_time_gte', 'start_date_time_lte']
+
+
+class CrewShiftFeedOrderingFilter(OrderingFilter):
+    """ Keeps the `?ordering=id` of the shift endpoints on the shift id
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        return [{'id': 'shift', '-id': '-shift'}.get(field, field) for field in ordering]
+
+
+class IndexedSearchFilter(SearchFilter):
+    """ `?search=` answered from the search vector and trigram indexes of the
+        model (see `apps.events.search`), ranked unless `?ordering=` is set.
+        View attributes:
+            search_trigram_fields: columns matched by similarity
+            search_id_field: exact match when the term is a number
+        `search_fields` keep the `icontains` search on other databases.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if not is_search_supported() or not hasattr(view, 'search_trigram_fields'):
+            return super().filter_queryset(request, queryset, view)
+        term = " ".join(self.get_search_terms(request))
+        if not term:
+            return queryset
+        extra = None
+        id_field = getattr(view, 'search_id_field', None)
+        if id_field and term.isdigit():
+            extra = Q(**{id_field: int(term)})
+        return search_queryset(queryset, term, view.search_trigram_fields, extra,
+                               rank=not request.query_params.get('ordering'))
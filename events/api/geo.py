@@ -0,0 +1,124 @@
+from datetime import datetime, time
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import exceptions
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from apps.events.api.utils import get_visibility_scope, get_visible_events, get_visible_shifts
+from apps.events.geo import SRID, nearby_event_locations, nearby_shifts
+from apps.events.tiles import get_tile, get_tile_version, is_valid_tile
+
+MAX_RADIUS = 500 * 1000
+
+
+def get_float(params, name):
+    try:
+        return float(params[name])
+    except (TypeError, ValueError):
+        raise exceptions.ValidationError({name: 'A number is required.'})
+
+
+def get_datetime(params, name, end_of_day=False):
+    """ a date alone covers the whole day """
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is not None:
+                parsed = datetime.combine(day, time.max if end_of_day else time.min)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise exceptions.ValidationError({name: 'A date or date/time is required.'})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def get_statuses(params):
+    statuses = []
+    for value in params.getlist('status'):
+        for status in value.split(','):
+            if status.strip():
+                if not status.strip().isdigit():
+                    raise exceptions.ValidationError({'status': 'Status ids are required.'})
+                statuses.append(int(status))
+    return statuses
+
+
+class NearbyEventsView(APIView):
+    """ Events and shifts the user may see around a point or inside a
+        bounding box, nearest first
+        :api: `events/nearby/`
+        :method: `GET`
+        :params: `lat`, `lng`, `radius` (meters) and/or `bbox` (`min_lng,min_lat,max_lng,max_lat`),
+                 `start_date`, `end_date`, `status` (repeatable or comma separated),
+                 `include` (`events`, `shifts`, default both), `limit`
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        point = radius = bbox = None
+        if 'lat' in params or 'lng' in params:
+            point = Point(get_float(params, 'lng'), get_float(params, 'lat'), srid=SRID)
+            radius = get_float(params, 'radius') if params.get('radius') else None
+            if radius is not None and not 0 < radius <= MAX_RADIUS:
+                raise exceptions.ValidationError({'radius': 'Between 0 and {} meters.'.format(MAX_RADIUS)})
+        if params.get('bbox'):
+            try:
+                bbox = tuple(float(value) for value in params['bbox'].split(','))
+            except ValueError:
+                bbox = ()
+            if len(bbox) != 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+                raise exceptions.ValidationError({'bbox': 'Expected min_lng,min_lat,max_lng,max_lat.'})
+        if point is None and bbox is None:
+            raise exceptions.ValidationError('lat/lng or bbox is required.')
+        if bbox is None and radius is None:
+            raise exceptions.ValidationError({'radius': 'Required without bbox.'})
+        max_limit = getattr(settings, 'EVENTS_NEARBY_MAX_LIMIT', 500)
+        limit = min(int(get_float(params, 'limit')) if params.get('limit') else 50, max_limit)
+        include = params.get('include', 'events,shifts').split(',')
+        kwargs = {
+            'point': point, 'radius': radius, 'bbox': bbox, 'limit': max(limit, 1),
+            'start': get_datetime(params, 'start_date'), 'end': get_datetime(params, 'end_date', end_of_day=True),
+            'statuses': get_statuses(params),
+        }
+        data = {}
+        if 'events' in include:
+            data['events'] = nearby_event_locations(get_visible_events(request.user), **kwargs)
+        if 'shifts' in include:
+            data['shifts'] = nearby_shifts(get_visible_shifts(request.user), **kwargs)
+        return Response(data)
+
+
+class EventTileView(APIView):
+    """ Clustered locations of the events the user may see on a `z/x/y` map
+        tile, every cluster with its count, mean position and counts per
+        status, `event` when it is a single one
+        :api: `events/tiles/<z>/<x>/<y>/`
+        :method: `GET`
+        :params: `status` (repeatable or comma separated)
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, z, x, y):
+        if not is_valid_tile(z, x, y):
+            raise exceptions.NotFound('No such tile.')
+        statuses = get_statuses(request.query_params)
+        version = get_tile_version()
+        scope = get_visibility_scope(request.user)
+        # every tile changes with the version, clients revalidate without a query
+        etag = '"{}:{}"'.format(version, scope)
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            return Response(status=304, headers={'ETag': etag})
+        tile = get_tile(z, x, y, statuses, version, get_visible_events(request.user), scope)
+        return Response(tile, headers={'ETag': etag})
@@ -0,0 +1,196 @@
+""" Per-request performance instrumentation for the events API.
+
+    Records DB query count/time, hits of the events cache (`cache` below, the
+    default cache counted while a request is measured) and the cumulative
+    time spent in every `SerializerMethodField`, tagged by tenant schema and
+    view name.
+    In DEBUG (or with `EVENTS_INSTRUMENTATION_HEADERS`) the numbers are sent as
+    response headers, otherwise they are aggregated per (schema, view) and
+    flushed to the `performance` logger every `EVENTS_METRICS_FLUSH_INTERVAL`
+    seconds.
+
+    Enable with `apps.events.api.instrumentation.InstrumentationMiddleware` in
+    MIDDLEWARE and `InstrumentedSerializerMixin` on the serializers.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from rest_framework.serializers import SerializerMethodField
+
+logger = logging.getLogger('performance')
+
+_current_metrics = ContextVar('events_request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'query_time', 'cache_hits', 'cache_misses', 'methods', 'started')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.methods = defaultdict(float)
+        self.started = time.monotonic()
+
+
+def get_current_metrics():
+    return _current_metrics.get()
+
+
+def query_wrapper(execute, sql, params, many, context):
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.monotonic()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.query_time += time.monotonic() - started
+
+
+_MISSING = object()
+
+
+class CountedCache:
+    """ The `alias` cache, with hits and misses of `get`/`get_many` counted
+        while a request is measured. Only the callers going through it are
+        counted, the backend class is left as is.
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    def __getattr__(self, name):
+        return getattr(caches[self.alias], name)
+
+    def get(self, key, default=None, version=None):
+        backend = caches[self.alias]
+        metrics = _current_metrics.get()
+        if metrics is None:
+            return backend.get(key, default, version=version)
+        value = backend.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            metrics.cache_misses += 1
+            return default
+        metrics.cache_hits += 1
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = caches[self.alias].get_many(keys, version=version)
+        metrics = _current_metrics.get()
+        if metrics is not None:
+            metrics.cache_hits += len(values)
+            metrics.cache_misses += len(keys) - len(values)
+        return values
+
+
+cache = CountedCache()
+
+
+class MetricsAggregator:
+    """ Process level sums of request metrics per (schema, view)
+    """
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.data = defaultdict(lambda: defaultdict(float))
+        self.last_flush = time.monotonic()
+
+    def record(self, schema_name, view_name, metrics, duration):
+        with self.lock:
+            entry = self.data[(schema_name, view_name)]
+            entry['requests'] += 1
+            entry['duration'] += duration
+            entry['queries'] += metrics.queries
+            entry['query_time'] += metrics.query_time
+            entry['cache_hits'] += metrics.cache_hits
+            entry['cache_misses'] += metrics.cache_misses
+            for name, spent in metrics.methods.items():
+                entry['method:' + name] += spent
+            if time.monotonic() - self.last_flush < self.flush_interval:
+                return
+            data = self.data
+            self.reset()
+        for (schema_name, view_name), entry in data.items():
+            logger.info('events api metrics', extra={
+                'schema_name': schema_name, 'view_name': view_name, 'metrics': dict(entry)})
+
+
+class InstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.send_headers = getattr(settings, 'EVENTS_INSTRUMENTATION_HEADERS', settings.DEBUG)
+        self.aggregator = MetricsAggregator(getattr(settings, 'EVENTS_METRICS_FLUSH_INTERVAL', 60))
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        try:
+            with connection.execute_wrapper(query_wrapper):
+                response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        duration = time.monotonic() - metrics.started
+        schema_name = getattr(connection, 'schema_name', '')
+        view_name = self.get_view_name(request)
+        if self.send_headers:
+            response['X-Tenant-Schema'] = schema_name
+            response['X-View-Name'] = view_name
+            response['X-Query-Count'] = str(metrics.queries)
+            response['X-Query-Time-Ms'] = '{:.1f}'.format(metrics.query_time * 1000)
+            response['X-Cache-Hits'] = '{}/{}'.format(metrics.cache_hits, metrics.cache_hits + metrics.cache_misses)
+            slowest = sorted(metrics.methods.items(), key=lambda item: -item[1])[:10]
+            response['Server-Timing'] = ", ".join(
+                ['db;dur={:.1f}'.format(metrics.query_time * 1000), 'total;dur={:.1f}'.format(duration * 1000)] +
+                ['{};dur={:.1f}'.format(name.replace('.', '-'), spent * 1000) for name, spent in slowest])
+        else:
+            self.aggregator.record(schema_name, view_name, metrics, duration)
+        return response
+
+    @staticmethod
+    def get_view_name(request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return ''
+        return match.view_name or match._func_path
+
+
+def _timed_representation(field, to_representation):
+    def timed(value):
+        metrics = _current_metrics.get()
+        if metrics is None:
+            return to_representation(value)
+        started = time.monotonic()
+        try:
+            return to_representation(value)
+        finally:
+            metrics.methods['{}.{}'.format(field.parent.__class__.__name__, field.method_name)] += \
+                time.monotonic() - started
+    return timed
+
+
+class InstrumentedSerializerMixin:
+    """ Times every `SerializerMethodField` of the serializer while a request
+        is being measured.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for field in fields.values():
+            if isinstance(field, SerializerMethodField):
+                field.to_representation = _timed_representation(field, field.to_representation)
+        return fields
@@ -1,10 +1,11 @@
 from rest_framework import viewsets
 
 from apps.events.models import Event
+from .fieldsets import SparseFieldsetViewMixin
 from .serilaizers import EventScheduleSerializer
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Event.objects.all().order_by("-created")
     serializer_class = EventScheduleSerializer
 
@@ -0,0 +1,214 @@
+""" On-demand sampling profiler for single requests.
+
+    A request carrying the `X-Profile: 1` header or the `?_profile=1` query
+    flag is sampled every `EVENTS_PROFILE_INTERVAL` seconds from a background
+    thread. Only requests of staff users are sampled: the user is
+    authenticated (session, else the API authentication classes) before the
+    sampler starts, other requests run unprofiled.
+    Profiles are stored as collapsed stacks (flame graph input) in a bounded
+    per-tenant directory under `EVENTS_PROFILE_DIR` and listed by
+    `ProfileListView`.
+
+    Enable with `apps.events.api.profiling.ProfilingMiddleware` in MIDDLEWARE.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import IsAdminUser
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_QUERY_FLAG = '_profile'
+
+
+class SamplingProfiler:
+    """ Samples the stack of one thread, counting collapsed stacks
+        (`module:function;module:function`).
+    """
+
+    def __init__(self, thread_id, interval=0.005, max_depth=100):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.started = time.monotonic()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.monotonic() - self.started
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append("{}:{}".format(frame.f_globals.get('__name__', '?'), code.co_name))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+
+class ProfileStore:
+    """ Bounded on-disk store, the oldest profiles of a tenant are removed
+        beyond `max_profiles`.
+    """
+
+    def __init__(self, root=None, max_profiles=None):
+        self.root = root or getattr(settings, 'EVENTS_PROFILE_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'events-profiles'))
+        self.max_profiles = max_profiles or getattr(settings, 'EVENTS_PROFILE_MAX_PER_TENANT', 50)
+
+    def get_dir(self, schema_name):
+        path = os.path.join(self.root, os.path.basename(schema_name) or 'public')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def save(self, schema_name, meta, stacks):
+        directory = self.get_dir(schema_name)
+        profile_id = "{}-{}".format(int(time.time()), uuid.uuid4().hex[:8])
+        with open(os.path.join(directory, profile_id + '.json'), 'w') as profile_file:
+            json.dump(dict(meta, id=profile_id, stacks=stacks), profile_file)
+        self.prune(directory)
+        return profile_id
+
+    def prune(self, directory):
+        files = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+        for name in files[:-self.max_profiles]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+    def list(self, schema_name, view_name=None):
+        directory = self.get_dir(schema_name)
+        profiles = []
+        for name in sorted(os.listdir(directory), reverse=True):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as profile_file:
+                    profile = json.load(profile_file)
+            except (OSError, ValueError):
+                continue
+            profile.pop('stacks', None)
+            if view_name and profile.get('view_name') != view_name:
+                continue
+            profiles.append(profile)
+        return profiles
+
+    def get(self, schema_name, profile_id):
+        path = os.path.join(self.get_dir(schema_name), os.path.basename(profile_id) + '.json')
+        try:
+            with open(path) as profile_file:
+                return json.load(profile_file)
+        except (OSError, ValueError):
+            return None
+
+
+class ProfilingMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.interval = getattr(settings, 'EVENTS_PROFILE_INTERVAL', 0.005)
+        self.store = ProfileStore()
+
+    def is_requested(self, request):
+        return request.META.get(PROFILE_HEADER) == '1' or request.GET.get(PROFILE_QUERY_FLAG) == '1'
+
+    @staticmethod
+    def get_user(request):
+        """ The user of the request, authenticated the way the API views do
+            when there is no session
+        """
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user
+        authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        try:
+            return Request(request, authenticators=authenticators).user
+        except APIException:
+            return None
+
+    def __call__(self, request):
+        if not self.is_requested(request):
+            return self.get_response(request)
+        user = self.get_user(request)
+        if user is None or not user.is_staff:
+            return self.get_response(request)
+        profiler = SamplingProfiler(threading.get_ident(), self.interval).start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+        match = getattr(request, 'resolver_match', None)
+        meta = {
+            'view_name': match.view_name if match else '',
+            'path': request.get_full_path(),
+            'method': request.method,
+            'status': response.status_code,
+            'user': user.pk,
+            'duration_ms': round(profiler.duration * 1000, 2),
+            'samples': profiler.samples,
+            'interval_ms': self.interval * 1000,
+            'created': timezone.now().isoformat(),
+        }
+        response['X-Profile-Id'] = self.store.save(
+            getattr(connection, 'schema_name', 'public'), meta, dict(profiler.stacks))
+        return response
+
+
+class ProfileListView(APIView):
+    """ Profiles stored for the current tenant
+        :api: `events/profiles/`
+        :params: `view_name` (optional)
+        :method: `GET`
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        profiles = ProfileStore().list(connection.schema_name, request.GET.get('view_name'))
+        return Response(profiles)
+
+
+class ProfileDetailView(APIView):
+    """ One profile with its collapsed stacks, `?collapsed=1` returns the
+        plain text input of flamegraph tools
+        :api: `events/profiles/<profile_id>/`
+        :method: `GET`
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, profile_id):
+        profile = ProfileStore().get(connection.schema_name, profile_id)
+        if profile is None:
+            raise Http404
+        if request.GET.get('collapsed') in ('true', 'True', '1'):
+            lines = ["{} {}".format(stack, count) for stack, count in profile['stacks'].items()]
+            return HttpResponse("\n".join(lines), content_type='text/plain')
+        return Response(profile)
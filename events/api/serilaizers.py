@@ -1,4 +1,5 @@
-from django.db.models import Q, Sum
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from rest_framework import serializers
 
@@ -14,10 +15,39 @@ from apps.common.api.serializers import (CrewDepartmentSerializer,
                                          SkillsSerializer)
 from apps.common.models import Location, Skills
 from apps.events.choices import EVENT_STATUS, STATUS
-from apps.events.models import (Event, EventType, Shift, ShiftEquipment,
-                                ShiftQualification, QuickQuote)
+from apps.events.models import (CrewShiftFeed, Event, EventType, Shift, ShiftEquipment,
+                                ShiftQualification, ShiftRecurrence, QuickQuote)
+from apps.events.recurrence import normalize_timezone, parse_rule
 from apps.scheduler.models import Schedule
-from apps.timesheet.models import TimeSheet
+
+from .fieldsets import SparseFieldsetMixin, get_reverse_accessor
+from .instrumentation import InstrumentedSerializerMixin
+
+
+def confirmed_shift_count():
+    shifts = Shift.objects.filter(event=OuterRef('pk'), status=Shift.CONFIRMATION).order_by().values(
+        'event').annotate(count=Count('id')).values('count')
+    return {'confirmed_shift_count': Coalesce(Subquery(shifts, output_field=IntegerField()), 0)}
+
+
+def scheduled_crew_prefetch():
+    return (Prefetch(get_reverse_accessor(Schedule, 'shift'),
+                     queryset=Schedule.objects.filter(is_scheduled=True).select_related('crew__user'),
+                     to_attr='scheduled_crew'),)
+
+
+def get_scheduled_crew(shift):
+    # prefetched by `scheduled_crew_prefetch` on list views
+    scheduled = getattr(shift, 'scheduled_crew', None)
+    if scheduled is None:
+        scheduled = list(Schedule.objects.filter(shift=shift, is_scheduled=True).select_related('crew__user'))
+    return scheduled
+
+
+SHIFT_QUALIFICATIONS_PREFETCH = (
+    Prefetch('shift_qualification', queryset=ShiftQualification.objects.select_related('qualification')),)
+SHIFT_EQUIPMENT_PREFETCH = (
+    Prefetch('shift_equipment', queryset=ShiftEquipment.objects.select_related('equipment')),)
 
 
 class EventTypeSerializer(serializers.ModelSerializer):
@@ -26,13 +56,25 @@ class EventTypeSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class EventSerializer(serializers.ModelSerializer):
+class EventSerializer(SparseFieldsetMixin, InstrumentedSerializerMixin, serializers.ModelSerializer):
     event_type_name = serializers.SerializerMethodField('make_event_type')
     status_name = serializers.SerializerMethodField('make_status')
     client_name = serializers.SerializerMethodField('make_client')
     location_details = serializers.SerializerMethodField()
     total_no_of_shifts = serializers.SerializerMethodField()
 
+    field_select_related = {
+        'event_type_name': ('event_type',),
+        'client_name': ('client',),
+    }
+    field_prefetch_related = {
+        'location_details': ('location',),
+        'location': ('location',),
+    }
+    field_annotations = {
+        'total_no_of_shifts': confirmed_shift_count,
+    }
+
     def make_event_type(self, obj):
         if obj.event_type:
             return obj.event_type.name
@@ -55,6 +97,8 @@ class EventSerializer(serializers.ModelSerializer):
             return Shift.objects.filter(
                 Q(event=obj),
                 Q(start_date__date=self.context['request'].parser_context['day']) | Q(end_date__date=self.context['request'].parser_context['day'])).count()
+        if hasattr(obj, 'confirmed_shift_count'):
+            return obj.confirmed_shift_count
         return Shift.objects.filter(event__id=obj.id, status=Shift.CONFIRMATION).count()
 
     class Meta:
@@ -62,7 +106,7 @@ class EventSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class EventCreateSerializer(serializers.ModelSerializer):
+class EventCreateSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     location_details = serializers.SerializerMethodField()
 
     class Meta:
@@ -116,7 +160,7 @@ class ShiftCrewSerilaizer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class ShiftLiteSerilizer(serializers.ModelSerializer):
+class ShiftLiteSerilizer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     location_name = serializers.SerializerMethodField()
 
     class Meta:
@@ -128,7 +172,7 @@ class ShiftLiteSerilizer(serializers.ModelSerializer):
         return obj.location.name
 
 
-class ShiftReadOnlyLiteSerializer(serializers.ModelSerializer):
+class ShiftReadOnlyLiteSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     """read-only shift serializer with minimal details about shift
     """
     event_name = serializers.SerializerMethodField()
@@ -149,90 +193,84 @@ class ShiftReadOnlyLiteSerializer(serializers.ModelSerializer):
         return obj.location.name
 
 
-class ShiftCrewListingSerilizer(serializers.ModelSerializer):
-    """ Serializer to get minimal amount of info for a user about shift Lisiting
+class CrewShiftMixin:
+    """ Pay rate and schedule of the crew member (`context['user']`) for one
+        shift. Crew shift listings are answered from the crew shift feed, this
+        serves the single shift detail.
     """
 
-    cost = serializers.SerializerMethodField()
-    location_name = serializers.SerializerMethodField()
-    schedule_details = serializers.SerializerMethodField()
-
-    class Meta:
-        model = Shift
-        fields = ('id', 'name', 'start_date', 'end_date', 'total_shift_hours',
-                  'cost', 'location_name', 'schedule_details')
-
-    def get_cost(self, obj):
-        # TODO change to a function
+    def get_crew_pay_rate(self, obj):
         qual = ShiftQualification.objects.filter(shift=obj).values_list(
             'qualification', flat=True)
-        cost = UserQualification.objects.filter(profile__user=self.context['user'],
-                                                qualification__in=qual).aggregate(
-                                                    sum=Sum('base_pay_rate'))
-        try:
-            cost = cost['sum'] * obj.total_shift_hours
-        except TypeError as te:
-            cost = 0
-        return cost
+        return UserQualification.objects.filter(
+            profile__user=self.context['user'], qualification__in=qual).aggregate(
+                sum=Sum('base_pay_rate'))['sum']
 
-    def get_location_name(self, obj):
-        return obj.location.name
-
-    def get_schedule_details(self, obj):
+    def get_crew_schedule_details(self, obj):
         try:
             sch = Schedule.objects.get(
                 shift=obj, crew__user=self.context['user'])
-            data = {'is_crew_chief': sch.is_crew_chief,
-                    'is_accepted': sch.is_accepted, 'is_rejected': sch.is_rejected}
         except Exception as ex:
             return 'N.A'
-        return data
+        return {'is_crew_chief': sch.is_crew_chief,
+                'is_accepted': sch.is_accepted, 'is_rejected': sch.is_rejected}
 
 
-class ShiftCrewDetailSerilizer(serializers.ModelSerializer):
-    """ Serializer to get minimal amount of info for a user about shift Lisiting
+class CrewShiftFeedListingSerializer(serializers.ModelSerializer):
+    """ Crew member's shift listing (pay and schedule) answered from the crew shift feed
     """
+    id = serializers.IntegerField(source='shift_id', read_only=True)
+    cost = serializers.FloatField(read_only=True)
+    schedule_details = serializers.SerializerMethodField()
 
-    cost = serializers.SerializerMethodField()
-    location_name = serializers.SerializerMethodField()
-    event_name = serializers.SerializerMethodField()
+    class Meta:
+        model = CrewShiftFeed
+        fields = ('id', 'name', 'start_date', 'end_date', 'total_shift_hours',
+                  'cost', 'location_name', 'schedule_details')
+        read_only_fields = fields
+
+    def get_schedule_details(self, obj):
+        return {'is_crew_chief': obj.is_crew_chief,
+                'is_accepted': obj.is_accepted, 'is_rejected': obj.is_rejected}
+
+
+class CrewShiftFeedDetailSerializer(serializers.ModelSerializer):
+    """ Crew member's shift detail (pay, event and running timesheet) answered from the crew shift feed
+    """
+    id = serializers.IntegerField(source='shift_id', read_only=True)
+    cost = serializers.FloatField(read_only=True)
     inprogress_shift = serializers.SerializerMethodField()
 
     class Meta:
-        model = Shift
+        model = CrewShiftFeed
         fields = ('id', 'name', 'start_date', 'end_date', 'total_shift_hours',
                   'cost', 'location_name', 'event_name', 'inprogress_shift')
         read_only_fields = fields
 
-    def get_cost(self, obj):
-        # TODO change to a function
-        qual = ShiftQualification.objects.filter(shift=obj).values_list(
-            'qualification', flat=True)
-        cost = UserQualification.objects.filter(profile__user=self.context['user'],
-                                                qualification__in=qual).aggregate(
-                                                    sum=Sum('base_pay_rate'))
-        try:
-            cost = cost['sum'] * obj.total_shift_hours
-        except TypeError as te:
-            cost = 0
-        return cost
+    def get_inprogress_shift(self, obj):
+        if obj.timesheet_id is None or obj.clock_in is None:
+            return {'running': False, 'timesheet_id': 'N.A'}
+        if not obj.clock_out and obj.clock_in <= timezone.now():
+            return {'running': True, 'timesheet_id': obj.timesheet_id}
+        return None
 
-    def get_location_name(self, obj):
-        return obj.location.name
 
-    def get_event_name(self, obj):
-        return obj.event.name
+class CrewShiftFeedSyncSerializer(serializers.ModelSerializer):
+    """ Shift, schedule and timesheet state of a crew shift for the delta sync
+    """
+    id = serializers.IntegerField(source='shift_id', read_only=True)
+    event = serializers.IntegerField(source='event_id', read_only=True)
+    cost = serializers.FloatField(read_only=True)
 
-    def get_inprogress_shift(self, obj):
-        try:
-            _timesheet = TimeSheet.objects.get(shift=obj, crew__user__id=self.context['user'])
-            if not _timesheet.clock_out and _timesheet.clock_in <= timezone.now():
-                return {'running': True, 'timesheet_id': _timesheet.id}
-        except Exception as ex:
-            return {'running': False, 'timesheet_id': 'N.A'}
+    class Meta:
+        model = CrewShiftFeed
+        fields = ('id', 'event', 'name', 'event_name', 'location_name', 'start_date', 'end_date',
+                  'total_shift_hours', 'status', 'cost', 'is_crew_chief', 'is_accepted',
+                  'is_rejected', 'timesheet_id', 'clock_in', 'clock_out')
+        read_only_fields = fields
 
 
-class ShiftCrewDetailSerializer(serializers.ModelSerializer):
+class ShiftCrewDetailSerializer(CrewShiftMixin, InstrumentedSerializerMixin, serializers.ModelSerializer):
     """ Serializer to get minimal amount of info for a user about shift -Detail
     """
     total_rate = serializers.SerializerMethodField()
@@ -248,12 +286,7 @@ class ShiftCrewDetailSerializer(serializers.ModelSerializer):
 
     def get_total_rate(self, obj):
         # FIXME
-        qual = ShiftQualification.objects.filter(shift=obj).values_list(
-            'qualification', flat=True)
-        cost = UserQualification.objects.filter(profile__user=self.context['user'],
-                                                qualification__in=qual).aggregate(
-                                                    sum=Sum('base_pay_rate'))
-        cost = cost['sum'] * obj.total_shift_hours
+        cost = self.get_crew_pay_rate(obj) * obj.total_shift_hours
         return cost
 
     def get_event_name(self, obj):
@@ -268,17 +301,10 @@ class ShiftCrewDetailSerializer(serializers.ModelSerializer):
         return qual.data
 
     def get_schedule_details(self, obj):
-        try:
-            sch = Schedule.objects.get(
-                shift=obj, crew__user=self.context['user'])
-            data = {'is_crew_chief': sch.is_crew_chief,
-                    'is_accepted': sch.is_accepted, 'is_rejected': sch.is_rejected}
-        except Exception as ex:
-            return 'N.A'
-        return data
+        return self.get_crew_schedule_details(obj)
 
 
-class ShiftEquipmentSerializer(serializers.ModelSerializer):
+class ShiftEquipmentSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     name = serializers.SerializerMethodField('make_name')
     charge_rate = serializers.SerializerMethodField()
 
@@ -293,7 +319,7 @@ class ShiftEquipmentSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class ShiftQualificationSerializer(serializers.ModelSerializer):
+class ShiftQualificationSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     qualification_details = serializers.SerializerMethodField()
 
     class Meta:
@@ -304,7 +330,7 @@ class ShiftQualificationSerializer(serializers.ModelSerializer):
         return QualificationLiteSerialiser(obj.qualification).data
 
 
-class ShiftSerializer(serializers.ModelSerializer):
+class ShiftSerializer(SparseFieldsetMixin, InstrumentedSerializerMixin, serializers.ModelSerializer):
     location_name = serializers.SerializerMethodField()
     department_details = serializers.SerializerMethodField()
     manager_name = serializers.SerializerMethodField()
@@ -314,23 +340,30 @@ class ShiftSerializer(serializers.ModelSerializer):
     event_name = serializers.SerializerMethodField()
     actions_needed = serializers.SerializerMethodField()
 
+    field_select_related = {
+        'location_name': ('location',),
+        'department_details': ('department',),
+        'manager_name': ('crew_manager__user',),
+        'event_name': ('event',),
+    }
+    field_prefetch_related = {
+        'skills': ('skills',),
+        'qualifications': SHIFT_QUALIFICATIONS_PREFETCH,
+        'equipment_details': SHIFT_EQUIPMENT_PREFETCH,
+        'actions_needed': scheduled_crew_prefetch,
+    }
+
     def get_actions_needed(self, obj):
-        assigned = Schedule.objects.filter(
-            shift=obj, is_scheduled=True).count()
-        accepted = Schedule.objects.filter(
-            shift=obj, is_scheduled=True, is_accepted=True).count()
+        scheduled = get_scheduled_crew(obj)
+        chiefs = [schedule for schedule in scheduled if schedule.is_crew_chief]
+        assigned = len(scheduled)
+        accepted = sum(1 for schedule in scheduled if schedule.is_accepted)
         actions = int(obj.no_of_resources - accepted)
-        rejected = Schedule.objects.filter(
-            shift=obj, is_scheduled=True, is_rejected=True).count()
-        crew_chief_assigned = Schedule.objects.filter(shift=obj, is_scheduled=True,
-                                                      is_crew_chief=True).count()
-        crew_chief_names = Schedule.objects.filter(
-            shift=obj, is_scheduled=True, is_crew_chief=True
-            ).values_list('crew__user__first_name')
-        crew_chief_accepted = Schedule.objects.filter(shift=obj, is_scheduled=True,
-                                                      is_crew_chief=True, is_accepted=True).count()
-        crew_chief_rejected = Schedule.objects.filter(shift=obj, is_scheduled=True,
-                                                      is_crew_chief=True, is_rejected=True).count()
+        rejected = sum(1 for schedule in scheduled if schedule.is_rejected)
+        crew_chief_assigned = len(chiefs)
+        crew_chief_names = [(schedule.crew.user.first_name, ) for schedule in chiefs]
+        crew_chief_accepted = sum(1 for schedule in chiefs if schedule.is_accepted)
+        crew_chief_rejected = sum(1 for schedule in chiefs if schedule.is_rejected)
         return {"assigned": assigned, "actions": actions, "accepted": accepted,
                 "rejected": rejected,
                 "crew_chief": {
@@ -357,12 +390,12 @@ class ShiftSerializer(serializers.ModelSerializer):
         return None
 
     def get_qualifications(self, obj):
-        shift_qualifications = ShiftQualification.objects.filter(shift=obj)
+        shift_qualifications = obj.shift_qualification.all()
         qual = ShiftQualificationSerializer(shift_qualifications, many=True)
         return qual.data
 
     def get_equipment_details(self, obj):
-        shift_equipment = ShiftEquipment.objects.filter(shift=obj)
+        shift_equipment = obj.shift_equipment.all()
         return ShiftEquipmentSerializer(shift_equipment, many=True).data
 
     def get_event_name(self, obj):
@@ -373,7 +406,7 @@ class ShiftSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class ShiftScheduleSerializer(serializers.ModelSerializer):
+class ShiftScheduleSerializer(SparseFieldsetMixin, InstrumentedSerializerMixin, serializers.ModelSerializer):
     # TODO duplicate serializer optimise this
     location_name = serializers.SerializerMethodField()
     department_details = serializers.SerializerMethodField()
@@ -384,20 +417,19 @@ class ShiftScheduleSerializer(serializers.ModelSerializer):
     event_name = serializers.SerializerMethodField()
     actions_needed = serializers.SerializerMethodField()
 
+    field_select_related = ShiftSerializer.field_select_related
+    field_prefetch_related = ShiftSerializer.field_prefetch_related
+
     def get_actions_needed(self, obj):
-        assigned = Schedule.objects.filter(
-            shift=obj, is_scheduled=True).count()
-        accepted = Schedule.objects.filter(
-            shift=obj, is_scheduled=True, is_accepted=True).count()
+        scheduled = get_scheduled_crew(obj)
+        chiefs = [schedule for schedule in scheduled if schedule.is_crew_chief]
+        assigned = len(scheduled)
+        accepted = sum(1 for schedule in scheduled if schedule.is_accepted)
         actions = int(obj.no_of_resources - accepted)
-        rejected = Schedule.objects.filter(
-            shift=obj, is_scheduled=True, is_rejected=True).count()
-        crew_chief_assigned = Schedule.objects.filter(shift=obj, is_scheduled=True,
-                                                      is_crew_chief=True).count()
-        crew_chief_accepted = Schedule.objects.filter(shift=obj, is_scheduled=True,
-                                                      is_crew_chief=True, is_accepted=True).count()
-        crew_chief_rejected = Schedule.objects.filter(shift=obj, is_scheduled=True,
-                                                      is_crew_chief=True, is_rejected=True).count()
+        rejected = sum(1 for schedule in scheduled if schedule.is_rejected)
+        crew_chief_assigned = len(chiefs)
+        crew_chief_accepted = sum(1 for schedule in chiefs if schedule.is_accepted)
+        crew_chief_rejected = sum(1 for schedule in chiefs if schedule.is_rejected)
         return {"assigned": assigned, "actions": actions, "accepted": accepted,
                 "rejected": rejected,
                 "crew_chief": {
@@ -422,12 +454,12 @@ class ShiftScheduleSerializer(serializers.ModelSerializer):
         return None
 
     def get_qualifications(self, obj):
-        shift_qualifications = ShiftQualification.objects.filter(shift=obj)
+        shift_qualifications = obj.shift_qualification.all()
         qual = ShiftQualificationSerializer(shift_qualifications, many=True)
         return qual.data
 
     def get_equipment_details(self, obj):
-        shift_equipment = ShiftEquipment.objects.filter(shift=obj)
+        shift_equipment = obj.shift_equipment.all()
         return ShiftEquipmentSerializer(shift_equipment, many=True).data
 
     def get_event_name(self, obj):
@@ -446,7 +478,7 @@ class ChildSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class ShiftSkillsSerializer(serializers.ModelSerializer):
+class ShiftSkillsSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     subskills = serializers.SerializerMethodField('make_subskills')
     # pagination_class = StandardResultsSetPagination
 
@@ -461,18 +493,36 @@ class ShiftSkillsSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class EventScheduleSerializer(serializers.ModelSerializer):
+def order_shifts_prefetch():
+    return (Prefetch(get_reverse_accessor(Shift, 'event'), to_attr='order_shifts', queryset=Shift.objects.select_related(
+        'location', 'department__location', 'crew_manager__user').prefetch_related(
+        'skills', *SHIFT_EQUIPMENT_PREFETCH)),)
+
+
+class EventScheduleSerializer(SparseFieldsetMixin, InstrumentedSerializerMixin, serializers.ModelSerializer):
     shifts = serializers.SerializerMethodField()
     event_location_details = serializers.SerializerMethodField()
     client_name = serializers.SerializerMethodField()
     event_type_name = serializers.SerializerMethodField()
 
+    field_select_related = {
+        'client_name': ('client',),
+        'event_type_name': ('event_type',),
+    }
+    field_prefetch_related = {
+        'shifts': order_shifts_prefetch,
+        'event_location_details': ('location',),
+        'location': ('location',),
+    }
+
     class Meta:
         model = Event
         fields = '__all__'
 
     def get_shifts(self, obj):
-        shifts = Shift.objects.filter(event=obj)
+        shifts = getattr(obj, 'order_shifts', None)
+        if shifts is None:
+            shifts = Shift.objects.filter(event=obj)
         return (OrderShiftSerializer(shifts, many=True)).data
 
     def get_event_location_details(self, obj):
@@ -487,7 +537,7 @@ class EventScheduleSerializer(serializers.ModelSerializer):
         return 'N.A'
 
 
-class OrderShiftSerializer(serializers.ModelSerializer):
+class OrderShiftSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     location_name = serializers.SerializerMethodField()
     department_name = serializers.SerializerMethodField()
     manager_name = serializers.SerializerMethodField()
@@ -536,7 +586,7 @@ class OrderShiftSerializer(serializers.ModelSerializer):
         return obj.department.location.name
 
     def get_equipment_details(self, obj):
-        shift_equipment = ShiftEquipment.objects.filter(shift=obj)
+        shift_equipment = obj.shift_equipment.all()
         return ShiftEquipmentSerializer(shift_equipment, many=True).data
 
     class Meta:
@@ -549,3 +599,30 @@ class QuickQuoteSerializer(serializers.ModelSerializer):
     class Meta:
         model = QuickQuote
         fields = '__all__'
+
+
+class ShiftRecurrenceSerializer(serializers.ModelSerializer):
+
+    def validate_timezone(self, value):
+        # an IANA name or a UTC offset (`+05:30`, JavaScript `getTimezoneOffset()` minutes)
+        try:
+            return normalize_timezone(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+    def validate(self, attrs):
+        template = attrs.get('template') or getattr(self.instance, 'template', None)
+        if template is None or template.start_date is None:
+            raise serializers.ValidationError({'template': "The template shift needs a start date."})
+        rule = attrs.get('rule', getattr(self.instance, 'rule', ''))
+        if rule:
+            try:
+                parse_rule(rule, template.start_date.replace(tzinfo=None))
+            except (TypeError, ValueError) as e:
+                raise serializers.ValidationError({'rule': str(e)})
+        return attrs
+
+    class Meta:
+        model = ShiftRecurrence
+        fields = '__all__'
+        read_only_fields = ('materialized_until', )
@@ -0,0 +1,75 @@
+""" Delta sync of the crew shift feed.
+
+    A sync token is a signed `{crew, cursor}` pair, the cursor being a
+    `CrewShiftChange` id. Change ids are allocated before commit, so a change
+    with a lower id can become visible after one with a higher id; the cursor
+    handed out therefore stops at the changes older than
+    `EVENTS_SYNC_SAFETY_LAG` seconds and the newer ones are sent again on the
+    next sync (upserts are idempotent on the client).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Max
+from django.utils import timezone
+
+from apps.events.models import CrewShiftChange, CrewShiftFeed
+
+TOKEN_SALT = 'events.crew-shift-sync'
+
+
+def get_token_max_age():
+    # the change log is pruned at the same age, see `prune_crew_shift_changes`
+    return getattr(settings, 'EVENTS_SYNC_TOKEN_MAX_AGE', 30 * 24 * 3600)
+
+
+def get_safety_lag():
+    return getattr(settings, 'EVENTS_SYNC_SAFETY_LAG', 5)
+
+
+def make_sync_token(crew_id, cursor):
+    return signing.dumps({'crew': crew_id, 'cursor': cursor}, salt=TOKEN_SALT, compress=True)
+
+
+def read_sync_token(token, crew_id):
+    """ Cursor of a token, None when the token is invalid, expired or issued
+        to another crew member (the client then does a full resync)
+    """
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT, max_age=get_token_max_age())
+    except signing.BadSignature:
+        return None
+    if data.get('crew') != crew_id:
+        return None
+    return data.get('cursor')
+
+
+def get_safe_cursor(crew_id, since=0):
+    safe_before = timezone.now() - timedelta(seconds=get_safety_lag())
+    cursor = CrewShiftChange.objects.filter(
+        crew=crew_id, id__gt=since, created__lt=safe_before).aggregate(cursor=Max('id'))['cursor']
+    return cursor or since
+
+
+def get_crew_changes(crew_id, token=None):
+    """ :returns: `(full, rows, deleted, token)`, `rows` the feed rows to
+        upsert on the client and `deleted` the shift ids to remove.
+    """
+    cursor = read_sync_token(token, crew_id) if token else None
+    if cursor is None:
+        # the cursor is read before the rows, changes in between are sent again
+        cursor = get_safe_cursor(crew_id)
+        rows = CrewShiftFeed.objects.filter(crew=crew_id, is_scheduled=True).order_by('start_date')
+        return True, rows, [], make_sync_token(crew_id, cursor)
+    shift_ids = set(CrewShiftChange.objects.filter(crew=crew_id, id__gt=cursor).values_list(
+        'shift_id', flat=True))
+    new_cursor = get_safe_cursor(crew_id, cursor)
+    if not shift_ids:
+        return False, CrewShiftFeed.objects.none(), [], make_sync_token(crew_id, new_cursor)
+    rows = CrewShiftFeed.objects.filter(crew=crew_id, shift__in=shift_ids, is_scheduled=True).order_by(
+        'start_date')
+    present = set(rows.values_list('shift', flat=True))
+    # unscheduled rows are removed from the client like deleted ones
+    deleted = sorted(shift_ids - present)
+    return False, rows, deleted, make_sync_token(crew_id, new_cursor)
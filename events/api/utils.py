@@ -12,24 +12,66 @@ def get_event_shift_status(self, request):
         return Event.ESTIMATION
 
 
+# highest working status first, an event takes the first one of its shifts
+EVENT_STATUS_FROM_SHIFT = (
+    (Shift.COMPLETED, Event.COMPLETED),
+    (Shift.ONGOING, Event.ONGOING),
+    (Shift.CONFIRMATION, Event.CONFIRMATION),
+    (Shift.QUOTATION, Event.QUOTATION),
+    (Shift.REQUEST_QUOTATION, Event.REQUEST_QUOTATION),
+    (Shift.ESTIMATION, Event.ESTIMATION),
+)
+
+
+def get_event_status_from_shifts(shift_statuses, default):
+    """ Event status for the statuses of its shifts, `default` when none of
+        them is a working status
+    """
+    for shift_status, event_status in EVENT_STATUS_FROM_SHIFT:
+        if shift_status in shift_statuses:
+            return event_status
+    return default
+
+
 def update_event_status_from_shift(event_id):
     """ function to update Event status from shifts, this takes highest
         working status from shift and returns new event status
         :params: `event_id`
     """
     _event = Event.objects.get(id=event_id)
-    shifts = Shift.objects.filter(event__id=event_id)
-    if shifts.filter(status=Shift.COMPLETED).exists():
-        _event.status = Event.COMPLETED
-    elif shifts.filter(status=Shift.ONGOING).exists():
-        _event.status = Event.ONGOING
-    elif shifts.filter(status=Shift.CONFIRMATION).exists():
-        _event.status = Event.CONFIRMATION
-    elif shifts.filter(status=Shift.QUOTATION).exists():
-        _event.status = Event.QUOTATION
-    elif shifts.filter(status=Shift.REQUEST_QUOTATION).exists():
-        _event.status = Event.REQUEST_QUOTATION
-    elif shifts.filter(status=Shift.ESTIMATION).exists():
-        _event.status = Event.ESTIMATION
+    shift_statuses = set(Shift.objects.filter(event__id=event_id).values_list('status', flat=True))
+    _event.status = get_event_status_from_shifts(shift_statuses, _event.status)
     _event.save()
     return _event.status
+
+
+def get_visible_events(user, events=None):
+    """ The events `user` may see: a Crew Manager those with a shift they
+        manage, a Client its own events, the other users all of them
+    """
+    events = Event.objects.all() if events is None else events
+    if user.user_type == User.CREW_MANAGER:
+        return events.filter(id__in=Shift.objects.filter(crew_manager__user=user).values('event'))
+    if user.user_type == User.CLIENT:
+        return events.filter(client__user=user)
+    return events
+
+
+def get_visibility_scope(user):
+    """ Name of the set of events `get_visible_events` gives `user`, for
+        caches shared by the users of a tenant
+    """
+    if user.user_type in (User.CREW_MANAGER, User.CLIENT):
+        return '{}:{}'.format(user.user_type, user.pk)
+    return 'all'
+
+
+def get_visible_shifts(user, shifts=None):
+    """ The shifts `user` may see, scoped like `get_visible_events`
+    """
+    shifts = Shift.objects.all() if shifts is None else shifts
+    if user.user_type == User.CREW_MANAGER:
+        return shifts.filter(crew_manager__user=user)
+    if user.user_type == User.CLIENT:
+        return shifts.filter(event__client__user=user)
+    return shifts
@@ -1,9 +1,12 @@
 from datetime import datetime, timedelta
 
 from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection, transaction
 from django.db.models import DateTimeField, ExpressionWrapper, F, Q
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.utils.translation import ugettext as _
 from django_filters.rest_framework import DjangoFilterBackend
 from django.utils.timezone import make_aware, make_naive
@@ -11,6 +14,8 @@ from django.utils.timezone import make_aware, make_naive
 from pinax.notifications.models import NoticeType, queue, send, send_now
 from rest_framework import (exceptions, filters, generics, mixins, status,
                             views, viewsets)
+from rest_framework.decorators import action
+from rest_framework.fields import DateTimeField as DateTimeSerializerField
 from rest_framework.generics import ListAPIView, RetrieveAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -20,24 +25,34 @@ from apps.accounts.api.serializers import CrewProfileLiteSerializer
 from apps.accounts.models import CrewProfile, Skills, User
 from apps.common.models import Equipments, Qualification
 from apps.events.api.notifications import send_event_status_notification
-from apps.events.models import (Event, EventType, Shift, ShiftEquipment,
-                                ShiftQualification, QuickQuote)
-from apps.timesheet.models import TimeSheet
-from apps.events.api.utils import get_event_shift_status, update_event_status_from_shift
+from apps.events.clone import clone_event
+from apps.events.feed import refresh_crew_shift_feed_for_shifts
+from apps.events.push.publish import publish_event_status, publish_shift_status
+from apps.events.push.tokens import make_push_token
+from apps.events.models import (CrewShiftFeed, Event, EventType, Shift, ShiftEquipment,
+                                ShiftQualification, ShiftRecurrence, QuickQuote)
+from apps.events.recurrence import (get_occurrences, get_timezone, materialize_occurrence,
+                                    materialize_recurrence, reset_recurrence)
+from apps.events.api.utils import (get_event_shift_status, get_visible_events,
+                                   update_event_status_from_shift)
 from apps.mixins import MethodSerializerMixin
 from apps.scheduler.models import Schedule
 from apps.suppliers.models import Suppliers
-from apps.utils import add_hours
 
-from .filters import ShiftFilter, EventFilter
-from .serilaizers import (EventCreateSerializer, EventLiteSerializer,
+from .fieldsets import SparseFieldsetViewMixin
+from .geo import get_datetime
+from .sync import get_crew_changes
+from .filters import (CrewShiftFeedFilter, CrewShiftFeedOrderingFilter,
+                      IndexedSearchFilter, ShiftFilter, EventFilter)
+from .serilaizers import (CrewShiftFeedDetailSerializer, CrewShiftFeedListingSerializer,
+                          CrewShiftFeedSyncSerializer,
+                          EventCreateSerializer, EventLiteSerializer,
                           EventScheduleSerializer, EventSerializer,
                           EventStatusSerializer, EventTypeSerializer,
-                          ShiftCrewDetailSerializer, ShiftCrewDetailSerilizer,
-                          ShiftCrewListingSerilizer, ShiftCrewSerilaizer,
+                          ShiftCrewDetailSerializer, ShiftCrewSerilaizer,
                           ShiftEquipmentSerializer, ShiftLiteSerilizer,
-                          ShiftQualificationSerializer, ShiftSerializer,
-                          ShiftSkillsSerializer, QuickQuoteSerializer)
+                          ShiftQualificationSerializer, ShiftRecurrenceSerializer,
+                          ShiftSerializer, ShiftSkillsSerializer, QuickQuoteSerializer)
 
 
 class EventTypeViewSet(viewsets.ModelViewSet):
@@ -47,11 +62,52 @@ class EventTypeViewSet(viewsets.ModelViewSet):
     serializer_class = EventTypeSerializer
 
 
-class EventViewSet(MethodSerializerMixin, viewsets.ModelViewSet):
+class LiteValuesListMixin:
+    """ `?lite=` list answered straight from `values()`: the columns (and
+        joined names) of `lite_values` are projected and the row dicts are
+        rendered as they are, no model or serializer instance is created.
+        Must return the same keys as the lite serializer of the view; datetime
+        columns go through the serializer field so both render alike.
+    """
+    lite_values = ('id', 'name')
+    lite_expressions = {}
+
+    def get_lite_datetime_fields(self, model):
+        datetime_fields = []
+        for name in self.lite_values:
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if isinstance(field, DateTimeField):
+                datetime_fields.append(name)
+        return datetime_fields
+
+    def render_lite_rows(self, rows, datetime_fields):
+        field = DateTimeSerializerField()
+        for row in rows:
+            for name in datetime_fields:
+                if row[name] is not None:
+                    row[name] = field.to_representation(row[name])
+        return rows
+
+    def list(self, request, *args, **kwargs):
+        if not request.GET.get('lite', None):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        datetime_fields = self.get_lite_datetime_fields(queryset.model)
+        queryset = queryset.values(*self.lite_values, **self.lite_expressions)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.render_lite_rows(list(page), datetime_fields))
+        return Response(self.render_lite_rows(list(queryset), datetime_fields))
+
+
+class EventViewSet(LiteValuesListMixin, SparseFieldsetViewMixin, MethodSerializerMixin, viewsets.ModelViewSet):
     queryset = Event.objects.all().order_by('-created')
     serializer_class = EventSerializer
     filter_backends = (
-        filters.OrderingFilter, filters.SearchFilter, DjangoFilterBackend
+        filters.OrderingFilter, IndexedSearchFilter, DjangoFilterBackend
     )
     ordering_fields = (
         'id', 'name', 'event_type__name', 'status',
@@ -59,7 +115,10 @@ class EventViewSet(MethodSerializerMixin, viewsets.ModelViewSet):
         'cost', 'po_number',
     )
     search_fields = ('name', )
+    search_trigram_fields = ('name', )
     filter_class = EventFilter
+    # EventLiteSerializer
+    lite_values = ('id', 'name')
     method_serializer_classes = {
         ('GET', ): EventSerializer,
         ('PUT', 'PATCH', 'POST'): EventCreateSerializer,
@@ -77,15 +136,7 @@ class EventViewSet(MethodSerializerMixin, viewsets.ModelViewSet):
             events = Event.objects.ex_archived()
         if self.request.GET.get('archived') in ('true', 'True'):
             events = Event.objects.get_archived()
-        if(self.request.user.user_type == User.CREW_MANAGER):
-            manager_events = Shift.objects.filter(
-                crew_manager__user=self.request.user).values_list(
-                'event', flat=True).distinct()
-            events = events.filter(id__in=manager_events)
-        elif(self.request.user.user_type == User.CLIENT):
-            events = events.filter(client__user=self.request.user)
-        elif(self.request.user.user_type == User.SUPPLIER):
-            pass
+        events = get_visible_events(self.request.user, events)
 
         if self.request.GET.get('month'):
             if(self.request.user.user_type == User.CREW_MANAGER):
@@ -117,6 +168,35 @@ class EventViewSet(MethodSerializerMixin, viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    @action(detail=True, methods=['post'])
+    def clone(self, request, pk=None):
+        """ Copy of the event with its locations and shifts, moved to a new
+            `start_date` or by `offset_days`, `name` optional
+            :api: `events/event/<pk>/clone/`
+        """
+        source = self.get_object()
+        if request.data.get('start_date'):
+            if source.start_date is None:
+                raise exceptions.ValidationError({'start_date': _("The event has no start date, use offset_days.")})
+            value = str(request.data['start_date'])
+            try:
+                day = parse_date(value)
+            except ValueError:
+                raise exceptions.ValidationError({'start_date': _("A valid date or date/time is required.")})
+            if day is not None:
+                # a date alone keeps the times of day
+                offset = timedelta(days=(day - timezone.localtime(source.start_date).date()).days)
+            else:
+                offset = get_datetime({'start_date': value}, 'start_date') - source.start_date
+        else:
+            try:
+                offset = timedelta(days=int(request.data.get('offset_days', 0)))
+            except (TypeError, ValueError):
+                raise exceptions.ValidationError({'offset_days': _("A number of days is required.")})
+        event = clone_event(source, offset, get_event_shift_status(self, request), request.data.get('name'))
+        serializer = EventSerializer(event, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
@@ -190,8 +270,12 @@ class EventChangeStatusView(generics.UpdateAPIView):
         serializer.is_valid(raise_exception=True)
         #  Update shift status
         shifts = Shift.objects.filter(event=instance, status=cur_status)
+        shift_ids = list(shifts.values_list('id', flat=True))
         shifts.update(status=new_status)
+        # `update()` sends no signals, the crew feed is refreshed here
+        transaction.on_commit(lambda: refresh_crew_shift_feed_for_shifts(shift_ids))
         self.perform_update(serializer)
+        publish_event_status(instance.id, instance.status, shift_ids)
         send_event_status_notification(instance, request)
 
         # TODO send notifications web/mob
@@ -241,17 +325,23 @@ class CrewEventListView(generics.ListAPIView):
         return qs
 
 
-class ShiftViewSet(viewsets.ModelViewSet):
+class ShiftViewSet(LiteValuesListMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     """
     """
     queryset = Shift.objects.all().order_by('-created')
     serializer_class = ShiftSerializer
-    filter_backends = (filters.SearchFilter, DjangoFilterBackend,
+    filter_backends = (IndexedSearchFilter, DjangoFilterBackend,
                        filters.OrderingFilter)
     search_fields = ('event__name', 'id', 'name')
+    # the event name is part of the shift search vector
+    search_trigram_fields = ('name', )
+    search_id_field = 'id'
     # filterset_fields = ['id', 'name', 'event', 'location', ]
     ordering_fields = ('name', 'event', 'start_date', 'total_hours', 'status')
     filter_class = ShiftFilter
+    # ShiftLiteSerilizer
+    lite_values = ('id', 'name', 'location', 'start_date', 'total_shift_hours', 'end_date')
+    lite_expressions = {'location_name': F('location__name')}
 
     def get_serializer_class(self):
         if self.request is not None:
@@ -290,29 +380,18 @@ class ShiftViewSet(viewsets.ModelViewSet):
             shift_equipment.save()
         headers = self.get_success_headers(serializer.data)
         if request.data['repeat_shift'] is True:
-            for st_date in request.data['dates_data']:
-                request.data['start_date'] = st_date
-                request.data['end_date'] = add_hours(
-                    st_date, instance.total_shift_hours)
-                serializer = self.get_serializer(data=request.data)
-                serializer.is_valid(raise_exception=True)
-                created_shift = serializer.save()
-
-                for qualification in skills_list:
-                    qual = Qualification.objects.get(id=qualification['id'])
-                    shift_qual, created = ShiftQualification.objects.get_or_create(
-                        shift=created_shift, qualification=qual
-                    )
-                    shift_qual.no_of_resources = qualification['count']
-                    shift_qual.save()
-
-                for equipment in equipments:
-                    e = Equipments.objects.get(id=equipment['id'])
-                    shift_equipment, created = ShiftEquipment.objects.get_or_create(
-                        shift=created_shift, equipment=e
-                    )
-                    shift_equipment.count = equipment['count']
-                    shift_equipment.save()
+            # the repeats are a series on this shift, rows are created up to the horizon only
+            recurrence_data = {
+                'template': instance.id,
+                'rule': request.data.get('recurrence_rule', ''),
+                'rdates': request.data.get('dates_data', []),
+                'exdates': request.data.get('exdates', []),
+            }
+            if request.data.get('tz_offset'):
+                recurrence_data['timezone'] = request.data['tz_offset']
+            recurrence_serializer = ShiftRecurrenceSerializer(data=recurrence_data)
+            recurrence_serializer.is_valid(raise_exception=True)
+            materialize_recurrence(recurrence_serializer.save())
 
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
@@ -359,6 +438,10 @@ class ShiftViewSet(viewsets.ModelViewSet):
         ShiftQualification.objects.filter(
             shift=instance, qualification__id__in=diff).delete()
 
+        recurrence = ShiftRecurrence.objects.filter(template=instance).first()
+        if recurrence is not None:
+            reset_recurrence(recurrence)
+
         if getattr(instance, '_prefetched_objects_cache', None):
             # If 'prefetch_related' has been applied to a queryset, we need to
             # forcibly invalidate the prefetch cache on the instance.
@@ -456,6 +539,59 @@ class ShiftQualificationViewSet(viewsets.ModelViewSet):
     serializer_class = ShiftQualificationSerializer
 
 
+class ShiftRecurrenceViewSet(viewsets.ModelViewSet):
+    """ Series of a template shift, see `apps.events.recurrence`.
+        An update edits every occurrence not materialized yet in one write.
+    """
+    queryset = ShiftRecurrence.objects.select_related('template').order_by('-created')
+    serializer_class = ShiftRecurrenceSerializer
+
+    def perform_create(self, serializer):
+        materialize_recurrence(serializer.save())
+
+    def perform_update(self, serializer):
+        reset_recurrence(serializer.save())
+
+    @action(detail=True, methods=['get'])
+    def occurrences(self, request, pk=None):
+        """ Starts of the series between two dates, with the shift of the
+            materialized ones
+            :api: `events/shift-recurrence/<pk>/occurrences/`
+            :params: `start_date`, `end_date`
+        """
+        recurrence = self.get_object()
+        start = get_datetime(request.query_params, 'start_date')
+        end = get_datetime(request.query_params, 'end_date', end_of_day=True)
+        if start is None or end is None or end <= start:
+            raise exceptions.ValidationError("start_date and end_date are required.")
+        occurrences = [{'start_date': occurrence_start, 'end_date': occurrence_end, 'shift': None}
+                       for _recurrence, occurrence_start, occurrence_end
+                       in get_occurrences([recurrence], start, end)]
+        for shift in recurrence.occurrences.filter(series_start__gte=start, series_start__lt=end):
+            occurrences.append({'start_date': shift.start_date, 'end_date': shift.end_date, 'shift': shift.id})
+        occurrences.sort(key=lambda occurrence: occurrence['start_date'])
+        return Response(occurrences)
+
+    @action(detail=True, methods=['post'])
+    def materialize(self, request, pk=None):
+        """ Shift row of one occurrence (`occurrence`, its start), e.g. before
+            scheduling crew on it, or of all the occurrences up to `until`
+            :api: `events/shift-recurrence/<pk>/materialize/`
+        """
+        recurrence = self.get_object()
+        if request.data.get('occurrence'):
+            start = get_datetime(request.data, 'occurrence')
+            try:
+                shift, created = materialize_occurrence(recurrence, start)
+            except ValueError as e:
+                raise exceptions.ValidationError({'occurrence': str(e)})
+            return Response(ShiftSerializer(shift, context=self.get_serializer_context()).data,
+                            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+        until = get_datetime(request.data, 'until', end_of_day=True)
+        shifts = materialize_recurrence(recurrence, until)
+        return Response({'created': [shift.id for shift in shifts]})
+
+
 def get_next_n_days(start_date, no_of_days):
     days = []
     for i in range(0, no_of_days):
@@ -463,17 +599,19 @@ def get_next_n_days(start_date, no_of_days):
     return days
 
 
-class ShiftScheduleViewSet(viewsets.ModelViewSet):
+class ShiftScheduleViewSet(SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Shift.objects.all()
     serializer_class = ShiftSerializer
 
-    def get_queryset(self):
-        # Quering Shifts based on local TimeZone coming from Request
+    def get_shift_queryset(self):
         if self.request.user.user_type == User.CREW_MANAGER:
-            shift_queryset = Shift.objects.filter(
+            return Shift.objects.filter(
                 crew_manager__user=self.request.user, status=Shift.CONFIRMATION)
-        else:
-            shift_queryset = Shift.objects.filter(status=Shift.CONFIRMATION)
+        return Shift.objects.filter(status=Shift.CONFIRMATION)
+
+    def get_queryset(self):
+        # Quering Shifts based on local TimeZone coming from Request
+        shift_queryset = self.get_shift_queryset()
         if self.request.GET.get('start_date') and self.request.GET.get('end_date'):
             # tz_offset = int(self.request.GET.get('tz_offset'))
             tz_offset = self.request.GET.get('tz_offset')
@@ -504,14 +642,14 @@ class ShiftScheduleViewSet(viewsets.ModelViewSet):
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
-        import pytz
         tz_offset = self.request.GET.get('tz_offset')
-        tz = pytz.timezone(tz_offset)
+        tz = get_timezone(tz_offset)
         start_date = make_aware(datetime.strptime(
             self.request.GET.get('start_date'), "%Y-%m-%d"), tz)
         end_date = make_aware(datetime.strptime(
             self.request.GET.get('end_date'), "%Y-%m-%d"), tz)
         days = get_next_n_days(start_date, (end_date - start_date).days)
+        occurrences = self.get_occurrences(start_date, start_date + timedelta(days=len(days)))
         data = []
         for day in days:
             # start_date = day + timedelta(minutes=tz_offset)
@@ -521,12 +659,41 @@ class ShiftScheduleViewSet(viewsets.ModelViewSet):
                 queryset.filter(start_date__range=[start_date, end_date]), many=True)
             data.append({
                 "day": day,
-                "shifts": serializer.data
+                "shifts": serializer.data + [occurrence for occurrence in occurrences
+                                             if start_date <= occurrence['series_start'] < end_date]
             })
         return Response(data)
 
-
-class ScheduleAllEvents(viewsets.ModelViewSet):
+    def get_occurrences(self, after, before):
+        """ Occurrences of the recurring shifts not materialized yet, as the
+            data of their template with the dates (and `id`) of the occurrence
+        """
+        recurrences = ShiftRecurrence.objects.filter(
+            template__in=self.get_shift_queryset().filter(event__id=self.request.GET.get('event_id'))
+        ).select_related('template')
+        date_field = DateTimeSerializerField()
+        templates = {}
+        occurrences = []
+        for recurrence, start, end in get_occurrences(recurrences, after, before):
+            if recurrence.id not in templates:
+                templates[recurrence.id] = self.get_serializer(recurrence.template).data
+            occurrence = dict(templates[recurrence.id], id=None, series=recurrence.id,
+                              start_date=date_field.to_representation(start),
+                              end_date=date_field.to_representation(end))
+            if 'actions_needed' in occurrence:
+                # nobody is scheduled on an occurrence before it is materialized
+                occurrence['actions_needed'] = dict(
+                    occurrence['actions_needed'], assigned=0, accepted=0, rejected=0,
+                    actions=recurrence.template.no_of_resources,
+                    crew_chief={"crew_chief_assigned": 0, "crew_chief_accepted": 0,
+                                "crew_chief_rejected": 0, "crew_chief_names": []})
+            # kept as a datetime for the day buckets, rendered by the response
+            occurrence['series_start'] = start
+            occurrences.append(occurrence)
+        return occurrences
+
+
+class ScheduleAllEvents(SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Event.objects.all().order_by('-created')
     serializer_class = EventSerializer
     paginator = None
@@ -564,47 +731,30 @@ class CrewShiftListAPIView(ListAPIView):
     """ Returns a list of shifts assinged to a crew(user)
         :api: get-crew-shift-list/
     """
-    serializer_class = ShiftCrewListingSerilizer
+    serializer_class = CrewShiftFeedListingSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = (filters.SearchFilter, DjangoFilterBackend,
-                       filters.OrderingFilter)
+                       CrewShiftFeedOrderingFilter)
     ordering_fields = ('id', 'name', 'start_date', 'end_date',
                        'total_shift_hours', )
     search_fields = ('name', )
-    filter_class = ShiftFilter
+    filter_class = CrewShiftFeedFilter
 
     def get_queryset(self):
-        if self.request.GET.get('user'):
-            queryset = Shift.objects.filter(
-                schedule__crew__user=self.request.GET.get('user'), schedule__is_scheduled=True)
-            queryset = self.get_filtered_qs(
-                queryset, self.request.GET.get('user'))
-        else:
-            queryset = Shift.objects.filter(
-                schedule__crew__user=self.request.user.id, schedule__is_scheduled=True)
-            queryset = self.get_filtered_qs(queryset, self.request.user.id)
-        return queryset
-
-    def get_serializer_context(self):
         if self.request.GET.get('user'):
             _id = self.request.GET.get('user')
         else:
             _id = self.request.user.id
-        return {'user': _id}
+        queryset = CrewShiftFeed.objects.filter(crew__user=_id, is_scheduled=True)
+        return self.get_filtered_qs(queryset)
 
-    def get_filtered_qs(self, queryset, user):
+    def get_filtered_qs(self, queryset):
         ''' additional filters to filter the queryset according to params
         '''
         if self.request.GET.get('pending') in ('True', 'true'):
-            queryset = Shift.objects.filter(
-                schedule__crew__user=user,
-                schedule__is_scheduled=True, schedule__is_accepted=False,
-                schedule__is_rejected=False)
+            queryset = queryset.filter(is_accepted=False, is_rejected=False)
         if self.request.GET.get('accepted') in ('True', 'true'):
-            queryset = Shift.objects.filter(
-                schedule__crew__user=user,
-                schedule__is_scheduled=True, schedule__is_accepted=True,
-                schedule__is_rejected=False)
+            queryset = queryset.filter(is_accepted=True, is_rejected=False)
         return queryset
 
 
@@ -663,26 +813,18 @@ class UpcomingShiftView(APIView):
 
     def get(self, request):
         if request.user.user_type == User.CREW_MEMBER:
-            queryset = Shift.objects.filter(
-                schedule__crew__user=self.request.user.id,
-                schedule__is_scheduled=True,
-                schedule__is_accepted=True
+            queryset = CrewShiftFeed.objects.filter(
+                crew__user=self.request.user.id,
+                is_scheduled=True,
+                is_accepted=True
             )
-            # TODO exclude completed timesheets if needed
-            # timesheets = TimeSheet.objects.filter(
-            #     crew__user=self.request.user,
-            #     clock_in__isnull=False,
-            #     clock_out__isnull=False
-            # ).values_list('shift', flat=True).distinct()
+            # TODO exclude completed timesheets if needed (`clock_out__isnull`)
             shift = queryset.filter(
                 Q(start_date__gte=timezone.now()) | Q(
                     end_date__gte=timezone.now())
             ).order_by('start_date').first()
             if shift:
-                ser = ShiftCrewDetailSerilizer(
-                    shift,
-                    context={"user": request.user.id}
-                )
+                ser = CrewShiftFeedDetailSerializer(shift)
                 return Response(ser.data, status=status.HTTP_200_OK)
             else:
                 return Response({'detail': 'No-upcoming Shifts'}, status=status.HTTP_404_NOT_FOUND)
@@ -695,15 +837,15 @@ class UpcomingAllShiftView(generics.ListAPIView):
         :API: get-all-upcoming-shift/
         :METHOD: GET
     """
-    serializer_class = ShiftCrewListingSerilizer
+    serializer_class = CrewShiftFeedListingSerializer
     permission_class = (IsAuthenticated)
 
     def get_queryset(self):
         if self.request.user.user_type == User.CREW_MEMBER:
-            queryset = Shift.objects.filter(
-                schedule__crew__user=self.request.user.id,
-                schedule__is_scheduled=True,
-                schedule__is_accepted=True
+            queryset = CrewShiftFeed.objects.filter(
+                crew__user=self.request.user.id,
+                is_scheduled=True,
+                is_accepted=True
             )
             shifts = queryset.filter(
                 Q(start_date__gte=timezone.now()) | Q(
@@ -713,12 +855,6 @@ class UpcomingAllShiftView(generics.ListAPIView):
             raise exceptions.ValidationError("View allowed only for Memeber")
         return shifts
 
-    def get_serializer_context(self):
-        context = {
-            "user": self.request.user.id
-        }
-        return context
-
 
 class ChangeShiftStatusView(APIView):
     """ View to change status of a list of shifts or bulk change to new status
@@ -738,12 +874,17 @@ class ChangeShiftStatusView(APIView):
             # change shifts status to new status
             if _cur_status:
                 shifts = Shift.objects.filter(event=_event, status=_cur_status)
-                shifts.update(status=_new_status)
             elif _shifts:
                 shifts = Shift.objects.filter(event=_event, id__in=_shifts)
-                shifts.update(status=_new_status)
+            else:
+                shifts = Shift.objects.none()
+            shift_ids = list(shifts.values_list('id', flat=True))
+            shifts.update(status=_new_status)
+            # `update()` sends no signals, the crew feed is refreshed here
+            transaction.on_commit(lambda: refresh_crew_shift_feed_for_shifts(shift_ids))
             # update event status to the highest shift status
             _status = update_event_status_from_shift(_event)
+            publish_shift_status(_event, shift_ids, _new_status)
             return Response(
                 {'detail': 'shifts status updated',
                  'event_status': _status},
@@ -754,10 +895,11 @@ class ChangeShiftStatusView(APIView):
 class QuickQuoteViewSet(viewsets.ModelViewSet):
     queryset = QuickQuote.objects.all().order_by('-created')
     serializer_class = QuickQuoteSerializer
-    filter_backends = (filters.SearchFilter, DjangoFilterBackend,
+    filter_backends = (IndexedSearchFilter, DjangoFilterBackend,
                        filters.OrderingFilter)
     ordering_fields = ('email', 'created', 'first_name', 'last_name')
     search_fields = ('first_name', 'last_name', 'phone', 'email')
+    search_trigram_fields = ('first_name', 'last_name', 'phone', 'email')
 
 
 class ShiftHistoryViewSet(APIView):
@@ -768,18 +910,53 @@ class ShiftHistoryViewSet(APIView):
     """
 
     def get(self, request, pk):
-        shift_queryset = Shift.objects.filter(
-            schedule__crew__id=pk,
-            schedule__is_scheduled=True,
-            schedule__is_accepted=True
+        shift_queryset = CrewShiftFeed.objects.filter(
+            crew=pk,
+            is_scheduled=True,
+            is_accepted=True
         )
         shifts = shift_queryset.filter(
             end_date__lte=timezone.now()
         ).order_by('end_date').first()
         if shifts:
-            ser = ShiftCrewDetailSerilizer(
-                shifts, context={"user": pk}
-            )
+            ser = CrewShiftFeedDetailSerializer(shifts)
             return Response(ser.data, status=status.HTTP_200_OK)
         else:
             return Response({'detail': 'No Previous Shifts'}, status=status.HTTP_404_NOT_FOUND)
+
+
+class CrewShiftSyncView(APIView):
+    """ Delta sync of the shifts of the logged in Crew Member
+        :API: crew-shift-sync/
+        :METHOD: GET
+        :params: `token` (optional) the token of the previous sync
+
+        Without a (valid) token every shift is returned with `full: true`,
+        otherwise only the shifts changed since the token and the ids of the
+        removed ones. The client keeps the returned `token` for the next sync.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        crew_id = CrewProfile.objects.filter(user=request.user).values_list('id', flat=True).first()
+        if crew_id is None:
+            return Response({'error': 'bad-request'}, status=status.HTTP_400_BAD_REQUEST)
+        full, rows, deleted, token = get_crew_changes(crew_id, request.GET.get('token'))
+        return Response({
+            'full': full,
+            'token': token,
+            'changed': CrewShiftFeedSyncSerializer(rows, many=True).data,
+            'deleted': deleted,
+        }, status=status.HTTP_200_OK)
+
+
+class PushTokenView(APIView):
+    """ Short lived token to open the push stream (`/events/push/?token=`)
+        :API: push-token/
+        :METHOD: POST
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        return Response({'token': make_push_token(request.user, connection.schema_name)},
+                        status=status.HTTP_200_OK)
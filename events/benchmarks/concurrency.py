@@ -0,0 +1,99 @@
+""" Requests/second of the sync crew endpoints against their async variants.
+
+    Sync: `workers` threads, each serving one request at a time like a sync
+    WSGI worker. Async: one event loop with `concurrency` pollers in flight,
+    the views running on the bounded pool of `apps.events.api.async_views`.
+    Requests go straight to the views (no HTTP server), so the numbers
+    compare the serving models, not the network stack.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+from tenant_schemas.utils import schema_context
+
+from apps.events.api import async_views
+from apps.events.models import CrewShiftFeed
+
+from .harness import get_url_prefix, percentile
+
+
+class ConcurrencyBenchmark:
+
+    def __init__(self, tenant, requests=500, workers=4, concurrency=100):
+        self.tenant = tenant
+        self.requests = requests
+        self.workers = workers
+        self.concurrency = concurrency
+        self.factory = APIRequestFactory(SERVER_NAME=tenant.domain_url)
+
+    def get_endpoints(self):
+        """ (name, user, path, view kwargs, async view) of every benchmarked endpoint
+        """
+        prefix = get_url_prefix()
+        with schema_context(self.tenant.schema_name):
+            row = CrewShiftFeed.objects.filter(is_scheduled=True, is_accepted=True).select_related(
+                'crew__user').order_by('id').first()
+        if row is None:
+            return []
+        user = row.crew.user
+        return [
+            ('crew-upcoming-shift', user, prefix + 'get-upcoming-shift/', {}, async_views.upcoming_shift),
+            ('crew-all-upcoming-shift', user, prefix + 'get-all-upcoming-shift/', {},
+             async_views.all_upcoming_shift),
+            ('crew-shift-detail', user, prefix + 'get-crew-shift-list/{}/'.format(row.shift_id),
+             {'pk': row.shift_id}, async_views.crew_shift_detail),
+        ]
+
+    def make_request(self, user, path):
+        request = self.factory.get(path)
+        force_authenticate(request, user)
+        request.tenant = self.tenant
+        return request
+
+    def run_sync(self, user, path, kwargs, view):
+        def serve(i):
+            started = time.perf_counter()
+            response = async_views.run_view(view, self.make_request(user, path), **kwargs)
+            return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(serve, range(self.requests)))
+        return time.perf_counter() - started, results
+
+    def run_async(self, user, path, kwargs, handler):
+        async def main():
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def serve(i):
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await handler(self.make_request(user, path), **kwargs)
+                    return time.perf_counter() - started, response.status_code
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*[serve(i) for i in range(self.requests)])
+            return time.perf_counter() - started, results
+
+        return asyncio.run(main())
+
+    @staticmethod
+    def summarize(seconds, results):
+        latencies = [latency for latency, status in results]
+        return {
+            'rps': round(len(results) / seconds, 1) if seconds else 0.0,
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'errors': sum(1 for latency, status in results if status >= 400),
+        }
+
+    def run(self):
+        results = {}
+        for name, user, path, kwargs, handler in self.get_endpoints():
+            results[name] = {
+                'sync': self.summarize(*self.run_sync(user, path, kwargs, handler.view_class.as_view())),
+                'async': self.summarize(*self.run_async(user, path, kwargs, handler)),
+            }
+        return results
@@ -0,0 +1,162 @@
+""" Synthetic tenant data for the events API benchmarks.
+
+    Builds a tenant with a configurable number of events, shifts,
+    qualifications, equipment, crew, schedules and timesheets. Rows are
+    written with `bulk_create`, the cost and scheduling signals are not
+    fired; computed columns, the crew shift feed and the search vectors are
+    filled in directly.
+"""
+import random
+from datetime import timedelta
+
+from django.contrib.gis.geos import Point
+from django.utils import timezone
+from tenant_schemas.utils import get_tenant_model, schema_context
+
+from apps.accounts.models import Client, CrewProfile, User, UserQualification
+from apps.common.models import CrewDepartment, Equipments, Location, Qualification, SuplierSetting
+from apps.events.feed import rebuild_crew_shift_feed
+from apps.events.search import rebuild_search_vectors
+from apps.events.models import (Event, EventLocation, EventType, Shift, ShiftEquipment,
+                                ShiftQualification)
+from apps.scheduler.models import Schedule
+from apps.timesheet.models import TimeSheet
+
+SIZES = {
+    'small': {'events': 20, 'shifts_per_event': 5, 'qualifications': 10, 'equipment': 10,
+              'crew': 50, 'schedules_per_shift': 3, 'timesheet_ratio': 0.5},
+    'medium': {'events': 200, 'shifts_per_event': 10, 'qualifications': 30, 'equipment': 30,
+               'crew': 300, 'schedules_per_shift': 5, 'timesheet_ratio': 0.5},
+    'large': {'events': 2000, 'shifts_per_event': 10, 'qualifications': 50, 'equipment': 50,
+              'crew': 2000, 'schedules_per_shift': 5, 'timesheet_ratio': 0.5},
+}
+
+
+class SyntheticTenant:
+    """ usage:
+            tenant = SyntheticTenant('bench_small', **SIZES['small']).build()
+    """
+
+    def __init__(self, schema_name, events=20, shifts_per_event=5, qualifications=10, equipment=10,
+                 crew=50, schedules_per_shift=3, timesheet_ratio=0.5, seed=42):
+        self.schema_name = schema_name
+        self.events = events
+        self.shifts_per_event = shifts_per_event
+        self.qualifications = qualifications
+        self.equipment = equipment
+        self.crew = crew
+        self.schedules_per_shift = schedules_per_shift
+        self.timesheet_ratio = timesheet_ratio
+        self.random = random.Random(seed)
+
+    @property
+    def domain_url(self):
+        return "{}.benchmark.local".format(self.schema_name)
+
+    def get_or_create_tenant(self):
+        tenant_model = get_tenant_model()
+        tenant = tenant_model.objects.filter(schema_name=self.schema_name).first()
+        if tenant is None:
+            # saving a tenant creates and migrates its schema
+            tenant = tenant_model(schema_name=self.schema_name, domain_url=self.domain_url,
+                                  name=self.schema_name)
+            tenant.save()
+        return tenant
+
+    def random_point(self):
+        return Point(8 + self.random.random(), 47 + self.random.random(), srid=4326)
+
+    def build(self):
+        tenant = self.get_or_create_tenant()
+        with schema_context(self.schema_name):
+            if Event.objects.exists():
+                return tenant
+            SuplierSetting.objects.get_or_create(defaults={'rate_per_km': 1})
+            self.build_catalog()
+            self.build_users()
+            self.build_events()
+            self.build_schedules()
+            rebuild_crew_shift_feed()
+            rebuild_search_vectors()
+        return tenant
+
+    def build_catalog(self):
+        self.locations = [Location.objects.create(name="Location {}".format(i), coordinates=self.random_point())
+                          for i in range(max(self.events // 5, 3))]
+        self.department = CrewDepartment.objects.create(name="Department", location=self.locations[0])
+        self.event_type = EventType.objects.create(name="Concert")
+        self.qualification_objs = Qualification.objects.bulk_create([
+            Qualification(name="Qualification {}".format(i), charge_rate=20 + i, chief_addl_charge_rate=5)
+            for i in range(self.qualifications)])
+        self.equipment_objs = Equipments.objects.bulk_create([
+            Equipments(name="Equipment {}".format(i), charge_rate=10 + i)
+            for i in range(self.equipment)])
+
+    def build_users(self):
+        self.supplier = User.objects.create(username="supplier@{}".format(self.domain_url),
+                                            email="supplier@{}".format(self.domain_url),
+                                            user_type=User.SUPPLIER, is_staff=True)
+        client_user = User.objects.create(username="client@{}".format(self.domain_url),
+                                          email="client@{}".format(self.domain_url), user_type=User.CLIENT)
+        self.client = Client.objects.create(user=client_user, company_name="Benchmark Client")
+        User.objects.bulk_create([
+            User(username="crew{}@{}".format(i, self.domain_url), email="crew{}@{}".format(i, self.domain_url),
+                 first_name="Crew", last_name=str(i), user_type=User.CREW_MEMBER)
+            for i in range(self.crew)])
+        users = list(User.objects.filter(user_type=User.CREW_MEMBER).order_by('id'))
+        CrewProfile.objects.bulk_create([CrewProfile(user=user) for user in users])
+        self.crew_profiles = list(CrewProfile.objects.select_related('user').order_by('id'))
+        UserQualification.objects.bulk_create([
+            UserQualification(profile=profile, qualification=self.random.choice(self.qualification_objs),
+                              base_pay_rate=15 + self.random.randint(0, 10))
+            for profile in self.crew_profiles])
+
+    def build_events(self):
+        now = timezone.now()
+        events = []
+        for i in range(self.events):
+            start = now + timedelta(days=self.random.randint(-60, 60))
+            events.append(Event(name="Event {}".format(i), event_type=self.event_type, client=self.client,
+                                status=Event.CONFIRMATION, start_date=start,
+                                end_date=start + timedelta(days=self.random.randint(0, 3))))
+        self.event_objs = Event.objects.bulk_create(events)
+        EventLocation.objects.bulk_create([
+            EventLocation(event=event, location_name=event.name, coordinates=self.random_point())
+            for event in self.event_objs])
+        shifts = []
+        for event in self.event_objs:
+            event.location.add(self.random.choice(self.locations))
+            for j in range(self.shifts_per_event):
+                start = event.start_date + timedelta(hours=self.random.randint(0, 48))
+                shifts.append(Shift(name="{} shift {}".format(event.name, j), event=event,
+                                    start_date=start, end_date=start + timedelta(hours=8),
+                                    total_shift_hours=8, location=self.random.choice(self.locations),
+                                    department=self.department, status=Shift.CONFIRMATION,
+                                    no_of_resources=self.schedules_per_shift))
+        self.shift_objs = Shift.objects.bulk_create(shifts)
+        qualifications, equipment = [], []
+        for shift in self.shift_objs:
+            for qualification in self.random.sample(self.qualification_objs, min(2, len(self.qualification_objs))):
+                qualifications.append(ShiftQualification(
+                    shift=shift, qualification=qualification, charge_rate=qualification.charge_rate,
+                    no_of_resources=1, qualification_cost=qualification.charge_rate * shift.total_shift_hours))
+            for item in self.random.sample(self.equipment_objs, min(2, len(self.equipment_objs))):
+                equipment.append(ShiftEquipment(shift=shift, equipment=item, count=1,
+                                                equipment_shift_charge=item.charge_rate,
+                                                equipment_cost=item.charge_rate))
+        ShiftQualification.objects.bulk_create(qualifications)
+        ShiftEquipment.objects.bulk_create(equipment)
+
+    def build_schedules(self):
+        schedules, timesheets = [], []
+        for shift in self.shift_objs:
+            for profile in self.random.sample(self.crew_profiles,
+                                              min(self.schedules_per_shift, len(self.crew_profiles))):
+                schedules.append(Schedule(shift=shift, crew=profile, is_scheduled=True,
+                                          is_accepted=self.random.random() < 0.7, is_rejected=False,
+                                          is_crew_chief=False))
+                if self.random.random() < self.timesheet_ratio:
+                    timesheets.append(TimeSheet(shift=shift, crew=profile, clock_in=shift.start_date,
+                                                clock_out=shift.end_date))
+        Schedule.objects.bulk_create(schedules)
+        TimeSheet.objects.bulk_create(timesheets)
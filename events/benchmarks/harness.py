@@ -0,0 +1,140 @@
+""" Endpoint benchmark harness for the events API.
+
+    Every endpoint is requested `repeat` times against a synthetic tenant,
+    recording query count, latency percentiles and peak Python memory.
+    Results are compared to `baselines/<size>.json`; more queries than the
+    baseline or latency/memory above `tolerance` times the baseline is a
+    regression. A metric left `null` in the baseline is not recorded yet and
+    is not compared, `--update-baseline` on the reference machine records it.
+"""
+import json
+import os
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from tenant_schemas.utils import schema_context
+
+from apps.accounts.models import User
+from apps.events.models import Event
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+
+
+def get_url_prefix():
+    return getattr(settings, 'EVENTS_BENCHMARK_URL_PREFIX', '/events/')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))]
+
+
+class EndpointBenchmark:
+
+    def __init__(self, tenant, repeat=10, tolerance=1.5):
+        self.tenant = tenant
+        self.repeat = repeat
+        self.tolerance = tolerance
+
+    def get_endpoints(self):
+        """ (name, user, path) of every benchmarked endpoint
+        """
+        prefix = get_url_prefix()
+        with schema_context(self.tenant.schema_name):
+            supplier = User.objects.filter(user_type=User.SUPPLIER).first()
+            crew = User.objects.filter(user_type=User.CREW_MEMBER, crewprofile__schedule__isnull=False).first()
+            event = Event.objects.order_by('id').first()
+        today = timezone.now().date()
+        month_start = today.replace(day=1)
+        month_end = month_start + timedelta(days=31)
+        calendar = "start_date={}&end_date={}".format(month_start, month_end)
+        return [
+            ('event-list', supplier, prefix + 'event/'),
+            ('event-list-lite', supplier, prefix + 'event/?lite=1'),
+            ('shift-list', supplier, prefix + 'shift/'),
+            ('shift-list-lite', supplier, prefix + 'shift/?lite=1'),
+            ('shift-list-sparse', supplier, prefix + 'shift/?fields=id,name,start_date,end_date,status'),
+            ('shift-schedule', supplier, prefix + 'shift-schedule/?event_id={}&tz_offset=UTC&{}'.format(
+                event.id if event else '', calendar)),
+            ('event-schedule', supplier, prefix + 'event-schedule/?' + calendar),
+            ('order-list', supplier, prefix + 'order/'),
+            ('crew-shift-list', crew, prefix + 'get-crew-shift-list/'),
+            ('crew-upcoming-shift', crew, prefix + 'get-upcoming-shift/'),
+            ('crew-all-upcoming-shift', crew, prefix + 'get-all-upcoming-shift/'),
+        ]
+
+    def measure(self, user, path):
+        client = APIClient(SERVER_NAME=self.tenant.domain_url)
+        client.force_authenticate(user)
+        latencies, queries, peak = [], 0, 0
+        for i in range(self.repeat):
+            tracemalloc.start()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(path)
+                latencies.append(time.perf_counter() - started)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            queries = max(queries, len(captured))
+        return {
+            'status': response.status_code,
+            'queries': queries,
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'max_ms': round(max(latencies) * 1000, 2),
+            'peak_kb': round(peak / 1024.0, 1),
+        }
+
+    def run(self):
+        results = {}
+        for name, user, path in self.get_endpoints():
+            if user is None:
+                continue
+            results[name] = self.measure(user, path)
+        return results
+
+    @staticmethod
+    def get_baseline_path(size):
+        return os.path.join(BASELINE_DIR, '{}.json'.format(size))
+
+    def load_baseline(self, size):
+        path = self.get_baseline_path(size)
+        if not os.path.exists(path):
+            raise LookupError("no baseline for {} ({})".format(size, path))
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+
+    def save_baseline(self, size, results):
+        with open(self.get_baseline_path(size), 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+
+    @staticmethod
+    def get_unrecorded(baseline, results):
+        """ names of the benchmarked endpoints the baseline has no numbers for
+        """
+        return sorted(name for name in results
+                      if not baseline.get(name) or baseline[name].get('queries') is None)
+
+    def compare(self, baseline, results):
+        """ returns a list of regression messages
+        """
+        regressions = []
+        for name, result in results.items():
+            expected = baseline.get(name)
+            if not expected:
+                continue
+            if expected['queries'] is not None and result['queries'] > expected['queries']:
+                regressions.append("{}: {} queries, baseline {}".format(
+                    name, result['queries'], expected['queries']))
+            for key in ('p95_ms', 'peak_kb'):
+                if expected[key] and result[key] > expected[key] * self.tolerance:
+                    regressions.append("{}: {} {}, baseline {} (tolerance x{})".format(
+                        name, key, result[key], expected[key], self.tolerance))
+        return regressions
@@ -0,0 +1,125 @@
+""" Copy of an event with its locations, shifts, shift qualifications,
+    equipment, skills and shift series, moved by a date offset.
+
+    Everything is written with `bulk_create` in one transaction, so none of
+    the per-row receivers run: the costs are copied (they do not depend on
+    the dates), the event cost and status are rolled up once and the search
+    vectors, map tiles and crew suggestions the receivers would maintain are
+    refreshed here.
+"""
+from django.db import transaction
+
+from apps.events.api.utils import get_event_status_from_shifts
+from apps.events.models import (Event, EventLocation, Shift, ShiftEquipment, ShiftQualification,
+                                ShiftRecurrence)
+from apps.events.recurrence import get_series_cost, shift_rule
+from apps.events.search import update_event_vector
+from apps.events.tiles import bump_tile_version
+
+BATCH_SIZE = 500
+
+
+def shift_date(value, offset):
+    return value + offset if value is not None else None
+
+
+def get_through_field(through, model):
+    return next(field.attname for field in through._meta.get_fields()
+                if field.is_relation and field.related_model is model)
+
+
+def clone_shifts(source, event, offset, status):
+    """ Copies of the shifts of `source` on `event`, the materialized
+        occurrences of a series are left to the copied series
+    """
+    shifts = list(Shift.objects.filter(event=source, series__isnull=True).exclude(
+        status__in=[Shift.CANCELLED, Shift.DELETED]).order_by('id'))
+    source_ids = [shift.id for shift in shifts]
+    for shift in shifts:
+        shift.pk = shift.id = None
+        shift.event = event
+        shift.start_date = shift_date(shift.start_date, offset)
+        shift.end_date = shift_date(shift.end_date, offset)
+        shift.status = status
+        shift.search_vector = None
+    Shift.objects.bulk_create(shifts, batch_size=BATCH_SIZE)
+    shift_ids = dict(zip(source_ids, [shift.id for shift in shifts]))
+
+    qualifications = list(ShiftQualification.objects.filter(shift__in=source_ids))
+    for qualification in qualifications:
+        qualification.pk = qualification.id = None
+        qualification.shift_id = shift_ids[qualification.shift_id]
+    ShiftQualification.objects.bulk_create(qualifications, batch_size=BATCH_SIZE)
+
+    equipments = list(ShiftEquipment.objects.filter(shift__in=source_ids))
+    for equipment in equipments:
+        equipment.pk = equipment.id = None
+        equipment.shift_id = shift_ids[equipment.shift_id]
+    ShiftEquipment.objects.bulk_create(equipments, batch_size=BATCH_SIZE)
+
+    through = Shift.skills.through
+    shift_field = get_through_field(through, Shift)
+    skill_field = get_through_field(through, Shift.skills.rel.related_model)
+    through.objects.bulk_create([
+        through(**{shift_field: shift_ids[shift_id], skill_field: skill_id})
+        for shift_id, skill_id in through.objects.filter(
+            **{shift_field + '__in': source_ids}).values_list(shift_field, skill_field)
+    ], batch_size=BATCH_SIZE)
+
+    # the daily `materialize_shift_recurrences` task creates the rows of the copied series
+    recurrences = list(ShiftRecurrence.objects.filter(template__in=source_ids).select_related('template'))
+    for recurrence in recurrences:
+        recurrence.rule = shift_rule(recurrence, offset)
+        recurrence.pk = recurrence.id = None
+        recurrence.template_id = shift_ids[recurrence.template_id]
+        recurrence.rdates = [rdate + offset for rdate in recurrence.rdates]
+        recurrence.exdates = [exdate + offset for exdate in recurrence.exdates]
+        recurrence.materialized_until = None
+    ShiftRecurrence.objects.bulk_create(recurrences, batch_size=BATCH_SIZE)
+    return shifts
+
+
+def clone_event(source, offset, status, name=None):
+    """ Copy of `source` moved by the `offset` timedelta, the copied shifts
+        start again from `status`
+    """
+    from apps.scheduler.tasks import delete_and_create_schedule
+    with transaction.atomic():
+        locations = list(source.location.all())
+        event = Event.objects.get(pk=source.pk)
+        event.pk = event.id = None
+        event.name = name or source.name
+        event.start_date = shift_date(source.start_date, offset)
+        event.end_date = shift_date(source.end_date, offset)
+        event.status = status
+        event.sub_total = 0
+        event.is_archived = False
+        event.search_vector = None
+        event.save()
+        event.location.set(locations)
+
+        event_locations = list(EventLocation.objects.filter(event=source))
+        for event_location in event_locations:
+            event_location.pk = event_location.id = None
+            event_location.event = event
+        EventLocation.objects.bulk_create(event_locations, batch_size=BATCH_SIZE)
+
+        shifts = clone_shifts(source, event, offset, status)
+
+        # the rollup `update_event_cost` and `update_event_status_from_shift` do per shift
+        event.series_cost = get_series_cost(event)
+        event.sub_total = sum(shift.total_shift_cost for shift in shifts) + event.series_cost
+        event.status = get_event_status_from_shifts({shift.status for shift in shifts}, event.status)
+        event.save()
+
+        update_event_vector(event)
+        shift_ids = [shift.id for shift in shifts]
+
+        def suggest_crew():
+            # what the `find_crew` receiver queues for every saved shift
+            for shift_id in shift_ids:
+                delete_and_create_schedule.apply_async(args=[shift_id])
+
+        transaction.on_commit(bump_tile_version)
+        transaction.on_commit(suggest_crew)
+    return event
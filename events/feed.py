@@ -0,0 +1,166 @@
+""" Maintenance of `CrewShiftFeed`, the per-crew shift rows read by the crew
+    mobile endpoints.
+
+    The rows of a shift are always rebuilt together from the shift, its
+    schedules, timesheets and qualifications, so a refresh is idempotent and
+    can be called from any signal or after a bulk `QuerySet.update()`.
+    Rows whose content really changed are appended to `CrewShiftChange`,
+    the log the crew delta sync API reads.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Sum
+
+from apps.accounts.models import UserQualification
+from apps.events.models import CrewShiftChange, CrewShiftFeed, Shift, ShiftQualification
+from apps.scheduler.models import Schedule
+from apps.timesheet.models import TimeSheet
+
+REBUILD_CHUNK_SIZE = 500
+
+# columns the crew clients see, a refresh leaving them unchanged is not logged
+SYNC_FIELDS = (
+    'name', 'event_name', 'location_name', 'start_date', 'end_date', 'total_shift_hours',
+    'status', 'is_scheduled', 'is_accepted', 'is_rejected', 'is_crew_chief', 'pay_rate',
+    'timesheet_id', 'clock_in', 'clock_out',
+)
+
+
+def log_changes(changes, action=CrewShiftChange.UPSERT):
+    """ :params: `changes` iterable of (crew_id, shift_id)
+    """
+    CrewShiftChange.objects.bulk_create([
+        CrewShiftChange(crew_id=crew_id, shift_id=shift_id, action=action)
+        for crew_id, shift_id in changes
+    ])
+
+
+def get_pay_rates(profile_ids, qualification_ids):
+    """ {profile_id: {qualification_id: summed base pay rate}}
+    """
+    pay_rates = defaultdict(dict)
+    for profile_id, qualification_id, pay_rate in UserQualification.objects.filter(
+            profile__in=profile_ids, qualification__in=qualification_ids).values(
+            'profile', 'qualification').annotate(pay_rate=Sum('base_pay_rate')).values_list(
+            'profile', 'qualification', 'pay_rate'):
+        pay_rates[profile_id][qualification_id] = pay_rate
+    return pay_rates
+
+
+def get_pay_rate(rates, qualification_ids):
+    # sum of the crew pay rates matching the shift, None when none match
+    matched = [rates[qualification] for qualification in qualification_ids if qualification in rates]
+    return sum(matched) if matched else None
+
+
+def build_feed_rows(shifts):
+    """ Unsaved feed rows of a list of shifts, in five queries
+    """
+    shift_ids = [shift.id for shift in shifts]
+    schedules = list(Schedule.objects.filter(shift__in=shift_ids))
+    shift_qualifications = defaultdict(set)
+    for shift_id, qualification_id in ShiftQualification.objects.filter(
+            shift__in=shift_ids).values_list('shift', 'qualification'):
+        shift_qualifications[shift_id].add(qualification_id)
+    pay_rates = get_pay_rates({schedule.crew_id for schedule in schedules},
+                              set().union(*shift_qualifications.values()))
+    timesheets = {(timesheet.shift_id, timesheet.crew_id): timesheet
+                  for timesheet in TimeSheet.objects.filter(shift__in=shift_ids)}
+    shifts = {shift.id: shift for shift in shifts}
+    rows = []
+    for schedule in schedules:
+        shift = shifts[schedule.shift_id]
+        timesheet = timesheets.get((shift.id, schedule.crew_id))
+        rows.append(CrewShiftFeed(
+            crew_id=schedule.crew_id,
+            shift=shift,
+            event=shift.event,
+            location=shift.location,
+            name=shift.name,
+            event_name=shift.event.name,
+            location_name=shift.location.name if shift.location else None,
+            start_date=shift.start_date,
+            end_date=shift.end_date,
+            total_shift_hours=shift.total_shift_hours,
+            status=shift.status,
+            is_scheduled=schedule.is_scheduled,
+            is_accepted=schedule.is_accepted,
+            is_rejected=schedule.is_rejected,
+            is_crew_chief=schedule.is_crew_chief,
+            pay_rate=get_pay_rate(pay_rates[schedule.crew_id], shift_qualifications[shift.id]),
+            timesheet_id=timesheet.id if timesheet else None,
+            clock_in=timesheet.clock_in if timesheet else None,
+            clock_out=timesheet.clock_out if timesheet else None,
+        ))
+    return rows
+
+
+def refresh_crew_shift_feed_for_shifts(shift_ids):
+    """ Rebuilds the feed rows of the given shifts, also used after bulk
+        `QuerySet.update()` calls that bypass the model signals
+    """
+    shift_ids = list(shift_ids)
+    if not shift_ids:
+        return
+    with transaction.atomic():
+        # the shift row lock serializes concurrent refreshes of the same shift
+        shifts = list(Shift.objects.select_for_update(of=('self',)).filter(
+            id__in=shift_ids).select_related('event', 'location').order_by('id'))
+        previous = {
+            (row['crew'], row['shift']): tuple(row[field] for field in SYNC_FIELDS)
+            for row in CrewShiftFeed.objects.filter(shift__in=shift_ids).values('crew', 'shift', *SYNC_FIELDS)
+        }
+        CrewShiftFeed.objects.filter(shift__in=shift_ids).delete()
+        rows = CrewShiftFeed.objects.bulk_create(build_feed_rows(shifts))
+        current = {(row.crew_id, row.shift_id): tuple(getattr(row, field) for field in SYNC_FIELDS)
+                   for row in rows}
+        log_changes(key for key, values in current.items() if previous.get(key) != values)
+        log_changes((key for key in previous if key not in current), CrewShiftChange.DELETE)
+
+
+def refresh_crew_shift_feed(shift_id):
+    refresh_crew_shift_feed_for_shifts([shift_id])
+
+
+def refresh_crew_pay_rates(profile_id):
+    """ Recomputes the pay rate of every feed row of a crew member
+    """
+    rows = list(CrewShiftFeed.objects.filter(crew_id=profile_id).only('id', 'crew', 'shift', 'pay_rate'))
+    shift_qualifications = defaultdict(set)
+    for shift_id, qualification_id in ShiftQualification.objects.filter(
+            shift__in=[row.shift_id for row in rows]).values_list('shift', 'qualification'):
+        shift_qualifications[shift_id].add(qualification_id)
+    rates = get_pay_rates([profile_id], set().union(*shift_qualifications.values()))[profile_id]
+    changed = []
+    for row in rows:
+        pay_rate = get_pay_rate(rates, shift_qualifications[row.shift_id])
+        if pay_rate != row.pay_rate:
+            CrewShiftFeed.objects.filter(id=row.id).update(pay_rate=pay_rate)
+            changed.append((row.crew_id, row.shift_id))
+    log_changes(changed)
+
+
+def rename_event_in_feed(event_id, name):
+    rows = CrewShiftFeed.objects.filter(event=event_id).exclude(event_name=name)
+    changed = list(rows.values_list('crew', 'shift'))
+    if changed:
+        rows.update(event_name=name)
+        log_changes(changed)
+
+
+def rebuild_crew_shift_feed(chunk_size=REBUILD_CHUNK_SIZE):
+    """ Backfill/repair of the whole feed of the current tenant, returns the
+        number of shifts refreshed. Only rows that differ are logged, so a
+        repair does not force the clients into a full resync.
+    """
+    refreshed = 0
+    last_id = 0
+    while True:
+        shift_ids = list(Shift.objects.filter(id__gt=last_id).order_by('id').values_list(
+            'id', flat=True)[:chunk_size])
+        if not shift_ids:
+            return refreshed
+        refresh_crew_shift_feed_for_shifts(shift_ids)
+        refreshed += len(shift_ids)
+        last_id = shift_ids[-1]
@@ -0,0 +1,138 @@
+""" Spatial queries over `EventLocation` and the shift locations.
+
+    Radius queries filter on `ST_DWithin` with a box in degrees that always
+    contains the radius (index scan), then on the exact spheroid distance.
+    Results are ordered with the KNN `<->` operator, so Postgres walks the
+    GiST index nearest first and stops at the limit: the cost depends on the
+    limit, not on the number of locations of the tenant.
+
+    The queries take the events/shifts the caller may see
+    (`apps.events.api.utils.get_visible_events`/`get_visible_shifts`).
+"""
+import math
+
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.gis.measure import D
+from django.db.models import Exists, F, FloatField, Func, OuterRef, Value
+
+from apps.common.models import Location
+from apps.events.models import EventLocation
+
+SRID = 4326
+METERS_PER_DEGREE = 111320.0
+
+
+class MakePoint(Func):
+    template = 'ST_SetSRID(ST_MakePoint(%(expressions)s), {})'.format(SRID)
+
+
+class KNNDistance(Func):
+    """ `<->` bounding box distance, only meant for ORDER BY
+    """
+    arg_joiner = ' <-> '
+    template = '%(expressions)s'
+    output_field = FloatField()
+
+    def __init__(self, field, point, **extra):
+        super().__init__(F(field), MakePoint(Value(point.x), Value(point.y)), **extra)
+
+
+def radius_in_degrees(point, radius):
+    # longitude degrees shrink with the latitude, take the widest
+    cos_lat = max(math.cos(math.radians(min(abs(point.y), 89.0))), 0.01)
+    return radius / (METERS_PER_DEGREE * cos_lat)
+
+
+def filter_area(queryset, field, point=None, radius=None, bbox=None):
+    if bbox is not None:
+        queryset = queryset.filter(**{field + '__contained': Polygon.from_bbox(bbox)})
+    if point is not None and radius is not None:
+        queryset = queryset.filter(**{
+            field + '__dwithin': (point, radius_in_degrees(point, radius)),
+            field + '__distance_lte': (point, D(m=radius)),
+        })
+    return queryset
+
+
+def get_center(point, bbox):
+    if point is not None:
+        return point
+    xmin, ymin, xmax, ymax = bbox
+    return Point((xmin + xmax) / 2.0, (ymin + ymax) / 2.0, srid=SRID)
+
+
+def nearby_event_locations(events, point=None, radius=None, bbox=None, start=None, end=None, statuses=None,
+                           limit=50):
+    """ Locations of `events` in the area sorted by distance to `point` (or
+        the bbox center), as dicts
+    """
+    center = get_center(point, bbox)
+    queryset = filter_area(EventLocation.objects.filter(event__in=events), 'coordinates', point, radius, bbox)
+    if start is not None:
+        queryset = queryset.filter(event__end_date__gte=start)
+    if end is not None:
+        queryset = queryset.filter(event__start_date__lte=end)
+    if statuses:
+        queryset = queryset.filter(event__status__in=statuses)
+    rows = queryset.annotate(distance=Distance('coordinates', center)).order_by(
+        KNNDistance('coordinates', center)).values(
+        'id', 'location_name', 'coordinates', 'distance', 'event', 'event__name', 'event__status',
+        'event__start_date', 'event__end_date')[:limit]
+    return [{
+        'id': row['event'],
+        'name': row['event__name'],
+        'status': row['event__status'],
+        'start_date': row['event__start_date'],
+        'end_date': row['event__end_date'],
+        'event_location': row['id'],
+        'location_name': row['location_name'],
+        'lng': row['coordinates'].x,
+        'lat': row['coordinates'].y,
+        'distance': round(row['distance'].m, 1),
+    } for row in rows]
+
+
+def nearby_shifts(shifts, point=None, radius=None, bbox=None, start=None, end=None, statuses=None, limit=50):
+    """ Matching `shifts` at the `limit` nearest locations in the area, sorted
+        by distance. The KNN scan runs on the locations having a matching
+        shift (semi-join), so the limit is not used up by locations whose
+        shifts are all filtered out.
+    """
+    center = get_center(point, bbox)
+    if start is not None:
+        shifts = shifts.filter(end_date__gte=start)
+    if end is not None:
+        shifts = shifts.filter(start_date__lte=end)
+    if statuses:
+        shifts = shifts.filter(status__in=statuses)
+    locations = Location.objects.annotate(
+        has_shifts=Exists(shifts.filter(location=OuterRef('pk')))).filter(has_shifts=True)
+    locations = {
+        row['id']: row for row in filter_area(locations, 'coordinates', point, radius, bbox).annotate(
+            distance=Distance('coordinates', center)).order_by(KNNDistance('coordinates', center)).values(
+            'id', 'name', 'coordinates', 'distance')[:limit]
+    }
+    if not locations:
+        return []
+    queryset = shifts.filter(location__in=list(locations))
+    shifts = []
+    for row in queryset.values('id', 'name', 'status', 'start_date', 'end_date', 'location', 'event',
+                               'event__name'):
+        location = locations[row['location']]
+        shifts.append({
+            'id': row['id'],
+            'name': row['name'],
+            'status': row['status'],
+            'start_date': row['start_date'],
+            'end_date': row['end_date'],
+            'event': row['event'],
+            'event_name': row['event__name'],
+            'location': row['location'],
+            'location_name': location['name'],
+            'lng': location['coordinates'].x,
+            'lat': location['coordinates'].y,
+            'distance': round(location['distance'].m, 1),
+        })
+    shifts.sort(key=lambda shift: (shift['distance'], shift['id']))
+    return shifts[:limit]
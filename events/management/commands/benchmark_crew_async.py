@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from apps.events.benchmarks.concurrency import ConcurrencyBenchmark
+from apps.events.benchmarks.generator import SIZES, SyntheticTenant
+
+
+class Command(BaseCommand):
+    help = "Compare requests/second of the sync and async crew shift endpoints on a synthetic tenant"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', default='small', choices=sorted(SIZES))
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=4, help="sync worker threads")
+        parser.add_argument('--concurrency', type=int, default=100, help="async pollers in flight")
+
+    def handle(self, *args, **options):
+        size = options['size']
+        tenant = SyntheticTenant('benchmark_{}'.format(size), **SIZES[size]).build()
+        benchmark = ConcurrencyBenchmark(tenant, requests=options['requests'], workers=options['workers'],
+                                         concurrency=options['concurrency'])
+        for name, result in sorted(benchmark.run().items()):
+            for mode in ('sync', 'async'):
+                self.stdout.write("{:<25} {:<6} {}".format(name, mode, " ".join(
+                    "{}={}".format(key, value) for key, value in sorted(result[mode].items()))))
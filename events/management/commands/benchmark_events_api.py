@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.events.benchmarks.generator import SIZES, SyntheticTenant
+from apps.events.benchmarks.harness import EndpointBenchmark
+
+
+class Command(BaseCommand):
+    help = "Benchmark the events API endpoints on synthetic tenants and compare with the baselines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', default=['small', 'medium'], choices=sorted(SIZES))
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--tolerance', type=float, default=1.5,
+                            help="allowed latency/memory factor over the baseline")
+        parser.add_argument('--update-baseline', action='store_true')
+
+    def handle(self, *args, **options):
+        regressions = []
+        for size in options['sizes']:
+            tenant = SyntheticTenant('benchmark_{}'.format(size), **SIZES[size]).build()
+            benchmark = EndpointBenchmark(tenant, repeat=options['repeat'], tolerance=options['tolerance'])
+            results = benchmark.run()
+            self.stdout.write("== {} ==".format(size))
+            for name, result in sorted(results.items()):
+                self.stdout.write("{:<25} {}".format(name, " ".join(
+                    "{}={}".format(key, value) for key, value in sorted(result.items()))))
+            if options['update_baseline']:
+                benchmark.save_baseline(size, results)
+                self.stdout.write("baseline {} written".format(size))
+                continue
+            try:
+                baseline = benchmark.load_baseline(size)
+            except LookupError as e:
+                raise CommandError("{}, run with --update-baseline to record it".format(e))
+            unrecorded = benchmark.get_unrecorded(baseline, results)
+            if unrecorded:
+                self.stdout.write("baseline {} not recorded for: {}".format(size, ", ".join(unrecorded)))
+            regressions += ["[{}] {}".format(size, message) for message in benchmark.compare(baseline, results)]
+        if regressions:
+            raise CommandError("Performance regressions:\n" + "\n".join(regressions))
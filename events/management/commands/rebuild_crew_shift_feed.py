@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.events.feed import rebuild_crew_shift_feed
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the crew shift feed of the current tenant from shifts, schedules and timesheets"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        refreshed = rebuild_crew_shift_feed(options['chunk_size'])
+        self.stdout.write("{}: feed of {} shifts refreshed".format(connection.schema_name, refreshed))
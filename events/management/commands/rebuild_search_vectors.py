@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.events.search import rebuild_search_vectors
+
+
+class Command(BaseCommand):
+    help = "Recomputes the search vectors of events, shifts and quick quotes of the current tenant"
+
+    def handle(self, *args, **options):
+        rebuild_search_vectors()
+        self.stdout.write("{}: search vectors rebuilt".format(connection.schema_name))
@@ -1,8 +1,14 @@
 import reversion
 import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
 from django.contrib.gis.db.models import PointField
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models, transaction
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.db.models import Manager as GeoManager
 from django.db.models import Sum, F, FloatField
 from django.core import serializers
@@ -61,6 +67,8 @@ class Event(CrewAppBaseModel):
         verbose_name="End Date/Time", null=True, blank=True)
     location = models.ManyToManyField(Location, blank=True)
     sub_total = models.FloatField(verbose_name=_("Sub total"), default=0)
+    # cost of the shift series occurrences not materialized yet, part of `sub_total`
+    series_cost = models.FloatField(default=0, editable=False)
     total_cost = models.FloatField(verbose_name=_("Cost/Budget"), default=0)
     comments = models.TextField(verbose_name="Comments", null=True, blank=True)
     po_number = models.CharField(max_length=255, verbose_name=_(
@@ -70,16 +78,37 @@ class Event(CrewAppBaseModel):
     discount = models.FloatField(_("Discount"), default=0.00)
     tax_percentage = models.FloatField(_("Tax Percentage"), default=0.00)
     is_archived = models.BooleanField(_("Archived"), default=False)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     objects = EventManager()
 
+    class Meta(CrewAppBaseModel.Meta):
+        indexes = [
+            GinIndex(fields=['search_vector'], name='event_search_vector'),
+            GinIndex(fields=['name'], name='event_name_trgm', opclasses=['gin_trgm_ops']),
+        ]
+
+    # fields the post_save receivers compare with their loaded value
+    TRACKED_FIELDS = ('name', 'status', 'is_archived', 'client_id')
+    __original = None
+
+    def __init__(self, *args, **kwargs):
+        super(Event, self).__init__(*args, **kwargs)
+        # read from __dict__, deferred fields are not loaded for this
+        self.__original = {field: self.__dict__.get(field) for field in self.TRACKED_FIELDS}
+
     def __str__(self):
         return self.name
 
+    def has_changed(self, field):
+        return self.__original[field] != getattr(self, field)
+
     def save(self, *args, **kwargs):
         self.total_cost = float(self.sub_total) - float(self.discount) + \
             float(float(self.sub_total) * float(self.tax_percentage / 100))
         super().save(*args, **kwargs)
+        # post_save receivers have seen `has_changed()` by now
+        self.__original = {field: getattr(self, field) for field in self.TRACKED_FIELDS}
 
 
 @reversion.register()
@@ -140,18 +169,35 @@ class Shift(CrewAppBaseModel):
     equipment_charges = models.FloatField(default=0.00)
     total_shift_cost = models.FloatField(default=0.00)
     no_of_crew_chiefs = models.PositiveIntegerField(default=0)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # set on the shifts materialized from a `ShiftRecurrence`
+    series = models.ForeignKey('ShiftRecurrence', null=True, blank=True, editable=False,
+                               related_name='occurrences', on_delete=models.SET_NULL)
+    series_start = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta(CrewAppBaseModel.Meta):
+        unique_together = (('series', 'series_start'), )
+        indexes = [
+            GinIndex(fields=['search_vector'], name='shift_search_vector'),
+            GinIndex(fields=['name'], name='shift_name_trgm', opclasses=['gin_trgm_ops']),
+        ]
 
     __original_location = None
     __original_no_of_resources = None
+    __original_crew_manager_id = None
 
     def __init__(self, *args, **kwargs):
         super(Shift, self).__init__(*args, **kwargs)
         self.__original_location = self.location
         self.__original_no_of_resources = self.no_of_resources
+        self.__original_crew_manager_id = self.__dict__.get('crew_manager_id')
 
     def __str__(self):
         return self.name
 
+    def has_crew_manager_changed(self):
+        return self.__original_crew_manager_id != self.crew_manager_id
+
     def qualification_cost(self, *args, **kwargs):
         cost = self.qualification.all().aggregate(
             Sum('charge_rate'))['charge_rate__sum']
@@ -200,15 +246,94 @@ class Shift(CrewAppBaseModel):
             self.travel_expenses = distance_in_km * \
                 self.distance_rate * self.no_of_resources
         super().save(*args, **kwargs)
+        # post_save receivers have seen `has_crew_manager_changed()` by now
+        self.__original_crew_manager_id = self.crew_manager_id
+
+
+@reversion.register()
+class ShiftRecurrence(CrewAppBaseModel):
+    """ Repeats a template shift at the starts of an RFC 5545 `rule` plus the
+        `rdates`, less the `exdates`. The rule is expanded in `timezone`, so
+        occurrences keep their wall clock time across DST changes.
+        Occurrences are `Shift` rows (`series`/`series_start`) only once
+        materialized, see `apps.events.recurrence`. The event cost counts the
+        occurrences not materialized yet at the cost of the template
+        (`Event.series_cost`, expanded again only when a series changes).
+    """
+    template = models.OneToOneField(Shift, related_name='recurrence', on_delete=models.CASCADE)
+    rule = models.CharField(_("Recurrence Rule"), max_length=255, blank=True, default='')
+    rdates = ArrayField(models.DateTimeField(), blank=True, default=list)
+    exdates = ArrayField(models.DateTimeField(), blank=True, default=list)
+    timezone = models.CharField(max_length=64, default=settings.TIME_ZONE)
+    # occurrences before this are materialized
+    materialized_until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.template}: {self.rule}'
+
+
+_deferred_event_costs = ContextVar('deferred_event_costs', default=None)
+
+
+@contextmanager
+def defer_event_cost(*event_ids, series=False):
+    """ The cost of the events of the shifts saved or deleted in the block
+        (and of `event_ids`) is rolled up once, when the block exits.
+        `series`: the shift series of `event_ids` changed, their cost is
+        expanded again
+    """
+    deferred = _deferred_event_costs.get()
+    if deferred is not None:
+        for event_id in event_ids:
+            deferred[event_id] = deferred.get(event_id, False) or series
+        yield
+        return
+    token = _deferred_event_costs.set(dict.fromkeys(event_ids, series))
+    try:
+        yield
+        deferred = _deferred_event_costs.get()
+    finally:
+        _deferred_event_costs.reset(token)
+    for event in Event.objects.filter(id__in=deferred):
+        roll_up_event_cost(event, series=deferred[event.id])
+
+
+def roll_up_event_cost(event, series=False):
+    """ `sub_total` of the event: its shifts plus the stored `series_cost`,
+        the series are expanded again only when `series` is set
+    """
+    if series:
+        from .recurrence import get_series_cost
+        event.series_cost = get_series_cost(event)
+    event.sub_total = (Shift.objects.filter(event=event).aggregate(
+        Sum('total_shift_cost'))['total_shift_cost__sum'] or 0) + event.series_cost
+    event.save()
+
+
+def update_cost_of_event(event_id, series=False):
+    deferred = _deferred_event_costs.get()
+    if deferred is not None:
+        deferred[event_id] = deferred.get(event_id, False) or series
+        return
+    event = Event.objects.filter(id=event_id).first()
+    if event is not None:
+        roll_up_event_cost(event, series=series)
 
 
 @receiver(post_delete, sender=Shift, dispatch_uid="update_event_cost")
 @receiver(post_save, sender=Shift, dispatch_uid="update_event_cost")
 def update_event_cost(sender, instance, **kwargs):
-    event = instance.event
-    event.sub_total = Shift.objects.filter(event=event).aggregate(
-        Sum('total_shift_cost'))['total_shift_cost__sum']
-    event.save()
+    # the cost and start of a template drive the cost of its series
+    series = instance.series_id is None and ShiftRecurrence.objects.filter(template_id=instance.pk).exists()
+    update_cost_of_event(instance.event_id, series=series)
+
+
+@receiver(post_delete, sender=ShiftRecurrence, dispatch_uid="update_event_series_cost")
+@receiver(post_save, sender=ShiftRecurrence, dispatch_uid="update_event_series_cost")
+def update_event_series_cost(sender, instance, **kwargs):
+    event_id = Shift.objects.filter(id=instance.template_id).values_list('event', flat=True).first()
+    if event_id is not None:
+        update_cost_of_event(event_id, series=True)
 
 
 @reversion.register()
@@ -315,3 +440,180 @@ class QuickQuote(CrewAppBaseModel):
     phone = models.CharField(max_length=30, verbose_name=_('Phone Number'))
     event_details = models.TextField(null=True, blank=True, verbose_name=_('Event Details')
                                      )
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta(CrewAppBaseModel.Meta):
+        indexes = [
+            GinIndex(fields=['search_vector'], name='quick_quote_search_vector'),
+            GinIndex(fields=['first_name', 'last_name'], name='quick_quote_name_trgm',
+                     opclasses=['gin_trgm_ops', 'gin_trgm_ops']),
+            GinIndex(fields=['phone'], name='quick_quote_phone_trgm', opclasses=['gin_trgm_ops']),
+            # the 'simple' parser keeps an email as one token, a typed email
+            # only matches by similarity
+            GinIndex(fields=['email'], name='quick_quote_email_trgm', opclasses=['gin_trgm_ops']),
+        ]
+
+
+@receiver(post_save, sender=Event, dispatch_uid="update_event_search_vector")
+def update_event_search_vector(sender, instance, created, **kwargs):
+    from .search import update_event_vector
+    # the shift vectors embed the event name
+    update_event_vector(instance, with_shifts=not created and instance.has_changed('name'))
+
+
+@receiver(post_save, sender=Shift, dispatch_uid="update_shift_search_vector")
+def update_shift_search_vector(sender, instance, **kwargs):
+    from .search import update_shift_vector
+    update_shift_vector(instance)
+
+
+@receiver(post_save, sender=QuickQuote, dispatch_uid="update_quick_quote_search_vector")
+def update_quick_quote_search_vector(sender, instance, **kwargs):
+    from .search import update_quick_quote_vector
+    update_quick_quote_vector(instance)
+
+
+class CrewShiftFeed(CrewAppBaseModel):
+    """ Materialized row per (crew, shift) the crew is scheduled for, read by
+        the crew mobile endpoints with one range scan on (crew, start_date).
+        Maintained by `apps.events.feed` from Shift, Schedule, TimeSheet and
+        qualification changes, never written by the API.
+    """
+    crew = models.ForeignKey(CrewProfile, on_delete=models.CASCADE, related_name='shift_feed')
+    shift = models.ForeignKey(Shift, on_delete=models.CASCADE, related_name='crew_feed')
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='crew_feed')
+    location = models.ForeignKey(Location, null=True, blank=True, on_delete=models.SET_NULL,
+                                 related_name='crew_feed')
+    name = models.CharField(max_length=255)
+    event_name = models.CharField(max_length=255)
+    location_name = models.CharField(max_length=255, null=True, blank=True)
+    start_date = models.DateTimeField(null=True, blank=True)
+    end_date = models.DateTimeField(null=True, blank=True)
+    total_shift_hours = models.FloatField(default=0.00)
+    status = models.IntegerField(default=Shift.ESTIMATION, choices=Shift.STATUS)
+    is_scheduled = models.BooleanField(default=False)
+    is_accepted = models.BooleanField(default=False)
+    is_rejected = models.BooleanField(default=False)
+    is_crew_chief = models.BooleanField(default=False)
+    pay_rate = models.FloatField(null=True, blank=True)
+    timesheet_id = models.IntegerField(null=True, blank=True)
+    clock_in = models.DateTimeField(null=True, blank=True)
+    clock_out = models.DateTimeField(null=True, blank=True)
+
+    class Meta(CrewAppBaseModel.Meta):
+        unique_together = ('crew', 'shift')
+        indexes = [
+            models.Index(fields=['crew', 'start_date']),
+        ]
+
+    def __str__(self):
+        return f'crew:{self.crew_id}, shift:{self.shift_id}'
+
+    @property
+    def cost(self):
+        if self.pay_rate is None:
+            return 0
+        return self.pay_rate * self.total_shift_hours
+
+
+def _refresh_feed_on_commit(shift_id):
+    from .feed import refresh_crew_shift_feed
+    transaction.on_commit(lambda: refresh_crew_shift_feed(shift_id))
+
+
+@receiver(post_save, sender=Shift, dispatch_uid="refresh_crew_shift_feed")
+def refresh_feed_from_shift(sender, instance, **kwargs):
+    _refresh_feed_on_commit(instance.id)
+
+
+@receiver(post_delete, sender=ShiftQualification, dispatch_uid="refresh_crew_shift_feed_qualification")
+@receiver(post_save, sender=ShiftQualification, dispatch_uid="refresh_crew_shift_feed_qualification")
+def refresh_feed_from_shift_qualification(sender, instance, **kwargs):
+    _refresh_feed_on_commit(instance.shift_id)
+
+
+@receiver(post_delete, sender='scheduler.Schedule', dispatch_uid="refresh_crew_shift_feed_schedule")
+@receiver(post_save, sender='scheduler.Schedule', dispatch_uid="refresh_crew_shift_feed_schedule")
+def refresh_feed_from_schedule(sender, instance, **kwargs):
+    _refresh_feed_on_commit(instance.shift_id)
+
+
+@receiver(post_delete, sender='timesheet.TimeSheet', dispatch_uid="refresh_crew_shift_feed_timesheet")
+@receiver(post_save, sender='timesheet.TimeSheet', dispatch_uid="refresh_crew_shift_feed_timesheet")
+def refresh_feed_from_timesheet(sender, instance, **kwargs):
+    _refresh_feed_on_commit(instance.shift_id)
+
+
+@receiver(post_delete, sender=UserQualification, dispatch_uid="refresh_crew_shift_feed_pay")
+@receiver(post_save, sender=UserQualification, dispatch_uid="refresh_crew_shift_feed_pay")
+def refresh_feed_from_user_qualification(sender, instance, **kwargs):
+    from .feed import refresh_crew_pay_rates
+    profile_id = instance.profile_id
+    transaction.on_commit(lambda: refresh_crew_pay_rates(profile_id))
+
+
+@receiver(post_save, sender=Event, dispatch_uid="refresh_crew_shift_feed_event")
+def refresh_feed_from_event(sender, instance, **kwargs):
+    from .feed import rename_event_in_feed
+    rename_event_in_feed(instance.id, instance.name)
+
+
+class CrewShiftChange(models.Model):
+    """ Append-only log of `CrewShiftFeed` changes, the id is the sync cursor
+        of the crew delta sync API.
+    """
+    UPSERT = 1
+    DELETE = 2
+
+    ACTIONS = (
+        (UPSERT, _('Upsert')),
+        (DELETE, _('Delete')),
+    )
+    id = models.BigAutoField(primary_key=True)
+    crew = models.ForeignKey(CrewProfile, on_delete=models.CASCADE, related_name='shift_changes')
+    shift_id = models.IntegerField()
+    action = models.PositiveSmallIntegerField(choices=ACTIONS, default=UPSERT)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['crew', 'id']),
+        ]
+
+    def __str__(self):
+        return f'crew:{self.crew_id}, shift:{self.shift_id}, action:{self.action}'
+
+
+@receiver(pre_delete, sender=Shift, dispatch_uid="log_crew_shift_feed_delete")
+def log_feed_delete_from_shift(sender, instance, **kwargs):
+    # the feed rows are deleted by the cascade, no refresh would see them go
+    from .feed import log_changes
+    crew_ids = CrewShiftFeed.objects.filter(shift=instance).values_list('crew', flat=True)
+    log_changes(((crew_id, instance.id) for crew_id in crew_ids), CrewShiftChange.DELETE)
+
+
+def _bump_tiles_on_commit():
+    from .tiles import bump_tile_version
+    transaction.on_commit(bump_tile_version)
+
+
+@receiver(post_delete, sender=EventLocation, dispatch_uid="bump_event_tiles_location")
+@receiver(post_save, sender=EventLocation, dispatch_uid="bump_event_tiles_location")
+def bump_tiles_from_event_location(sender, instance, **kwargs):
+    _bump_tiles_on_commit()
+
+
+@receiver(post_save, sender=Event, dispatch_uid="bump_event_tiles_event")
+def bump_tiles_from_event(sender, instance, created, **kwargs):
+    # new events have no location yet, deleted ones cascade to their locations
+    if not created and any(instance.has_changed(field) for field in ('status', 'is_archived', 'client_id')):
+        _bump_tiles_on_commit()
+
+
+@receiver(post_delete, sender=Shift, dispatch_uid="bump_event_tiles_shift")
+@receiver(post_save, sender=Shift, dispatch_uid="bump_event_tiles_shift")
+def bump_tiles_from_shift(sender, instance, **kwargs):
+    # a Crew Manager sees the events of the shifts they manage on the map
+    added_or_removed = kwargs.get('created', True) and instance.crew_manager_id is not None
+    if added_or_removed or instance.has_crew_manager_changed():
+        _bump_tiles_on_commit()
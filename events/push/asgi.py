@@ -0,0 +1,150 @@
+""" Server-sent events stream of the push notifications.
+
+    A client gets a short lived token from `events/push-token/` (regular DRF
+    auth) and opens `GET /events/push/?token=<token>` with an EventSource.
+    The stream carries `data: <json>` messages of its user and role channels
+    and a comment line every `EVENTS_PUSH_HEARTBEAT` seconds.
+
+    Each process holds one broker subscription, fanned out by `PushHub` to
+    one bounded asyncio queue per connection, so an idle connection costs a
+    pending coroutine and no thread. Mount it in front of Django in the
+    project asgi.py; Django before 3.0 has no ASGI handler, its WSGI
+    application is wrapped with `asgiref` (a separate install there):
+
+        from asgiref.wsgi import WsgiToAsgi
+        application = PushRouter(WsgiToAsgi(get_wsgi_application()))
+
+    (`PushRouter(get_asgi_application())` once on Django 3.0+).
+"""
+import asyncio
+import json
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+from .broker import get_pubsub, role_channel, user_channel
+from .tokens import read_push_token
+
+PUSH_PATH = '/events/push/'
+RESYNC_MESSAGE = json.dumps({'type': 'resync'})
+
+
+class PushHub:
+    """ Routes broker messages to the queues of the connections subscribed to
+        their channel. Broker callbacks may come from any thread.
+    """
+
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size
+        self.subscribers = defaultdict(set)
+        self.loop = None
+        self.stop_listening = None
+
+    def start(self, loop):
+        if self.loop is None:
+            self.loop = loop
+            self.stop_listening = get_pubsub().listen(self.on_message)
+
+    def stop(self):
+        if self.stop_listening is not None:
+            self.stop_listening()
+        self.loop = self.stop_listening = None
+
+    def on_message(self, channel, data):
+        # most messages have no local subscriber, skip the loop hop for them
+        if channel in self.subscribers and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.dispatch, channel, data)
+
+    def dispatch(self, channel, data):
+        for queue in list(self.subscribers.get(channel, ())):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                # a slow client lost messages, it re-syncs instead
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC_MESSAGE)
+
+    def subscribe(self, channels):
+        queue = asyncio.Queue(self.queue_size or getattr(settings, 'EVENTS_PUSH_QUEUE_SIZE', 100))
+        for channel in channels:
+            self.subscribers[channel].add(queue)
+        return queue
+
+    def unsubscribe(self, channels, queue):
+        for channel in channels:
+            subscribers = self.subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self.subscribers[channel]
+
+
+hub = PushHub()
+
+
+async def send_text(send, status, text):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+    await send({'type': 'http.response.body', 'body': text.encode('utf-8')})
+
+
+async def wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+    if scope['method'] != 'GET':
+        return await send_text(send, 405, 'Method Not Allowed')
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    claims = read_push_token(query.get('token', [''])[0])
+    if claims is None:
+        return await send_text(send, 403, 'Forbidden')
+    channels = [user_channel(claims['schema'], claims['user']),
+                role_channel(claims['schema'], claims['role'])]
+    hub.start(asyncio.get_running_loop())
+    queue = hub.subscribe(channels)
+    heartbeat = getattr(settings, 'EVENTS_PUSH_HEARTBEAT', 25)
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+        while True:
+            message = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({message, disconnected}, timeout=heartbeat,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if message in done:
+                body = 'data: {}\n\n'.format(message.result())
+            else:
+                message.cancel()
+                if disconnected in done:
+                    break
+                body = ': ping\n\n'
+            await send({'type': 'http.response.body', 'body': body.encode('utf-8'), 'more_body': True})
+    finally:
+        hub.unsubscribe(channels, queue)
+        disconnected.cancel()
+
+
+class PushRouter:
+    """ Serves `PUSH_PATH` with the push stream and everything else with the
+        wrapped (Django) ASGI application
+    """
+
+    def __init__(self, django_application):
+        self.django_application = django_application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == PUSH_PATH:
+            return await application(scope, receive, send)
+        return await self.django_application(scope, receive, send)
@@ -0,0 +1,111 @@
+""" Pub/sub transport of the push notifications.
+
+    `RedisPubSub` is used when `EVENTS_PUSH_REDIS_URL` is set, otherwise
+    `LocalPubSub` delivers in-process (tests, single process dev servers).
+    Messages are JSON objects published on `events:<schema>:user:<id>` and
+    `events:<schema>:role:<user_type>` channels.
+"""
+import json
+import logging
+import threading
+
+from django.conf import settings
+
+try:
+    import redis
+except ImportError:  # only needed with EVENTS_PUSH_REDIS_URL
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'events'
+
+
+def user_channel(schema_name, user_id):
+    return '{}:{}:user:{}'.format(CHANNEL_PREFIX, schema_name, user_id)
+
+
+def role_channel(schema_name, user_type):
+    return '{}:{}:role:{}'.format(CHANNEL_PREFIX, schema_name, user_type)
+
+
+class LocalPubSub:
+    """ In-process stand-in of the broker, listeners are called synchronously
+        on publish.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.published = []
+
+    def publish(self, channel, message):
+        data = json.dumps(message)
+        with self.lock:
+            self.published.append((channel, data))
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(channel, data)
+
+    def listen(self, callback):
+        with self.lock:
+            self.listeners.append(callback)
+        return lambda: self.listeners.remove(callback)
+
+
+class RedisPubSub:
+    """ One pattern subscription per process, read on a daemon thread and
+        handed to `callback(channel, data)`.
+    """
+
+    def __init__(self, url):
+        if redis is None:
+            raise ImportError("EVENTS_PUSH_REDIS_URL requires the redis package")
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, channel, message):
+        self.client.publish(channel, json.dumps(message))
+
+    def listen(self, callback):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(CHANNEL_PREFIX + ':*')
+        stopped = threading.Event()
+
+        def run():
+            while not stopped.is_set():
+                try:
+                    message = pubsub.get_message(timeout=1.0)
+                except redis.RedisError:
+                    logger.exception("push subscription lost, resubscribing")
+                    stopped.wait(1.0)
+                    continue
+                if message and message['type'] == 'pmessage':
+                    callback(message['channel'].decode('utf-8'), message['data'].decode('utf-8'))
+
+        threading.Thread(target=run, daemon=True, name='events-push-listener').start()
+
+        def stop():
+            stopped.set()
+            pubsub.close()
+        return stop
+
+
+_pubsub = None
+_pubsub_lock = threading.Lock()
+
+
+def get_pubsub():
+    global _pubsub
+    with _pubsub_lock:
+        if _pubsub is None:
+            url = getattr(settings, 'EVENTS_PUSH_REDIS_URL', None)
+            _pubsub = RedisPubSub(url) if url else LocalPubSub()
+        return _pubsub
+
+
+def set_pubsub(pubsub):
+    """ Swaps the broker, e.g. a fresh `LocalPubSub` per test
+    """
+    global _pubsub
+    with _pubsub_lock:
+        _pubsub = pubsub
@@ -0,0 +1,60 @@
+""" Push notifications of shift and event status changes.
+
+    Called from the status views; the message is published once the
+    transaction commits, so a client never re-fetches data that is not
+    visible yet.
+"""
+from django.db import connection, transaction
+
+from apps.accounts.models import User
+from apps.events.models import Event, Shift
+from apps.scheduler.models import Schedule
+
+from .broker import get_pubsub, role_channel, user_channel
+
+# roles that see every event of the tenant, crew managers only see the
+# shifts they manage (`get_visible_shifts`) and are reached on their own channel
+STAFF_ROLES = (User.SUPPLIER, User.ASSOCIATE_USER)
+
+
+def get_channels(schema_name, event_id, shift_ids=None):
+    """ Staff role channels, the event client, the crew managers of the
+        shifts and the crew scheduled on them (all shifts of the event when
+        `shift_ids` is None)
+    """
+    schedules = Schedule.objects.filter(is_scheduled=True)
+    shifts = Shift.objects.filter(crew_manager__isnull=False)
+    if shift_ids is None:
+        schedules = schedules.filter(shift__event=event_id)
+        shifts = shifts.filter(event=event_id)
+    else:
+        schedules = schedules.filter(shift__in=shift_ids)
+        shifts = shifts.filter(id__in=shift_ids)
+    user_ids = set(schedules.values_list('crew__user', flat=True))
+    user_ids.update(shifts.values_list('crew_manager__user', flat=True))
+    user_ids.update(Event.objects.filter(id=event_id).values_list('client__user', flat=True))
+    channels = [role_channel(schema_name, role) for role in STAFF_ROLES]
+    channels += [user_channel(schema_name, user_id) for user_id in user_ids if user_id]
+    return channels
+
+
+def publish_on_commit(message, event_id, shift_ids=None):
+    schema_name = connection.schema_name
+
+    def publish():
+        pubsub = get_pubsub()
+        for channel in get_channels(schema_name, event_id, shift_ids):
+            pubsub.publish(channel, message)
+    transaction.on_commit(publish)
+
+
+def publish_shift_status(event_id, shift_ids, status):
+    shift_ids = list(shift_ids)
+    if shift_ids:
+        publish_on_commit({'type': 'shift_status', 'event': int(event_id), 'shifts': shift_ids,
+                           'status': int(status)}, event_id, shift_ids)
+
+
+def publish_event_status(event_id, status, shift_ids=()):
+    publish_on_commit({'type': 'event_status', 'event': int(event_id), 'status': int(status),
+                       'shifts': list(shift_ids)}, event_id)
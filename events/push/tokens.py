@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core import signing
+
+TOKEN_SALT = 'events.push'
+
+
+def make_push_token(user, schema_name):
+    return signing.dumps({'user': user.id, 'role': user.user_type, 'schema': schema_name}, salt=TOKEN_SALT)
+
+
+def read_push_token(token):
+    """ `{user, role, schema}` of a token, None when invalid or expired.
+        Tokens only open the stream, an open stream is not re-checked.
+    """
+    try:
+        return signing.loads(token, salt=TOKEN_SALT,
+                             max_age=getattr(settings, 'EVENTS_PUSH_TOKEN_MAX_AGE', 300))
+    except signing.BadSignature:
+        return None
@@ -0,0 +1,275 @@
+""" Recurring shifts.
+
+    A `ShiftRecurrence` repeats its template shift. Its occurrences are
+    expanded on read (`get_occurrences`) and become `Shift` rows, with the
+    qualifications, equipment and skills of the template, only within the
+    rolling `EVENTS_RECURRENCE_HORIZON_DAYS` (`materialize_recurrence`, run by
+    the `materialize_shift_recurrences` task) or when one occurrence is needed
+    as a row, e.g. to schedule crew on it (`materialize_occurrence`).
+
+    Editing the series is an update of the recurrence or the template,
+    `reset_recurrence` then replaces only the materialized occurrences that
+    have no crew scheduled yet.
+
+    The cost of the occurrences not materialized yet is the cost of the
+    template times their number up to the end of the event
+    (`get_series_cost`), so the event cost covers the whole series. It is
+    stored as `Event.series_cost` when a series, its template or its
+    materialization changes, saving another shift does not expand the rules.
+
+    Only the shift schedule (`ShiftScheduleViewSet`) lists the occurrences
+    not materialized yet. The shift list, the event schedule and the crew
+    endpoints read `Shift` rows, so they show a series up to the horizon.
+"""
+import logging
+import re
+from datetime import timedelta
+
+import pytz
+from dateutil.rrule import rrule, rrulestr, rruleset
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from apps.events.models import Shift, ShiftEquipment, ShiftQualification, ShiftRecurrence, defer_event_cost
+from apps.scheduler.models import Schedule
+
+logger = logging.getLogger(__name__)
+
+# `+05:30`, `+0530`, `-03`, optionally prefixed by UTC/GMT
+UTC_OFFSET_RE = re.compile(r'^(?:UTC|GMT)?([+-])(\d{2}):?(\d{2})?$')
+
+
+def get_horizon():
+    return timezone.now() + timedelta(days=getattr(settings, 'EVENTS_RECURRENCE_HORIZON_DAYS', 28))
+
+
+def get_cost_days():
+    # span of the series cost when the event has no end date
+    return getattr(settings, 'EVENTS_RECURRENCE_COST_DAYS', 365)
+
+
+def get_offset_minutes(value):
+    """ Minutes east of UTC of an ISO offset (`+05:30`) or of a number of
+        minutes behind UTC (JavaScript `getTimezoneOffset()`, `-330`),
+        None when `value` is neither
+    """
+    match = UTC_OFFSET_RE.match(value)
+    if match:
+        sign, hours, minutes = match.groups()
+        offset = int(hours) * 60 + int(minutes or 0)
+        return -offset if sign == '-' else offset
+    try:
+        return -int(value)
+    except ValueError:
+        return None
+
+
+def normalize_timezone(value):
+    """ The time zone name of `value` to store: an IANA name as is, a UTC
+        offset as `+HH:MM`. Raises `ValueError` on anything else.
+    """
+    value = str(value).strip()
+    if value in pytz.all_timezones_set:
+        return value
+    offset = get_offset_minutes(value)
+    if offset is None or abs(offset) >= 24 * 60:
+        raise ValueError("Unknown time zone.")
+    return '{}{:02d}:{:02d}'.format('-' if offset < 0 else '+', abs(offset) // 60, abs(offset) % 60)
+
+
+def get_timezone(name):
+    """ tzinfo of an IANA name or a UTC offset. An offset is fixed: the wall
+        clock time of the occurrences is kept across DST only with a name.
+    """
+    if name in pytz.all_timezones_set:
+        return pytz.timezone(name)
+    offset = get_offset_minutes(name)
+    if offset is None:
+        raise pytz.UnknownTimeZoneError(name)
+    return pytz.FixedOffset(offset)
+
+
+def parse_rule(rule, dtstart):
+    """ raises `ValueError` on an invalid rule, the rule is one RRULE without
+        DTSTART (the series starts with its template)
+    """
+    if 'DTSTART' in rule.upper():
+        raise ValueError("DTSTART is not allowed, the series starts with its template shift.")
+    parsed = rrulestr(rule, dtstart=dtstart)
+    if not isinstance(parsed, rrule):
+        raise ValueError("A single RRULE is expected.")
+    return parsed
+
+
+def get_local_start(recurrence):
+    return timezone.localtime(recurrence.template.start_date, get_timezone(recurrence.timezone)).replace(tzinfo=None)
+
+
+def shift_rule(recurrence, offset):
+    """ `recurrence.rule` with its UNTIL moved by the `offset` timedelta,
+        for a copy of the series starting `offset` later
+    """
+    if not recurrence.rule:
+        return recurrence.rule
+    parsed = parse_rule(recurrence.rule, get_local_start(recurrence))
+    if parsed._until is None:
+        return recurrence.rule
+    # str() gives the DTSTART and RRULE lines, the rule is stored without DTSTART
+    lines = str(parsed.replace(until=parsed._until + offset)).splitlines()
+    return next(line for line in lines if line.startswith('RRULE:'))[len('RRULE:'):]
+
+
+def get_rule_set(recurrence):
+    tz = get_timezone(recurrence.timezone)
+
+    def local(value):
+        return timezone.localtime(value, tz).replace(tzinfo=None)
+
+    rule_set = rruleset()
+    if recurrence.rule:
+        rule_set.rrule(parse_rule(recurrence.rule, local(recurrence.template.start_date)))
+    for rdate in recurrence.rdates:
+        rule_set.rdate(local(rdate))
+    for exdate in recurrence.exdates:
+        rule_set.exdate(local(exdate))
+    return rule_set, tz, local
+
+
+def get_duration(shift):
+    if shift.end_date:
+        return shift.end_date - shift.start_date
+    return timedelta(hours=shift.total_shift_hours)
+
+
+def get_occurrence_starts(recurrence, after, before):
+    """ Starts in [after, before), the template itself excluded
+    """
+    rule_set, tz, local = get_rule_set(recurrence)
+    starts = []
+    for start in rule_set.between(local(after), local(before), inc=True):
+        start = tz.localize(start)
+        if start < before and start != recurrence.template.start_date:
+            starts.append(start)
+    return starts
+
+
+def get_occurrences(recurrences, after, before):
+    """ `(recurrence, start, end)` of the occurrences in [after, before) that
+        are not materialized yet
+    """
+    recurrences = list(recurrences)
+    materialized = set(Shift.objects.filter(
+        series__in=recurrences, series_start__gte=after, series_start__lt=before
+    ).values_list('series', 'series_start'))
+    occurrences = []
+    for recurrence in recurrences:
+        duration = get_duration(recurrence.template)
+        for start in get_occurrence_starts(recurrence, after, before):
+            if (recurrence.id, start) not in materialized:
+                occurrences.append((recurrence, start, start + duration))
+    return occurrences
+
+
+def copy_template(recurrence, start):
+    template = recurrence.template
+    shift = Shift.objects.get(pk=template.pk)
+    shift.pk = shift.id = None
+    shift.start_date = start
+    shift.end_date = start + get_duration(template)
+    shift.series = recurrence
+    shift.series_start = start
+    shift.search_vector = None
+    shift.save()
+    shift.skills.set(template.skills.all())
+    # created one by one, the receivers roll up the shift cost (the event cost
+    # is deferred by the callers)
+    for qualification in ShiftQualification.objects.filter(shift=template):
+        ShiftQualification.objects.create(
+            shift=shift, qualification=qualification.qualification,
+            charge_rate=qualification.charge_rate,
+            add_chief_charge_rate=qualification.add_chief_charge_rate,
+            no_of_resources=qualification.no_of_resources)
+    for equipment in ShiftEquipment.objects.filter(shift=template):
+        ShiftEquipment.objects.create(
+            shift=shift, equipment=equipment.equipment, count=equipment.count,
+            equipment_shift_charge=equipment.equipment_shift_charge)
+    return shift
+
+
+def get_series_cost(event):
+    """ Cost of the occurrences of the series of `event` not materialized
+        yet, up to the end of the event
+    """
+    cost = 0
+    for recurrence in ShiftRecurrence.objects.filter(template__event=event).select_related('template'):
+        template = recurrence.template
+        if not template.total_shift_cost or template.start_date is None:
+            continue
+        after = max(recurrence.materialized_until or template.start_date, template.start_date)
+        until = event.end_date or after + timedelta(days=get_cost_days())
+        if until > after:
+            cost += template.total_shift_cost * len(get_occurrences([recurrence], after, until))
+    return cost
+
+
+def lock_recurrence(recurrence):
+    return ShiftRecurrence.objects.select_for_update().select_related('template').get(pk=recurrence.pk)
+
+
+def materialize_occurrence(recurrence, start):
+    """ `(shift, created)` of the occurrence starting at `start`,
+        `ValueError` when the series has no such occurrence
+    """
+    with transaction.atomic():
+        recurrence = lock_recurrence(recurrence)
+        shift = Shift.objects.filter(series=recurrence, series_start=start).first()
+        if shift is not None:
+            return shift, False
+        if start not in get_occurrence_starts(recurrence, start, start + timedelta(seconds=1)):
+            raise ValueError("No occurrence starts at {}".format(start.isoformat()))
+        with defer_event_cost(recurrence.template.event_id, series=True):
+            return copy_template(recurrence, start), True
+
+
+def materialize_recurrence(recurrence, until=None):
+    """ Materializes the occurrences up to `until` (the horizon by default),
+        returns the new shifts
+    """
+    until = until or get_horizon()
+    with transaction.atomic():
+        recurrence = lock_recurrence(recurrence)
+        after = recurrence.materialized_until or recurrence.template.start_date
+        if until <= after:
+            return []
+        with defer_event_cost(recurrence.template.event_id, series=True):
+            shifts = [copy_template(recurrence, start)
+                      for _recurrence, start, _end in get_occurrences([recurrence], after, until)]
+            recurrence.materialized_until = until
+            recurrence.save(update_fields=['materialized_until'])
+    return shifts
+
+
+def reset_recurrence(recurrence):
+    """ Applies an edit of the series: the upcoming materialized occurrences
+        without scheduled crew are dropped and the horizon materialized again.
+        The cost is bounded by the horizon, not by the length of the series,
+        and the event cost is rolled up once.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        recurrence = lock_recurrence(recurrence)
+        with defer_event_cost(recurrence.template.event_id, series=True):
+            scheduled = Schedule.objects.filter(shift__series=recurrence).values('shift')
+            dropped = recurrence.occurrences.filter(series_start__gte=now).exclude(id__in=scheduled)
+            dropped_ids = list(dropped.values_list('id', flat=True))
+            # one DELETE per table, the feed and cost receivers still see every shift
+            Shift.objects.filter(id__in=dropped_ids).delete()
+            if dropped_ids:
+                logger.info('Dropped %s occurrences of shift series %s: %s', len(dropped_ids), recurrence.pk,
+                            dropped_ids)
+            if recurrence.materialized_until and recurrence.materialized_until > now:
+                recurrence.materialized_until = now
+                recurrence.save(update_fields=['materialized_until'])
+            shifts = materialize_recurrence(recurrence)
+    return shifts
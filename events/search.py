@@ -0,0 +1,108 @@
+""" Indexed search of events, shifts and quick quotes.
+
+    Every searchable model keeps a `search_vector` (maintained by the
+    `post_save` receivers in `apps.events.models`) and trigram GIN indexes on
+    its name-like columns. `search_queryset` matches prefix full-text terms
+    on the vector or trigram similarity on those columns, both answered by
+    the GIN indexes, and ranks the rows.
+
+    Needs `django.contrib.postgres` in INSTALLED_APPS and the `pg_trgm`
+    extension (`TrigramExtension()` in a migration). Other databases use the
+    `icontains` search of the callers.
+"""
+import re
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank, SearchVector,
+                                            TrigramSimilarity)
+from django.db import connection
+from django.db.models import CharField, F, Q, Value
+from django.db.models.functions import Greatest
+
+from apps.events.models import Event, QuickQuote, Shift
+
+SEARCH_CONFIG = 'simple'
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+# minimum `similarity()` of the trigram matches, pg_trgm.similarity_threshold
+# is used by the `%` operator and defaults to the same value
+TRIGRAM_THRESHOLD = 0.3
+
+
+def is_search_supported():
+    return connection.vendor == 'postgresql'
+
+
+def get_event_vector():
+    return SearchVector('name', weight='A', config=SEARCH_CONFIG)
+
+
+def get_shift_vector(event_name):
+    # the event name is copied in, shift search never joins events
+    return (SearchVector('name', weight='A', config=SEARCH_CONFIG) +
+            SearchVector(Value(event_name or '', output_field=CharField()), weight='B', config=SEARCH_CONFIG))
+
+
+def get_quick_quote_vector():
+    return (SearchVector('first_name', 'last_name', weight='A', config=SEARCH_CONFIG) +
+            SearchVector('email', weight='B', config=SEARCH_CONFIG) +
+            SearchVector('phone', weight='C', config=SEARCH_CONFIG))
+
+
+def update_event_vector(event, with_shifts=True):
+    Event.objects.filter(pk=event.pk).update(search_vector=get_event_vector())
+    if with_shifts:
+        Shift.objects.filter(event=event).update(search_vector=get_shift_vector(event.name))
+
+
+def update_shift_vector(shift):
+    Shift.objects.filter(pk=shift.pk).update(search_vector=get_shift_vector(
+        Event.objects.filter(pk=shift.event_id).values_list('name', flat=True).first()))
+
+
+def update_quick_quote_vector(quick_quote):
+    QuickQuote.objects.filter(pk=quick_quote.pk).update(search_vector=get_quick_quote_vector())
+
+
+def rebuild_search_vectors():
+    """ Backfill of all the vectors of the current tenant
+    """
+    Event.objects.update(search_vector=get_event_vector())
+    for event_id, name in Event.objects.values_list('id', 'name').iterator():
+        Shift.objects.filter(event=event_id).update(search_vector=get_shift_vector(name))
+    QuickQuote.objects.update(search_vector=get_quick_quote_vector())
+
+
+def get_search_query(term):
+    """ Prefix tsquery of the words of `term` (`foo:* & bar:*`), None when
+        `term` has no word
+    """
+    words = TERM_RE.findall(term)
+    if not words:
+        return None
+    return SearchQuery(" & ".join("{}:*".format(word) for word in words),
+                       config=SEARCH_CONFIG, search_type='raw')
+
+
+def search_queryset(queryset, term, trigram_fields, extra=None, rank=True):
+    """ Rows whose vector matches the words of `term` or whose
+        `trigram_fields` are similar to it, annotated with `search_rank`
+        and ordered by it when `rank` is set.
+        :params: `extra` Q of additional exact matches (e.g. the id)
+    """
+    term = term.strip()
+    condition = Q()
+    query = get_search_query(term)
+    if query is not None:
+        condition |= Q(search_vector=query)
+    for field in trigram_fields:
+        condition |= Q(**{field + '__trigram_similar': term})
+    if extra is not None:
+        condition |= extra
+    queryset = queryset.filter(condition)
+    if not rank:
+        return queryset
+    scores = [TrigramSimilarity(field, term) for field in trigram_fields]
+    if query is not None:
+        scores.append(SearchRank(F('search_vector'), query))
+    score = scores[0] if len(scores) == 1 else Greatest(*scores)
+    return queryset.annotate(search_rank=score).order_by('-search_rank')
@@ -5,12 +5,16 @@ from celery import shared_task
 
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
+from django.db.models import Q
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.utils.translation import ugettext as _
 from django.utils import timezone
+from tenant_schemas.utils import schema_context
 
-from apps.events.models import Event
+from apps.events.api.sync import get_token_max_age
+from apps.events.models import CrewShiftChange, Event, Shift, ShiftRecurrence
+from apps.events.recurrence import get_horizon, materialize_recurrence
 from apps.invoice.utils import generate_invoice
 
 
@@ -33,3 +37,28 @@ def send_invoice_email(event):
     my_email.attach('invoice.pdf', pdf, 'application/pdf')
     my_email.attach_alternative(html_content, "text/html")
     my_email.send(fail_silently=False)
+
+
+@shared_task
+def prune_crew_shift_changes(schema_name):
+    """ Drops the crew shift changes older than the sync tokens, clients with
+        such an old token get a full resync anyway
+    """
+    with schema_context(schema_name):
+        # a day of margin for the changes sent again after the token cursor
+        CrewShiftChange.objects.filter(
+            created__lt=timezone.now() - timedelta(seconds=get_token_max_age(), days=1)).delete()
+
+
+@shared_task
+def materialize_shift_recurrences(schema_name):
+    """ Moves the materialized occurrences of every live series up to the
+        rolling horizon, meant to run daily per tenant
+    """
+    with schema_context(schema_name):
+        horizon = get_horizon()
+        recurrences = ShiftRecurrence.objects.exclude(
+            template__status__in=[Shift.CANCELLED, Shift.DELETED]
+        ).filter(Q(materialized_until__isnull=True) | Q(materialized_until__lt=horizon))
+        for recurrence in recurrences.iterator():
+            materialize_recurrence(recurrence, horizon)
@@ -1,3 +1,348 @@
-from django.test import TestCase
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import pytz
+from django.contrib.gis.geos import Point
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from tenant_schemas.test.cases import TenantTestCase
+
+from apps.accounts.models import Client, CrewProfile, User
+from apps.common.models import CrewDepartment, Location, SuplierSetting
+from apps.events.api.geo import EventTileView, NearbyEventsView
+from apps.events.api.sync import make_sync_token, read_sync_token
+from apps.events.api.views import CrewShiftSyncView, EventViewSet
+from apps.events.clone import clone_event
+from apps.events.feed import refresh_crew_shift_feed_for_shifts
+from apps.events.models import Event, EventLocation, EventType, Shift, ShiftRecurrence
+from apps.events.recurrence import (get_occurrence_starts, get_timezone, materialize_recurrence,
+                                    normalize_timezone, reset_recurrence, shift_rule)
+from apps.scheduler.models import Schedule
+
+
+class EventsTestCase(TenantTestCase):
+    """ A supplier, a client and a crew member, with a location and a
+        department to create events and shifts on
+    """
+
+    def setUp(self):
+        SuplierSetting.objects.get_or_create(defaults={'rate_per_km': 1})
+        self.location = Location.objects.create(name="Location", coordinates=Point(8.54, 47.37, srid=4326))
+        self.department = CrewDepartment.objects.create(name="Department", location=self.location)
+        self.event_type = EventType.objects.create(name="Concert")
+        self.supplier_user = self.create_user("supplier", User.SUPPLIER, is_staff=True)
+        self.client_user = self.create_user("client", User.CLIENT)
+        self.event_client = Client.objects.create(user=self.client_user, company_name="Client")
+        self.crew_user = self.create_user("crew", User.CREW_MEMBER)
+        self.crew = CrewProfile.objects.create(user=self.crew_user)
+        self.factory = APIRequestFactory()
+
+    @staticmethod
+    def create_user(name, user_type, **kwargs):
+        return User.objects.create(username="{}@example.com".format(name), email="{}@example.com".format(name),
+                                   user_type=user_type, **kwargs)
+
+    def create_event(self, start=None, client=None, **kwargs):
+        start = start or timezone.now() + timedelta(days=7)
+        return Event.objects.create(name=kwargs.pop('name', "Event"), event_type=self.event_type,
+                                    client=client or self.event_client, status=Event.CONFIRMATION,
+                                    start_date=start, end_date=start + timedelta(days=1), **kwargs)
+
+    def create_shift(self, event, start=None, **kwargs):
+        start = start or event.start_date
+        return Shift.objects.create(name=kwargs.pop('name', "Shift"), event=event, start_date=start,
+                                    end_date=start + timedelta(hours=8),
+                                    location=kwargs.pop('location', self.location),
+                                    department=self.department, status=Shift.CONFIRMATION, **kwargs)
+
+    def get(self, view, user, path='/', data=None, **kwargs):
+        request = self.factory.get(path, data or {})
+        force_authenticate(request, user=user)
+        return view(request, **kwargs)
+
+
+@override_settings(EVENTS_SYNC_SAFETY_LAG=0)
+class CrewShiftSyncTest(EventsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.event = self.create_event()
+        self.shift = self.create_shift(self.event)
+        Schedule.objects.create(shift=self.shift, crew=self.crew, is_scheduled=True, is_accepted=True,
+                                is_rejected=False, is_crew_chief=False)
+        # the feed is refreshed on commit, which a test case never reaches
+        refresh_crew_shift_feed_for_shifts([self.shift.id])
+
+    def sync(self, token=None):
+        response = self.get(CrewShiftSyncView.as_view(), self.crew_user, data={'token': token} if token else None)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_deleted_shift_is_synced_as_deleted(self):
+        data = self.sync()
+        self.assertTrue(data['full'])
+        self.assertEqual([row['id'] for row in data['changed']], [self.shift.id])
+
+        shift_id = self.shift.id
+        self.shift.delete()
+        data = self.sync(data['token'])
+        self.assertFalse(data['full'])
+        self.assertEqual(data['changed'], [])
+        self.assertEqual(data['deleted'], [shift_id])
+
+        # the delete is acknowledged by the new token
+        data = self.sync(data['token'])
+        self.assertEqual(data['deleted'], [])
+
+    def test_tampered_token_forces_full_sync(self):
+        token = self.sync()['token']
+        cursor = read_sync_token(token, self.crew.id)
+        self.assertIsNotNone(cursor)
+        tampered = token[:-1] + ('A' if token[-1] != 'A' else 'B')
+        self.assertIsNone(read_sync_token(tampered, self.crew.id))
+        data = self.sync(tampered)
+        self.assertTrue(data['full'])
+        self.assertEqual([row['id'] for row in data['changed']], [self.shift.id])
+
+    def test_token_of_another_crew_forces_full_sync(self):
+        other = CrewProfile.objects.create(user=self.create_user("other", User.CREW_MEMBER))
+        token = make_sync_token(other.id, 10 ** 9)
+        self.assertIsNone(read_sync_token(token, self.crew.id))
+        self.assertTrue(self.sync(token)['full'])
+
+    def test_unchanged_feed_returns_nothing(self):
+        data = self.sync(self.sync()['token'])
+        self.assertFalse(data['full'])
+        self.assertEqual(data['changed'], [])
+        self.assertEqual(data['deleted'], [])
+
+    @override_settings(EVENTS_SYNC_SAFETY_LAG=3600)
+    def test_changes_within_safety_lag_are_sent_again(self):
+        token = self.sync()['token']
+        # the change is newer than the lag, the cursor stays before it
+        self.assertEqual(read_sync_token(token, self.crew.id), 0)
+        for _attempt in range(2):
+            data = self.sync(token)
+            self.assertFalse(data['full'])
+            self.assertEqual([row['id'] for row in data['changed']], [self.shift.id])
+            token = data['token']
+
+
+class ScopedEventsTestCase(EventsTestCase):
+    """ Two clients with one event each, a shift on the first one managed
+        by a Crew Manager
+    """
+    point = Point(8.54, 47.37, srid=4326)
+
+    def setUp(self):
+        super().setUp()
+        self.manager_user = self.create_user("manager", User.CREW_MANAGER)
+        self.manager = CrewProfile.objects.create(user=self.manager_user)
+        self.other_client = Client.objects.create(user=self.create_user("other-client", User.CLIENT),
+                                                  company_name="Other Client")
+        self.event = self.create_event(name="Event")
+        self.other_event = self.create_event(name="Other Event", client=self.other_client)
+        for event, offset in ((self.event, 0.001), (self.other_event, 0.002)):
+            EventLocation.objects.create(event=event, location_name=event.name,
+                                         coordinates=Point(8.54 + offset, 47.37, srid=4326))
+        self.shift = self.create_shift(self.event, crew_manager=self.manager)
+        self.other_shift = self.create_shift(self.other_event)
+
+
+class NearbyEventsTest(ScopedEventsTestCase):
+
+    def nearby(self, user, **params):
+        params = dict({'lat': self.point.y, 'lng': self.point.x, 'radius': 10000}, **params)
+        response = self.get(NearbyEventsView.as_view(), user, data=params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_supplier_sees_every_event_and_shift(self):
+        data = self.nearby(self.supplier_user)
+        self.assertEqual([row['id'] for row in data['events']], [self.event.id, self.other_event.id])
+        self.assertEqual({row['id'] for row in data['shifts']}, {self.shift.id, self.other_shift.id})
+
+    def test_client_sees_own_events_and_shifts(self):
+        data = self.nearby(self.client_user)
+        self.assertEqual([row['id'] for row in data['events']], [self.event.id])
+        self.assertEqual([row['id'] for row in data['shifts']], [self.shift.id])
+
+    def test_crew_manager_sees_managed_shifts(self):
+        data = self.nearby(self.manager_user)
+        self.assertEqual([row['id'] for row in data['events']], [self.event.id])
+        self.assertEqual([row['id'] for row in data['shifts']], [self.shift.id])
+
+    def test_shift_limit_applies_after_filters(self):
+        # the nearest location only has a cancelled shift
+        far = Location.objects.create(name="Far", coordinates=Point(8.60, 47.37, srid=4326))
+        far_shift = self.create_shift(self.event, location=far)
+        Shift.objects.filter(location=self.location).update(status=Shift.CANCELLED)
+        data = self.nearby(self.supplier_user, status=str(Shift.CONFIRMATION), limit=1, include='shifts')
+        self.assertEqual([row['id'] for row in data['shifts']], [far_shift.id])
+
+
+class EventTileTest(ScopedEventsTestCase):
+
+    def tile(self, user, **headers):
+        request = self.factory.get('/', **headers)
+        force_authenticate(request, user=user)
+        return EventTileView.as_view()(request, z=0, x=0, y=0)
+
+    def get_events(self, response):
+        self.assertEqual(response.status_code, 200)
+        clusters = response.data['clusters']
+        return sum(cluster['count'] for cluster in clusters), [cluster.get('event') for cluster in clusters]
+
+    def test_tiles_are_scoped_to_the_user(self):
+        self.assertEqual(self.get_events(self.tile(self.supplier_user))[0], 2)
+        self.assertEqual(self.get_events(self.tile(self.client_user)), (1, [self.event.id]))
+        self.assertEqual(self.get_events(self.tile(self.manager_user)), (1, [self.event.id]))
+
+    def test_etag_depends_on_the_scope(self):
+        supplier_etag = self.tile(self.supplier_user)['ETag']
+        client_etag = self.tile(self.client_user)['ETag']
+        self.assertNotEqual(supplier_etag, client_etag)
+        self.assertEqual(self.tile(self.client_user, HTTP_IF_NONE_MATCH=client_etag).status_code, 304)
+        # a tag of another scope does not validate the cached copy of the client
+        response = self.tile(self.client_user, HTTP_IF_NONE_MATCH=supplier_etag)
+        self.assertEqual(self.get_events(response), (1, [self.event.id]))
+
+
+class RecurrenceExpansionTest(SimpleTestCase):
+
+    def get_recurrence(self, start, rule='FREQ=WEEKLY', tz_name='Europe/Zurich'):
+        template = Shift(name="Template", start_date=start, end_date=start + timedelta(hours=8))
+        return ShiftRecurrence(template=template, rule=rule, timezone=normalize_timezone(tz_name))
+
+    def test_wall_clock_time_is_kept_across_dst(self):
+        zurich = pytz.timezone('Europe/Zurich')
+        # the clocks move forward on 2026-03-29
+        start = zurich.localize(datetime(2026, 3, 20, 9, 0))
+        starts = get_occurrence_starts(self.get_recurrence(start), start, start + timedelta(days=21))
+        local = [value.astimezone(zurich) for value in starts]
+        self.assertEqual([value.date().isoformat() for value in local], ['2026-03-27', '2026-04-03', '2026-04-10'])
+        self.assertEqual({(value.hour, value.minute) for value in local}, {(9, 0)})
+        self.assertEqual([value.utcoffset() for value in local],
+                         [timedelta(hours=1), timedelta(hours=2), timedelta(hours=2)])
+
+    def test_fixed_offset_keeps_utc_time(self):
+        start = pytz.utc.localize(datetime(2026, 3, 20, 8, 0))
+        starts = get_occurrence_starts(self.get_recurrence(start, tz_name='+01:00'), start,
+                                       start + timedelta(days=21))
+        self.assertEqual({(value.astimezone(pytz.utc).hour) for value in starts}, {8})
+
+    def test_timezone_names_and_offsets(self):
+        self.assertEqual(normalize_timezone('Europe/Zurich'), 'Europe/Zurich')
+        for value in ('+05:30', '+0530', 'UTC+05:30', '-330', -330):
+            self.assertEqual(normalize_timezone(value), '+05:30')
+        self.assertEqual(normalize_timezone('-03'), '-03:00')
+        self.assertEqual(normalize_timezone('180'), '-03:00')
+        for value in ('Mars/Base', '+25:00', 'soon'):
+            with self.assertRaises(ValueError):
+                normalize_timezone(value)
+        self.assertEqual(get_timezone('+05:30').utcoffset(None), timedelta(hours=5, minutes=30))
+
+
+@override_settings(EVENTS_RECURRENCE_HORIZON_DAYS=20)
+class SeriesCostTest(EventsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.event = self.create_event(start=timezone.now() + timedelta(days=1))
+        Event.objects.filter(id=self.event.id).update(end_date=self.event.start_date + timedelta(days=21))
+        self.event.refresh_from_db()
+        self.template = self.create_shift(self.event)
+        Shift.objects.filter(id=self.template.id).update(total_shift_cost=100)
+        self.template.refresh_from_db()
+        # weekly, two occurrences before the end of the event besides the template,
+        # both within the horizon
+        self.recurrence = ShiftRecurrence.objects.create(template=self.template, rule='FREQ=WEEKLY',
+                                                         timezone='UTC')
+
+    def get_sub_total(self):
+        self.event.refresh_from_db()
+        return self.event.sub_total
+
+    def test_event_cost_covers_the_whole_series(self):
+        self.assertEqual(self.get_sub_total(), 300)
+        shifts = materialize_recurrence(self.recurrence)
+        self.assertEqual(len(shifts), 2)
+        self.assertEqual(self.get_sub_total(), 300)
+
+    def test_reset_keeps_scheduled_occurrences(self):
+        first, second = materialize_recurrence(self.recurrence)
+        Schedule.objects.create(shift=first, crew=self.crew, is_scheduled=True, is_accepted=False,
+                                is_rejected=False, is_crew_chief=False)
+        shifts = reset_recurrence(self.recurrence)
+        self.assertEqual([shift.series_start for shift in shifts], [second.series_start])
+        self.assertTrue(Shift.objects.filter(id=first.id).exists())
+        self.assertFalse(Shift.objects.filter(id=second.id).exists())
+        self.assertEqual(self.get_sub_total(), 300)
+
+    def test_saving_another_shift_keeps_the_series_cost(self):
+        with mock.patch('apps.events.recurrence.get_series_cost') as get_series_cost:
+            shift = self.create_shift(self.event, name="Other")
+            shift.save()
+        get_series_cost.assert_not_called()
+        self.assertEqual(self.get_sub_total(), 300 + shift.total_shift_cost)
+
+
+class CloneEventTest(EventsTestCase):
+    UNTIL_FORMAT = '%Y%m%dT%H%M%S'
+
+    def setUp(self):
+        super().setUp()
+        start = timezone.now().replace(microsecond=0) + timedelta(days=7)
+        self.event = self.create_event(start=start)
+        self.shift = self.create_shift(self.event)
+        self.until = start.astimezone(pytz.utc).replace(tzinfo=None) + timedelta(days=14)
+        self.recurrence = ShiftRecurrence.objects.create(
+            template=self.shift, timezone='UTC', rdates=[start + timedelta(days=1)],
+            rule='FREQ=WEEKLY;UNTIL={}'.format(self.until.strftime(self.UNTIL_FORMAT)))
+
+    def clone(self, **data):
+        request = self.factory.post('/', data, format='json')
+        force_authenticate(request, user=self.supplier_user)
+        return EventViewSet.as_view({'post': 'clone'})(request, pk=self.event.pk)
+
+    def test_clone_moves_shifts_and_series(self):
+        offset = timedelta(days=7)
+        event = clone_event(self.event, offset, Event.ESTIMATION)
+        self.assertEqual(event.start_date, self.event.start_date + offset)
+        shift = Shift.objects.get(event=event)
+        self.assertEqual(shift.start_date, self.shift.start_date + offset)
+        recurrence = ShiftRecurrence.objects.get(template=shift)
+        self.assertEqual(recurrence.rule, 'FREQ=WEEKLY;UNTIL={}'.format(
+            (self.until + offset).strftime(self.UNTIL_FORMAT)))
+        self.assertEqual(recurrence.rdates, [rdate + offset for rdate in self.recurrence.rdates])
+        # as many occurrences as the source series
+        self.assertEqual(len(get_occurrence_starts(recurrence, shift.start_date, shift.start_date + timedelta(days=60))),
+                         len(get_occurrence_starts(self.recurrence, self.shift.start_date,
+                                                   self.shift.start_date + timedelta(days=60))))
+        self.recurrence.refresh_from_db()
+        self.assertIn(self.until.strftime(self.UNTIL_FORMAT), self.recurrence.rule)
+
+    def test_rule_without_until_is_kept(self):
+        self.recurrence.rule = 'FREQ=DAILY;COUNT=3'
+        self.assertEqual(shift_rule(self.recurrence, timedelta(days=7)), 'FREQ=DAILY;COUNT=3')
+
+    def test_clone_to_a_date_keeps_the_time_of_day(self):
+        day = timezone.localtime(self.event.start_date).date() + timedelta(days=3)
+        response = self.clone(start_date=day.isoformat())
+        self.assertEqual(response.status_code, 201)
+        event = Event.objects.exclude(id=self.event.id).get()
+        self.assertEqual(event.start_date, self.event.start_date + timedelta(days=3))
+
+    def test_clone_by_offset_days(self):
+        response = self.clone(offset_days=-2)
+        self.assertEqual(response.status_code, 201)
+        event = Event.objects.exclude(id=self.event.id).get()
+        self.assertEqual(event.start_date, self.event.start_date - timedelta(days=2))
+
+    def test_invalid_start_date_is_rejected(self):
+        for value in ('2026-02-30', '2026-02-30T10:00', 'soon'):
+            response = self.clone(start_date=value)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('start_date', response.data)
+        self.assertEqual(Event.objects.count(), 1)
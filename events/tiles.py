@@ -0,0 +1,132 @@
+""" Clustered map tiles of the event locations.
+
+    A `z/x/y` tile (web map tiling) is split in a `EVENTS_TILE_GRID` x
+    `EVENTS_TILE_GRID` grid. The locations of a tile are aggregated per grid
+    cell in the database with `ST_SnapToGrid`, giving per cell the count, the
+    mean position and the counts per event status.
+
+    A tile only counts the events the caller may see, it is cached per
+    visibility scope (`apps.events.api.utils.get_visibility_scope`) under a
+    per-tenant version that `bump_tile_version` replaces whenever an
+    `EventLocation`, the status or client of an event or the managed shifts
+    change, outdated tiles are then never read again and expire.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from apps.events.api.instrumentation import cache
+from apps.events.models import Event, EventLocation
+
+MAX_ZOOM = 22
+
+
+def get_grid_size():
+    return getattr(settings, 'EVENTS_TILE_GRID', 64)
+
+
+def get_cache_timeout():
+    return getattr(settings, 'EVENTS_TILE_CACHE_TIMEOUT', 24 * 3600)
+
+
+def get_version_key():
+    return 'events:tiles:{}:version'.format(connection.schema_name)
+
+
+def bump_tile_version():
+    # a timestamp rather than a counter, an evicted version can not come back
+    cache.set(get_version_key(), '{:.6f}'.format(time.time()), None)
+
+
+def get_tile_version():
+    version = cache.get(get_version_key())
+    if version is None:
+        bump_tile_version()
+        version = cache.get(get_version_key())
+    return version
+
+
+def tile_bounds(z, x, y):
+    """ (min_lng, min_lat, max_lng, max_lat) of a tile
+    """
+    n = 2 ** z
+
+    def lng(tile_x):
+        return tile_x / n * 360.0 - 180.0
+
+    def lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return lng(x), lat(y + 1), lng(x + 1), lat(y)
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+CLUSTER_SQL = """
+    SELECT SUM(n), SUM(sum_x) / SUM(n), SUM(sum_y) / SUM(n), json_object_agg(status, n), MIN(event_id)
+    FROM (
+        SELECT ST_SnapToGrid(l.coordinates, %s, %s) AS cell, e.status AS status,
+               COUNT(*) AS n, SUM(ST_X(l.coordinates)) AS sum_x, SUM(ST_Y(l.coordinates)) AS sum_y,
+               MIN(l.event_id) AS event_id
+        FROM {location_table} l
+        JOIN {event_table} e ON e.id = l.event_id
+        WHERE l.coordinates && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+          AND NOT e.is_archived {status_filter} {event_filter}
+        GROUP BY 1, 2
+    ) cells
+    GROUP BY cell
+"""
+
+
+def cluster_tile(z, x, y, statuses=None, events=None):
+    """ clusters of the locations of `events` (all events by default) """
+    xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+    grid = get_grid_size()
+    # cells of the same size on every tile of a zoom, clusters do not split on tile edges
+    params = [360.0 / (2 ** z) / grid, 180.0 / (2 ** z) / grid, xmin, ymin, xmax, ymax]
+    status_filter = event_filter = ''
+    if statuses:
+        status_filter = 'AND e.status IN %s'
+        params.append(tuple(statuses))
+    if events is not None:
+        events_sql, events_params = events.order_by().values('id').query.sql_with_params()
+        event_filter = 'AND e.id IN ({})'.format(events_sql)
+        params.extend(events_params)
+    sql = CLUSTER_SQL.format(
+        location_table=connection.ops.quote_name(EventLocation._meta.db_table),
+        event_table=connection.ops.quote_name(Event._meta.db_table),
+        status_filter=status_filter, event_filter=event_filter)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    clusters = []
+    for count, lng, lat, statuses_count, event_id in rows:
+        cluster = {
+            'lng': lng,
+            'lat': lat,
+            'count': int(count),
+            'statuses': {int(status): int(n) for status, n in statuses_count.items()},
+        }
+        if count == 1:
+            cluster['event'] = event_id
+        clusters.append(cluster)
+    return clusters
+
+
+def get_tile(z, x, y, statuses=None, version=None, events=None, scope='all'):
+    """ cached tile of the current (or the given) version, `scope` names the
+        set of `events` the tile is built from
+    """
+    version = version or get_tile_version()
+    key = 'events:tiles:{}:{}:{}:{}/{}/{}:{}'.format(
+        connection.schema_name, version, scope, z, x, y,
+        ",".join(str(status) for status in sorted(statuses or ())))
+    tile = cache.get(key)
+    if tile is None:
+        tile = {'z': z, 'x': x, 'y': y, 'clusters': cluster_tile(z, x, y, statuses, events)}
+        cache.set(key, tile, get_cache_timeout())
+    return tile
@@ -4,6 +4,9 @@ from rest_framework.routers import DefaultRouter
 
 from apps.events.api import views
 from apps.events.api import order_views
+from apps.events.api import profiling
+from apps.events.api import async_views
+from apps.events.api import geo
 
 router = DefaultRouter()
 router.register(r'event', views.EventViewSet)
@@ -15,6 +18,7 @@ router.register(r'shift', views.ShiftViewSet)
 router.register(r'order', order_views.OrderViewSet)
 router.register(r'shift-equipment', views.ShiftEquipmentViewSet)
 router.register(r'shift-qualification', views.ShiftQualificationViewSet)
+router.register(r'shift-recurrence', views.ShiftRecurrenceViewSet)
 router.register(r'quick-quote', views.QuickQuoteViewSet)
 urlpatterns = [
     path('', include(router.urls)),
@@ -31,5 +35,18 @@ urlpatterns = [
     path('get-crew-event-list/', views.CrewEventListView.as_view()),
     path('change-event-status/<int:pk>', views.EventChangeStatusView.as_view()),
     path('change-shift-status/', views.ChangeShiftStatusView.as_view()),
-    path('shift-history/<int:pk>', views.ShiftHistoryViewSet.as_view())
+    path('shift-history/<int:pk>', views.ShiftHistoryViewSet.as_view()),
+    path('crew-shift-sync/', views.CrewShiftSyncView.as_view()),
+    path('push-token/', views.PushTokenView.as_view()),
+    path('nearby/', geo.NearbyEventsView.as_view()),
+    path('tiles/<int:z>/<int:x>/<int:y>/', geo.EventTileView.as_view()),
+    path('profiles/', profiling.ProfileListView.as_view()),
+    path('profiles/<str:profile_id>/', profiling.ProfileDetailView.as_view()),
 ]
+
+if async_views.ASYNC_VIEWS_SUPPORTED:
+    urlpatterns += [
+        path('async/get-crew-shift-list/<int:pk>/', async_views.crew_shift_detail),
+        path('async/get-upcoming-shift/', async_views.upcoming_shift),
+        path('async/get-all-upcoming-shift/', async_views.all_upcoming_shift),
+    ]
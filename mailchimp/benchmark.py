@@ -0,0 +1,182 @@
+""" Throughput benchmark of the Mailchimp sync client against `FakeMailChimpServer`.
+
+    Measures operations/second, HTTP calls per operation and p95 latency of the
+    single order, POS bulk and catalog import flows. Run it from the
+    `mailchimp_benchmark` management command inside a tenant schema.
+"""
+import time
+from types import SimpleNamespace
+
+from django.db import connection
+
+from apps.products.models import Product
+
+from .cache import TwoTierCache
+from .circuit import CircuitBreaker
+from .client import MailChimpHelperClient
+from .executor import AccountRateLimiter, MailChimpSyncExecutor
+from .imports import ProductCatalogImport
+from .models import MailChimpImportJob, MailChimpSyncLedger
+
+BENCHMARK_STORE_ID = "benchmark"
+
+
+class LineSet(list):
+    """ list that quacks like a related manager for `order.lines.all()`
+    """
+
+    def all(self):
+        return self
+
+
+def make_client_class(server):
+    """ Client talking to the fake server, with caches and circuits of its own
+        so a benchmark never touches the real tenant entries.
+    """
+
+    class BenchmarkClient(MailChimpHelperClient):
+        OAUTH2_METADATA_URL = server.metadata_url
+        STORE_CACHE = TwoTierCache("benchmark-store")
+        LIST_CACHE = TwoTierCache("benchmark-list")
+        ENDPOINT_CACHE = TwoTierCache("benchmark-endpoint", local_timeout=0)
+        TOKEN_CACHE = TwoTierCache("benchmark-token", local_timeout=0)
+        CAMPAIGN_CACHE = TwoTierCache("benchmark-campaigns")
+        GLOBAL_CIRCUIT = CircuitBreaker("benchmark-global")
+
+        def get_access_token(self):
+            return "benchmark-token"
+
+        def get_circuits(self):
+            return [self.GLOBAL_CIRCUIT]
+
+    return BenchmarkClient
+
+
+def get_benchmark_store():
+    return SimpleNamespace(
+        id=BENCHMARK_STORE_ID, name="Benchmark Store", email="benchmark@example.com",
+        retailer=SimpleNamespace(schema_name=connection.schema_name, domain_url="benchmark.example.com"))
+
+
+def make_order(order_id, store, catalog_size, lines_per_order, customers):
+    lines = LineSet()
+    for i in range(lines_per_order):
+        product_id = (order_id * lines_per_order + i) % catalog_size
+        product = SimpleNamespace(internal_item_number="BENCH-{}".format(product_id),
+                                  title="Benchmark product {}".format(product_id),
+                                  brand=SimpleNamespace(name="Benchmark"))
+        lines.append(SimpleNamespace(id="{}-{}".format(order_id, i), quantity=1, line_price_incl_tax="9.99",
+                                     retailer_product=SimpleNamespace(product=product)))
+    customer_id = order_id % customers
+    customer = SimpleNamespace(email="customer{}@example.com".format(customer_id),
+                               first_name="Customer", last_name=str(customer_id))
+    order = SimpleNamespace(id="BENCH-{}".format(order_id), store=store, lines=lines, total_incl_tax="9.99")
+    return order, customer
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))]
+
+
+def summarize(flow, operations, seconds, http_calls, latencies):
+    return {
+        "flow": flow,
+        "operations": operations,
+        "seconds": round(seconds, 3),
+        "ops_per_second": round(operations / seconds, 2) if seconds else 0.0,
+        "http_calls": http_calls,
+        "calls_per_op": round(http_calls / operations, 2) if operations else 0.0,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+    }
+
+
+class MailChimpBenchmark:
+
+    def __init__(self, server, orders=200, lines_per_order=3, catalog_size=50, customers=40,
+                 pos_orders=200, concurrency=10):
+        self.server = server
+        self.client_class = make_client_class(server)
+        self.store = get_benchmark_store()
+        self.orders = orders
+        self.lines_per_order = lines_per_order
+        self.catalog_size = catalog_size
+        self.customers = customers
+        self.pos_orders = pos_orders
+        self.concurrency = concurrency
+
+    def store_id(self):
+        return "{}_{}".format(connection.schema_name, BENCHMARK_STORE_ID)
+
+    def cleanup(self):
+        MailChimpSyncLedger.objects.filter(store_id=self.store_id()).delete()
+        MailChimpSyncLedger.invalidate(MailChimpSyncLedger.STORE, resource_id=self.store_id())
+        MailChimpImportJob.objects.filter(store_id=self.store_id()).delete()
+        self.client_class.STORE_CACHE.invalidate(self.store_id())
+
+    def timed(self, flow, operations, run):
+        self.server.state.reset_calls()
+        latencies = []
+        started = time.monotonic()
+        count = run(latencies)
+        seconds = time.monotonic() - started
+        return summarize(flow, count if count is not None else operations, seconds,
+                         self.server.state.total_calls, latencies)
+
+    def run_single_orders(self, latencies):
+        client = self.client_class()
+        for order_id in range(self.orders):
+            order, customer = make_order(order_id, self.store, self.catalog_size, self.lines_per_order,
+                                         self.customers)
+            started = time.monotonic()
+            client.create_order(order, customer)
+            latencies.append(time.monotonic() - started)
+
+    def run_pos_bulk(self, latencies):
+        product_ids = list(Product.objects.order_by('pk').values_list(
+            'internal_item_number', flat=True)[:self.catalog_size])
+        if not product_ids:
+            return 0
+        store_id = self.client_class().create_store(self.store)
+
+        def create_pos_order(client, order_id):
+            data = {
+                "id": "BENCH-{}".format(order_id),
+                "customer": {"email_address": "customer{}@example.com".format(order_id % self.customers),
+                             "first_name": "Customer", "last_name": str(order_id)},
+                "lines": [{"id": "{}-{}".format(order_id, i), "etp_id": product_ids[(order_id + i) % len(product_ids)],
+                           "quantity": 1, "line_total": "9.99"} for i in range(self.lines_per_order)],
+                "total_collected": "9.99",
+            }
+            started = time.monotonic()
+            client.create_order_from_pos(data, store_id)
+            return time.monotonic() - started
+
+        executor = MailChimpSyncExecutor(
+            client_class=self.client_class, max_workers=self.concurrency,
+            rate_limiter=AccountRateLimiter("benchmark", max_connections=self.concurrency, rate=10 ** 6))
+        for order_id, latency in executor.run(create_pos_order, range(self.pos_orders)):
+            if isinstance(latency, float):
+                latencies.append(latency)
+        return self.pos_orders
+
+    def run_catalog_import(self, latencies):
+        started = time.monotonic()
+        job = ProductCatalogImport(self.store, client=self.client_class()).run(restart=True)
+        latencies.append(time.monotonic() - started)
+        return job.processed if job else 0
+
+    def run(self):
+        self.cleanup()
+        try:
+            results = [
+                self.timed("single_order (cold)", self.orders, self.run_single_orders),
+                self.timed("single_order (warm)", self.orders, self.run_single_orders),
+                self.timed("pos_bulk", self.pos_orders, self.run_pos_bulk),
+                self.timed("catalog_import", 0, self.run_catalog_import),
+            ]
+        finally:
+            self.cleanup()
+        return results
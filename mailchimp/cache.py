@@ -0,0 +1,123 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import connection
+
+
+class TwoTierCache:
+    """ Memoizes values resolved from Mailchimp.
+        An in-process LRU sits in front of the shared Django cache, keys are
+        scoped to the current tenant schema. A resolver returning `None` is
+        remembered for `negative_timeout` seconds so a missing resource is not
+        looked up on every call. Only one worker resolves a given key at a
+        time, the others wait for its result (stampede protection).
+        `invalidate` only reaches the local tier of the calling process, values
+        that must not outlive an invalidation (credentials) are kept out of it
+        with `local_timeout=0`.
+    """
+    NEGATIVE = "__mailchimp_none__"
+    # fixed pool of local locks, keys sharing a stripe resolve one at a time
+    KEY_LOCK_STRIPES = 64
+
+    def __init__(self, prefix, maxsize=1024, timeout=60 * 60, negative_timeout=60,
+                 lock_timeout=10, local_timeout=5 * 60):
+        self.prefix = prefix
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.lock_timeout = lock_timeout
+        self.local_timeout = local_timeout
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(self.KEY_LOCK_STRIPES)]
+
+    def make_key(self, key):
+        return "mailchimp:{}:{}:{}".format(self.prefix, connection.schema_name, key)
+
+    def _get_local(self, cache_key):
+        with self._lock:
+            entry = self._local.get(cache_key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._local[cache_key]
+                return None
+            self._local.move_to_end(cache_key)
+            return value
+
+    def _set_local(self, cache_key, value, timeout):
+        if self.local_timeout <= 0:
+            return
+        with self._lock:
+            self._local[cache_key] = (value, time.monotonic() + min(timeout, self.local_timeout))
+            self._local.move_to_end(cache_key)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def _get_key_lock(self, cache_key):
+        return self._key_locks[hash(cache_key) % self.KEY_LOCK_STRIPES]
+
+    def _unwrap(self, value):
+        return None if value == self.NEGATIVE else value
+
+    def get(self, key):
+        cache_key = self.make_key(key)
+        value = self._get_local(cache_key)
+        if value is None:
+            value = cache.get(cache_key)
+            if value is not None:
+                self._set_local(cache_key, value, self.timeout)
+        return value
+
+    def set(self, key, value):
+        cache_key = self.make_key(key)
+        if value is None:
+            value, timeout = self.NEGATIVE, self.negative_timeout
+        else:
+            timeout = self.timeout
+        cache.set(cache_key, value, timeout)
+        self._set_local(cache_key, value, timeout)
+
+    def invalidate(self, key):
+        cache_key = self.make_key(key)
+        with self._lock:
+            self._local.pop(cache_key, None)
+        cache.delete(cache_key)
+
+    def get_or_resolve(self, key, resolver):
+        value = self.get(key)
+        if value is not None:
+            return self._unwrap(value)
+        cache_key = self.make_key(key)
+        # threads of this process queue on a local lock, processes on a cache lock
+        with self._get_key_lock(cache_key):
+            value = self.get(key)
+            if value is not None:
+                return self._unwrap(value)
+            lock_key = cache_key + ":lock"
+            token = uuid.uuid4().hex
+            deadline = time.monotonic() + self.lock_timeout
+            acquired = cache.add(lock_key, token, self.lock_timeout)
+            while not acquired:
+                if time.monotonic() > deadline:
+                    # lock holder died or is too slow, resolve ourselves
+                    # without taking over its lock
+                    break
+                time.sleep(0.05)
+                value = cache.get(cache_key)
+                if value is not None:
+                    self._set_local(cache_key, value, self.timeout)
+                    return self._unwrap(value)
+                acquired = cache.add(lock_key, token, self.lock_timeout)
+            try:
+                value = resolver()
+                self.set(key, value)
+            finally:
+                # our lock may have expired and been taken by another worker
+                if acquired and cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+        return value
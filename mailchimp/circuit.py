@@ -0,0 +1,95 @@
+import logging
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger('third_party_api_call_logger')
+
+
+class CircuitOpen(Exception):
+    """ Raised instead of calling Mailchimp while the circuit is open
+    """
+
+
+class CircuitBreaker:
+    """ Circuit breaker shared by every process through the cache.
+        closed:    calls go through, failures inside `window` are counted,
+                   `failure_threshold` failures open the circuit.
+        open:      calls fail fast with `CircuitOpen` for `reset_timeout` seconds.
+        half-open: a single probe call is let through, its result closes or
+                   re-opens the circuit.
+        Trips and seconds spent open are kept as counters for monitoring.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    METRICS_TIMEOUT = 7 * 24 * 60 * 60
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, window=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.window = window
+
+    def make_key(self, name):
+        return "mailchimp:circuit:{}:{}".format(self.name, name)
+
+    @property
+    def state(self):
+        opened_at = cache.get(self.make_key("opened_at"))
+        if opened_at is None:
+            return self.CLOSED
+        if time.time() - opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow_request(self):
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN:
+            # only one process gets to probe mailchimp
+            return cache.add(self.make_key("probe"), 1, self.reset_timeout)
+        return False
+
+    def _incr(self, name, delta=1, timeout=None):
+        key = self.make_key(name)
+        cache.add(key, 0, timeout or self.METRICS_TIMEOUT)
+        try:
+            return cache.incr(key, delta)
+        except ValueError:
+            cache.set(key, delta, timeout or self.METRICS_TIMEOUT)
+            return delta
+
+    def open(self):
+        cache.set(self.make_key("opened_at"), time.time(), None)
+        cache.delete(self.make_key("probe"))
+        trips = self._incr("trips")
+        logger.warning("MailChimp circuit %s opened (trip %s)", self.name, trips)
+
+    def record_success(self):
+        opened_at = cache.get(self.make_key("opened_at"))
+        if opened_at is not None:
+            open_seconds = int(time.time() - opened_at)
+            self._incr("open_seconds", open_seconds)
+            cache.delete_many([self.make_key("opened_at"), self.make_key("probe")])
+            logger.info("MailChimp circuit %s closed after %ss", self.name, open_seconds)
+        cache.delete(self.make_key("failures"))
+
+    def record_failure(self):
+        if self.state == self.HALF_OPEN:
+            # probe failed, stay open for another `reset_timeout`
+            self.open()
+            return
+        if self._incr("failures", timeout=self.window) >= self.failure_threshold:
+            cache.delete(self.make_key("failures"))
+            self.open()
+
+    def get_metrics(self):
+        return {
+            "name": self.name,
+            "state": self.state,
+            "trips": cache.get(self.make_key("trips"), 0),
+            "open_seconds": cache.get(self.make_key("open_seconds"), 0),
+        }
@@ -1,9 +1,11 @@
+import io
 import json
 import logging
+import tarfile
+import time
 
 import requests
 from django.contrib import messages
-from django.core.cache import cache
 from django.db import connection
 from django.utils import six
 from django.conf import settings
@@ -17,6 +19,11 @@ from core.utils import get_default_retailer_currency
 from etailpet.utils.constants import MAILCHIMP_REQUEST_TIMEOUT, KINESIS_ACTION_PRODUCT_IMPORT_MAILCHIMP
 from integrations.mailchimp.helpers import get_mailchimp_oauth2_redirect_uri
 
+from .cache import TwoTierCache
+from .circuit import CircuitBreaker, CircuitOpen
+from .logs import LazyBody, redact_url, should_log_success
+from .models import MailChimpOutbox, MailChimpSyncLedger
+
 # Standard logger for third_party_api_call events
 logger = logging.getLogger('third_party_api_call_logger')
 
@@ -38,161 +45,330 @@ class MailChimpHelperClient:
 
     DATA_STORE_URL_CACHE_KEY = "mail_chimp_api_url"
 
+    # resolved store ids and list id, shared by every instance of the process
+    STORE_CACHE = TwoTierCache("store")
+    LIST_CACHE = TwoTierCache("list")
+    LIST_CACHE_KEY = "default"
+    # datacenter endpoint and oauth token, per tenant schema. Shared tier only,
+    # `delete_data_store_url` must reach every worker at once (revoked token)
+    ENDPOINT_CACHE = TwoTierCache("endpoint", timeout=24 * 60 * 60, negative_timeout=10, local_timeout=0)
+    TOKEN_CACHE = TwoTierCache("token", timeout=24 * 60 * 60, negative_timeout=10, local_timeout=0)
+    ACCESS_TOKEN_CACHE_KEY = "access_token"
+    # campaign pickers, per tenant and status
+    CAMPAIGN_CACHE = TwoTierCache("campaigns", timeout=60, negative_timeout=10, local_timeout=30)
+    CAMPAIGN_FIELDS = "campaigns.id,campaigns.settings.title,total_items"
+    CAMPAIGN_PAGE_SIZE = 1000
+
+    # set by MailChimpSyncExecutor to share the account limits between workers
+    rate_limiter = None
+
     # Status codes
     GENERIC_SUCCESS_CODE = 200
     BAD_REQUEST_CODE = 400
+    SERVER_ERROR_CODE = 500
+
+    # shared by every account, trips when mailchimp itself is degraded
+    GLOBAL_CIRCUIT = CircuitBreaker("global", failure_threshold=20)
 
     def __init__(self, *args, **kwargs):
-        self.retailer_config = RetailerConfig.get_solo()
+        self._retailer_config = None
+
+    @property
+    def retailer_config(self):
+        # loaded on first use, regular calls only need the cached token and endpoint
+        if self._retailer_config is None:
+            self._retailer_config = RetailerConfig.get_solo()
+        return self._retailer_config
+
+    #function to get the access token of the current tenant
+    def get_access_token(self):
+        return self.TOKEN_CACHE.get_or_resolve(
+            self.ACCESS_TOKEN_CACHE_KEY, lambda: self.retailer_config.mailchimp_access_token or None) or ""
+
+    DEFAULT_LOG_DATA = {
+        'client': "mailchimp",
+        'customer_email': "",
+        "request_body": "",
+        "response_body": "",
+        "response_time": float(0.00),  # monotonic seconds
+        "request_url": "",
+        "request_method": "",
+        "response_code": "",  # response.status_code
+        "timeout": MAILCHIMP_REQUEST_TIMEOUT,
+        "exception_msg": "",
+        "exception_type": ""  # e.__class__.__name__
+    }
 
     def get_log_data(self, extra_data={}):
-        default_log_data = {
-            'client': "mailchimp",
-            'schema_name': connection.schema_name,
-            'customer_email': "",
-            "request_body": "",
-            "response_body": "",
-            "response_time": float(0.00),  # elapsed.total_seconds()
-            "request_url": "",
-            "request_method": "",
-            "response_code": "",  # response.status_code
-            "timeout": MAILCHIMP_REQUEST_TIMEOUT,
-            "exception_msg": "",
-            "exception_type": ""  # e.__class__.__name__
-        }
+        default_log_data = dict(self.DEFAULT_LOG_DATA, schema_name=connection.schema_name)
         default_log_data.update(extra_data)
         return default_log_data
 
     #common function to send api request to mailchimp server
     def make_api_request(self, url, data, method="POST"):
         json_data = {}
+        path = url
         try:
             url = self.get_api_endpoint() + url
-            logger.info("Sending request to MailChimp: %s - %s - %s", url, method, data, extra=self.get_log_data())
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Sending request to MailChimp: %s - %s - %s", redact_url(url), method, LazyBody(data),
+                             extra=self.get_log_data())
+            started = time.monotonic()
             response = self.get_api_response(url, data, method)
+            response_time = time.monotonic() - started
             json_data = json.loads(response.text)
-            extra_data = {
-                "request_body": str(data),
-                "response_body": str(json_data),
-                "response_time": response.elapsed.total_seconds(),
-                "request_url": url,
-                "response_code": response.status_code,
-            }
-            logger.info('API Request & Response', extra=self.get_log_data(extra_data))
+            if self.is_error_response(json_data):
+                log_level = logging.ERROR
+            else:
+                log_level = logging.INFO if should_log_success() else None
+            if log_level and logger.isEnabledFor(log_level):
+                extra_data = {
+                    "request_body": LazyBody(data),
+                    "response_body": LazyBody(json_data),
+                    "response_time": response_time,
+                    "request_url": redact_url(url),
+                    "request_method": method,
+                    "response_code": response.status_code,
+                }
+                logger.log(log_level, 'API Request & Response', extra=self.get_log_data(extra_data))
+        except CircuitOpen as e:
+            self.add_to_outbox(path, data, method, e)
+            logger.warning('MailChimp circuit open, request not sent', extra=self.get_log_data({
+                "request_method": method,
+                "request_url": redact_url(url),
+                "exception_type": e.__class__.__name__,
+            }))
         except Exception as e:
+            if isinstance(e, requests.RequestException):
+                self.add_to_outbox(path, data, method, e)
             extra_data = {
                 "exception_msg": six.text_type(e),
                 "exception_type": e.__class__.__name__,
                 "request_method": method,
-                "request_body": data,
-                "request_url": url,
+                "request_body": LazyBody(data),
+                "request_url": redact_url(url),
             }
             logger.error('Exception: Request', extra=self.get_log_data(extra_data), exc_info=True)
         return json_data
 
+    #function to keep a write that could not reach mailchimp for a later retry
+    def add_to_outbox(self, path, data, method, error):
+        if method != "GET":
+            MailChimpOutbox.enqueue(path, data, method, six.text_type(error))
+
+    def get_circuits(self):
+        return [CircuitBreaker("account:{}".format(connection.schema_name)), self.GLOBAL_CIRCUIT]
+
     #function to get response from mailchimp
     def get_api_response(self, url, data, method):
+        circuits = self.get_circuits()
+        for circuit in circuits:
+            if not circuit.allow_request():
+                raise CircuitOpen("MailChimp circuit {} is open".format(circuit.name))
+        try:
+            if self.rate_limiter is None:
+                response = self.send_api_request(url, data, method)
+            else:
+                response = self.rate_limiter.call(self.send_api_request, url, data, method)
+        except requests.RequestException:
+            for circuit in circuits:
+                circuit.record_failure()
+            raise
+        for circuit in circuits:
+            if response.status_code >= self.SERVER_ERROR_CODE:
+                circuit.record_failure()
+            else:
+                circuit.record_success()
+        return response
+
+    #function to send the http request to mailchimp
+    def send_api_request(self, url, data, method):
         if method == "GET":
             response = requests.get(url, params=data,
                                     headers={"content-type": "application/json",
-                                             "Authorization": "OAuth " + self.retailer_config.mailchimp_access_token},
+                                             "Authorization": "OAuth " + self.get_access_token()},
                                     timeout=MAILCHIMP_REQUEST_TIMEOUT)
         else:
-            response = requests.post(url, data=json.dumps(data),
-                                     headers={"content-type": "application/json",
-                                              "Authorization": "OAuth " + self.retailer_config.mailchimp_access_token},
-                                     timeout=MAILCHIMP_REQUEST_TIMEOUT)
+            # POST, PUT (upsert) and PATCH all send a json body
+            response = requests.request(method, url, data=json.dumps(data),
+                                        headers={"content-type": "application/json",
+                                                 "Authorization": "OAuth " + self.get_access_token()},
+                                        timeout=MAILCHIMP_REQUEST_TIMEOUT)
         return response
+
+    #function to check if mailchimp returned an error document
+    @staticmethod
+    def is_error_response(json_data):
+        return not json_data or isinstance(json_data.get('status'), int) and json_data['status'] >= 400
+
+    #function to upsert a resource only if its content changed since the last sync
+    def sync_resource(self, resource_type, store_id, resource_id, url, data):
+        if MailChimpSyncLedger.is_synced(resource_type, resource_id, data, store_id):
+            return None
+        json_data = self.make_api_request(url, data, "PUT")
+        if not self.is_error_response(json_data):
+            MailChimpSyncLedger.mark_synced(resource_type, resource_id, data, store_id)
+        else:
+            self.check_store_not_found(store_id, json_data)
+        return json_data
+
+    #function to forget a memoized store when mailchimp says it does not exist anymore
+    def check_store_not_found(self, store_id, json_data):
+        if json_data and json_data.get('status') == 404:
+            self.invalidate_store(store_id)
+            return True
+        return False
+
+    @classmethod
+    def invalidate_store(cls, store_id):
+        cls.STORE_CACHE.invalidate(store_id)
+        # a re-created store is empty, its products and customers must be pushed again
+        MailChimpSyncLedger.invalidate(MailChimpSyncLedger.PRODUCT, store_id=store_id)
+        MailChimpSyncLedger.invalidate(MailChimpSyncLedger.CUSTOMER, store_id=store_id)
+        MailChimpSyncLedger.invalidate(MailChimpSyncLedger.STORE, resource_id=store_id)
     
     #function to post data to mailchimp in baches
     def create_in_batches(self, data, url, method="POST"):
         operations_data = []
         for d in data:
             operations_data.append({
-                "method": "POST",
-                "body": str(d),
+                "method": method,
+                "body": json.dumps(d),
                 "path": url
             })
-        return self.make_api_request(self.BATCH_URL, {"operations": operations_data})
+        return self.create_batch_operations(operations_data)
+
+    #function to post prepared batch operations, `operations` can be any iterable
+    def create_batch_operations(self, operations):
+        return self.make_api_request(self.BATCH_URL, {"operations": list(operations)})
+
+    #function to read the state of a batch operation
+    def get_batch(self, batch_id):
+        return self.make_api_request(self.BATCH_URL + "/" + batch_id, {}, "GET")
+
+    #function to wait for a batch operation to finish, returns the last state read
+    def wait_for_batch(self, batch_id, timeout=None, interval=None):
+        timeout = timeout or getattr(settings, 'MAILCHIMP_BATCH_TIMEOUT', 10 * 60)
+        interval = interval or getattr(settings, 'MAILCHIMP_BATCH_POLL_INTERVAL', 2)
+        deadline = time.monotonic() + timeout
+        while True:
+            batch = self.get_batch(batch_id)
+            if batch.get('status') == 'finished' or time.monotonic() >= deadline:
+                return batch
+            time.sleep(interval)
+
+    #function to read the status code of every operation of a finished batch, by `operation_id`
+    def get_batch_results(self, batch):
+        response = requests.get(batch["response_body_url"], timeout=MAILCHIMP_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        results = {}
+        with tarfile.open(fileobj=io.BytesIO(response.content), mode="r:gz") as archive:
+            for member in archive.getmembers():
+                if not member.isfile():
+                    continue
+                for result in json.load(archive.extractfile(member)):
+                    results[result.get("operation_id")] = result.get("status_code")
+        return results
 
     #function to create products in mailchimp ecommerce
     def create_products(self, store_id, product):
         data = {
-            "id": product.id,
+            "id": str(product.id),
             "title": product.name,
             "variants": [{
-                "id": product.product.id,
+                "id": str(product.product.id),
                 "title": product.product.name,
             }]
         }
-        return self.make_api_request(MailChimpHelperClient.STORES_URL + "/" + store_id + "/products", data)
+        return self.sync_product(store_id, data)
 
-    #function to create customers in mailchimp ecommerce
-    def create_customer(self, customer, store_id):
-        data = {
+    #function to upsert a product payload in mailchimp ecommerce
+    def sync_product(self, store_id, data):
+        return self.sync_resource(
+            MailChimpSyncLedger.PRODUCT, store_id, data["id"],
+            MailChimpHelperClient.STORES_URL + "/" + store_id + "/products/" + data["id"], data)
+
+    #function to build the mailchimp payload of a customer
+    @staticmethod
+    def get_customer_data(customer):
+        return {
             "id": str(customer.email),
             "email_address": customer.email,
             "opt_in_status": True,
             "first_name": customer.first_name,
             "last_name": customer.last_name,
         }
-        return self.make_api_request(MailChimpHelperClient.STORES_URL + "/" + store_id + "/customers", data)
+
+    #function to create customers in mailchimp ecommerce
+    def create_customer(self, customer, store_id):
+        return self.sync_customer(store_id, self.get_customer_data(customer))
+
+    #function to upsert a customer payload in mailchimp ecommerce
+    def sync_customer(self, store_id, data):
+        return self.sync_resource(
+            MailChimpSyncLedger.CUSTOMER, store_id, data["id"],
+            MailChimpHelperClient.STORES_URL + "/" + store_id + "/customers/" + data["id"], data)
+
+    #function to build the mailchimp product payload of an order line
+    @staticmethod
+    def get_line_product_data(line):
+        product_id = str(line.retailer_product.product.internal_item_number)
+        product_title = str(line.retailer_product.product.title)
+        return {
+            "id": product_id,
+            "title": product_title,
+            "vendor": str(line.retailer_product.product.brand.name),
+            "variants": [{
+                "id": product_id,
+                "title": product_title,
+            }]
+        }
+
+    #function to build the mailchimp payload of an order
+    @staticmethod
+    def get_order_data(order, customer_id, campaign_id=None):
+        line_data = []
+        for line in order.lines.all():
+            product_id = str(line.retailer_product.product.internal_item_number)
+            line_data.append({
+                "id": str(line.id),
+                "product_id": product_id,
+                "product_variant_id": product_id,
+                "quantity": line.quantity,
+                "price": str(line.line_price_incl_tax)
+            })
+        data = {
+            "id": str(order.id),
+            "customer": {
+                "id": str(customer_id)
+            },
+            "currency_code": get_default_retailer_currency(),
+            "order_total": str(order.total_incl_tax),
+            "lines": line_data,
+        }
+        if campaign_id:
+            data["campaign_id"] = campaign_id
+        return data
 
     #function to create order in mailchimp ecommerce
     def create_order(self, order, customer, campaign_id=None):
-        line_data = []
         store_id = self.create_store(order.store)
         if store_id:
             for line in order.lines.all():
-                product_id = str(line.retailer_product.product.internal_item_number)
-                product_title = str(line.retailer_product.product.title)
-                products_data = {
-                    "id": product_id,
-                    "title": product_title,
-                    "vendor": str(line.retailer_product.product.brand.name),
-                    "variants": [{
-                        "id": product_id,
-                        "title": product_title,
-                    }]
-                }
-                mailchimp_product = self.make_api_request(
-                    MailChimpHelperClient.STORES_URL + "/" + store_id + "/products", products_data)
-                line_data.append({
-                    "id": str(line.id),
-                    "product_id": product_id,
-                    "product_variant_id": product_id,
-                    "quantity": line.quantity,
-                    "price": str(line.line_price_incl_tax)
-                })
-            # batch_data = self.create_in_batches(json.dumps(list(set(products_data))),
-            #                                     MailChimpHelperClient.STORES_URL + "/" + store_id + "/products")
+                mailchimp_product = self.sync_product(store_id, self.get_line_product_data(line))
             mailchimp_customer_response = self.create_customer(customer, store_id)
-            if campaign_id:
-                data = {
-                    "id": str(order.id),
-                    "customer": {
-                        "id": str(customer.email)
-                    },
-                    "currency_code": get_default_retailer_currency(),
-                    "order_total": str(order.total_incl_tax),
-                    "lines": line_data,
-                    "campaign_id": campaign_id
-                }
-            else:
-                data = {
-                    "id": str(order.id),
-                    "customer": {
-                        "id": str(customer.email)
-                    },
-                    "currency_code": get_default_retailer_currency(),
-                    "order_total": str(order.total_incl_tax),
-                    "lines": line_data,
-                }
-            self.make_api_request(MailChimpHelperClient.STORES_URL + "/" + store_id + "/orders", data)
+            data = self.get_order_data(order, customer.email, campaign_id)
+            mailchimp_order = self.make_api_request(
+                MailChimpHelperClient.STORES_URL + "/" + store_id + "/orders", data)
+            self.check_store_not_found(store_id, mailchimp_order)
 
     #function to create stores in mailchimp ecommerce
     def create_store(self, store):
         store_id = "{}_{}".format(store.retailer.schema_name, store.id)
+        return self.STORE_CACHE.get_or_resolve(store_id, lambda: self.resolve_store(store_id, store))
+
+    #function to look up the store in mailchimp and create it when missing
+    def resolve_store(self, store_id, store):
         data = {
             "id": str(store_id),
             "list_id": self.retailer_config.mail_chimp_list_id,
@@ -201,6 +377,8 @@ class MailChimpHelperClient:
             "email_address": store.email,
             "currency_code": get_default_retailer_currency()
         }
+        if MailChimpSyncLedger.is_synced(MailChimpSyncLedger.STORE, store_id, data):
+            return store_id
         try:
             mailchimp_store = self.make_api_request(MailChimpHelperClient.STORES_URL + "/" + str(store_id), {}, "GET")
             if mailchimp_store.get('status', '') == 404:
@@ -209,8 +387,9 @@ class MailChimpHelperClient:
             elif mailchimp_store.get('id'):
                 store_id = mailchimp_store['id']
             else:
-                logger.error('Exception: Request', extra=self.get_log_data({'response_body': mailchimp_store}))
+                logger.error('Exception: Request', extra=self.get_log_data({'response_body': LazyBody(mailchimp_store)}))
                 return None
+            MailChimpSyncLedger.mark_synced(MailChimpSyncLedger.STORE, store_id, data)
         except Exception as e:
             extra_data = {
                 "exception_msg": six.text_type(e),
@@ -222,6 +401,14 @@ class MailChimpHelperClient:
 
     #function to create list/audience in mailchimp
     def create_list(self, retailer):
+        mailchimp_list_id = self.LIST_CACHE.get_or_resolve(self.LIST_CACHE_KEY, lambda: self.resolve_list(retailer))
+        if mailchimp_list_id and not self.retailer_config.mail_chimp_list_id:
+            # resolved by another worker, which saved it to the config
+            self.retailer_config.mail_chimp_list_id = mailchimp_list_id
+        return mailchimp_list_id
+
+    #function to look up the list/audience in mailchimp and create it when missing
+    def resolve_list(self, retailer):
         mailchimp_list_id = None
         if retailer.get_default_store:
             store = retailer.get_default_store
@@ -259,12 +446,12 @@ class MailChimpHelperClient:
                         mailchimp_list_id = self.retailer_config.mail_chimp_list_id
                     else:
                         extra_data = {
-                            'response_body': str(mailchimp_list)
+                            'response_body': LazyBody(mailchimp_list)
                         }
                         logger.error('Could not create list', extra=self.get_log_data(extra_data))
                 else:
                     extra_data = {
-                        'response_body': str(mailchimp_list)
+                        'response_body': LazyBody(mailchimp_list)
                     }
                     logger.error('Could not create list', extra=self.get_log_data(extra_data))
             except Exception as e:
@@ -277,17 +464,16 @@ class MailChimpHelperClient:
 
     @classmethod
     def delete_data_store_url(cls):
-        cache.delete(cls.DATA_STORE_URL_CACHE_KEY)
+        cls.ENDPOINT_CACHE.invalidate(cls.DATA_STORE_URL_CACHE_KEY)
+        cls.TOKEN_CACHE.invalidate(cls.ACCESS_TOKEN_CACHE_KEY)
 
     def get_api_endpoint(self):
-        if cache.get("mail_chimp_api_url") is None:
-            response = self.get_api_response(self.OAUTH2_METADATA_URL, {}, 'GET')
-            json_response = response.json()
-            cache.set(self.DATA_STORE_URL_CACHE_KEY, json_response["api_endpoint"])
-            api_endpoint = json_response["api_endpoint"]
-        else:
-            api_endpoint = cache.get(self.DATA_STORE_URL_CACHE_KEY)
-        return api_endpoint
+        return self.ENDPOINT_CACHE.get_or_resolve(self.DATA_STORE_URL_CACHE_KEY, self.fetch_api_endpoint)
+
+    #function to get the datacenter endpoint of the connected account from mailchimp
+    def fetch_api_endpoint(self):
+        response = self.get_api_response(self.OAUTH2_METADATA_URL, {}, 'GET')
+        return response.json().get("api_endpoint")
 
     #function to get access token from mailchimp
     def connect_with_mailchimp(self, request, retailer, code):
@@ -306,6 +492,8 @@ class MailChimpHelperClient:
                 response = response.json()
                 retailer_config.mailchimp_access_token = response['access_token']
                 retailer_config.save()
+                # new token may belong to an account on another datacenter
+                self.delete_data_store_url()
             else:
                 messages.error(request, _('Mailchimp connection has failed. Please try again later.'))
                 return
@@ -336,8 +524,7 @@ class MailChimpHelperClient:
             "first_name": data["customer"]["first_name"],
             "last_name": data["customer"]["last_name"],
         }
-        customer_mailchimp_response = self.make_api_request(
-            MailChimpHelperClient.STORES_URL + "/" + store_id + "/customers", customer_data)
+        customer_mailchimp_response = self.sync_customer(store_id, customer_data)
         for line in data["lines"]:
             try:
                 product = Product.objects.get(internal_item_number=line["etp_id"])
@@ -350,8 +537,7 @@ class MailChimpHelperClient:
                         "title": str(product.title),
                     }]
                 }
-                mailchimp_product = self.make_api_request(
-                    MailChimpHelperClient.STORES_URL + "/" + store_id + "/products", products_data)
+                mailchimp_product = self.sync_product(store_id, products_data)
                 line_data.append({
                     "id": "POS_" + str(line["id"]),
                     "product_id": str(line["etp_id"]),
@@ -380,19 +566,31 @@ class MailChimpHelperClient:
             order_mailchimp_response = self.make_api_request(
                 MailChimpHelperClient.STORES_URL + "/" + store_id + "/orders",
                 order_data)
+            self.check_store_not_found(store_id, order_mailchimp_response)
 
     #function to get active campaigns in mailchimp
-    def get_mailchimp_campaigns(self):
+    def get_mailchimp_campaigns(self, status="save"):
+        campaigns = self.CAMPAIGN_CACHE.get_or_resolve(status, lambda: self.fetch_campaigns(status)) or []
+        return [{"no": i + 1, "id": campaign["id"], "name": campaign["name"]}
+                for i, campaign in enumerate(campaigns)]
+
+    #function to page through the campaigns of a status, only the fields we show
+    def fetch_campaigns(self, status):
         campaigns = []
-        mailchimp_campaigns = self.make_api_request(MailChimpHelperClient.CAMPAIGN_URL, {}, "GET")
-        if mailchimp_campaigns.get('campaigns') and len(mailchimp_campaigns['campaigns']):
-            i = 0
+        offset = 0
+        while True:
+            params = {
+                "status": status,
+                "fields": self.CAMPAIGN_FIELDS,
+                "count": self.CAMPAIGN_PAGE_SIZE,
+                "offset": offset,
+            }
+            mailchimp_campaigns = self.make_api_request(MailChimpHelperClient.CAMPAIGN_URL, params, "GET")
+            if 'campaigns' not in mailchimp_campaigns:
+                # error page, don't cache a partial list
+                return None
             for campaign in mailchimp_campaigns['campaigns']:
-                if campaign['status'] == 'save':
-                    campaigns.append({
-                        "no": i + 1,
-                        "id": campaign['id'],
-                        "name": campaign['settings']['title']
-                    })
-        return campaigns
-                   
\ No newline at end of file
+                campaigns.append({"id": campaign['id'], "name": campaign['settings']['title']})
+            offset += self.CAMPAIGN_PAGE_SIZE
+            if not mailchimp_campaigns['campaigns'] or offset >= mailchimp_campaigns.get('total_items', 0):
+                return campaigns
@@ -0,0 +1,208 @@
+import logging
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+from tenant_schemas.utils import schema_context
+
+logger = logging.getLogger('third_party_api_call_logger')
+
+TOO_MANY_REQUESTS_CODE = 429
+
+
+class AccountRateLimiter:
+    """ Limits the traffic of one Mailchimp account across every worker.
+        State lives in the shared cache:
+        - `max_connections` connection leases (Mailchimp allows 10
+          simultaneous connections per account), each a key expiring on its
+          own should its holder die,
+        - a token bucket refilled at `rate` tokens per second and holding at
+          most `burst`, so no second sees more than `burst + rate` requests,
+        - a back off deadline raised on every 429 and relaxed on success.
+    """
+    SLOT_TIMEOUT = 5 * 60
+    BUCKET_TIMEOUT = 60
+    BUCKET_LOCK_TIMEOUT = 1
+
+    def __init__(self, account, max_connections=None, rate=None, max_retries=5,
+                 base_backoff=1.0, max_backoff=60.0, burst=None):
+        self.account = account
+        self.max_connections = max_connections or getattr(settings, 'MAILCHIMP_MAX_CONNECTIONS', 10)
+        self.rate = rate or getattr(settings, 'MAILCHIMP_REQUESTS_PER_SECOND', 10)
+        self.burst = burst or getattr(settings, 'MAILCHIMP_REQUEST_BURST', 1)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+    def make_key(self, name):
+        return "mailchimp:ratelimit:{}:{}".format(self.account, name)
+
+    def wait_for_backoff(self):
+        backoff_until = cache.get(self.make_key("backoff_until"))
+        if backoff_until:
+            delay = backoff_until - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def take_token(self):
+        """ Takes a token from the bucket, returns 0 or the seconds to wait
+            before the next one is available
+        """
+        lock_key = self.make_key("bucket:lock")
+        # the bucket is read and written back, one worker at a time
+        delay = 0.002
+        while not cache.add(lock_key, 1, self.BUCKET_LOCK_TIMEOUT):
+            time.sleep(delay + random.random() * delay)
+            delay = min(delay * 2, 0.05)
+        try:
+            key = self.make_key("bucket")
+            now = time.time()
+            tokens, updated = cache.get(key) or (self.burst, now)
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                cache.set(key, (tokens - 1, now), self.BUCKET_TIMEOUT)
+                return 0
+            cache.set(key, (tokens, now), self.BUCKET_TIMEOUT)
+            return (1 - tokens) / self.rate
+        finally:
+            cache.delete(lock_key)
+
+    def acquire_token(self):
+        while True:
+            wait = self.take_token()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def acquire_slot(self):
+        """ Key of the connection lease taken, waits while all are held
+        """
+        while True:
+            # a random first slot spreads the workers over the leases
+            first = random.randrange(self.max_connections)
+            for i in range(self.max_connections):
+                key = self.make_key("connections:{}".format((first + i) % self.max_connections))
+                if cache.add(key, 1, self.SLOT_TIMEOUT):
+                    return key
+            time.sleep(0.05 + random.random() * 0.05)
+
+    def release_slot(self, key):
+        cache.delete(key)
+
+    def register_throttle(self):
+        key = self.make_key("throttled")
+        cache.add(key, 0, self.SLOT_TIMEOUT)
+        try:
+            throttled = cache.incr(key)
+        except ValueError:
+            throttled = 1
+        delay = min(self.base_backoff * 2 ** (throttled - 1), self.max_backoff)
+        delay += random.random() * self.base_backoff
+        cache.set(self.make_key("backoff_until"), time.time() + delay, int(delay) + 1)
+        logger.warning("MailChimp throttled account %s, backing off %.1fs", self.account, delay)
+
+    def register_success(self):
+        key = self.make_key("throttled")
+        if cache.get(key):
+            try:
+                cache.decr(key)
+            except ValueError:
+                pass
+
+    #function to send a request within the account limits, retrying on 429
+    def call(self, send, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.wait_for_backoff()
+            self.acquire_token()
+            slot = self.acquire_slot()
+            try:
+                response = send(*args, **kwargs)
+            finally:
+                self.release_slot(slot)
+            if response.status_code != TOO_MANY_REQUESTS_CODE:
+                self.register_success()
+                return response
+            self.register_throttle()
+        return response
+
+
+class MailChimpSyncExecutor:
+    """ Runs `MailChimpHelperClient` operations concurrently for one tenant.
+        usage:
+            executor = MailChimpSyncExecutor()
+            executor.run(lambda client, order: client.create_order(order, order.user), orders)
+        Every HTTP call of the worker threads goes through the account limiter,
+        so several executors (or workers) can share one Mailchimp account.
+    """
+
+    def __init__(self, client_class=None, max_workers=None, schema_name=None, rate_limiter=None):
+        if client_class is None:
+            from .client import MailChimpHelperClient
+            client_class = MailChimpHelperClient
+        self.client_class = client_class
+        self.schema_name = schema_name or connection.schema_name
+        self.rate_limiter = rate_limiter or AccountRateLimiter(self.schema_name)
+        self.max_workers = max_workers or self.rate_limiter.max_connections
+
+    def get_client(self):
+        client = self.client_class()
+        client.rate_limiter = self.rate_limiter
+        return client
+
+    def call(self, operation, item):
+        try:
+            with schema_context(self.schema_name):
+                return operation(self.get_client(), item)
+        finally:
+            # worker threads open their own connections, don't leave them behind
+            connections.close_all()
+
+    #function to run `operation(client, item)` for every item, yields (item, result or exception)
+    def run(self, operation, items):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {}
+            for item in items:
+                futures[pool.submit(self.call, operation, item)] = item
+                if len(futures) >= self.max_workers * 2:
+                    # keep a bounded number of pending calls for large iterables
+                    yield from self._collect(futures, wait_all=False)
+            yield from self._collect(futures, wait_all=True)
+
+    #function to run `operation(client, item)` with at most `max_workers` calls in flight,
+    # yields (item, result or exception) in the order of `items`
+    def run_ordered(self, operation, items):
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            try:
+                for item in items:
+                    pending.append((item, pool.submit(self.call, operation, item)))
+                    if len(pending) >= self.max_workers:
+                        yield self._result(*pending.popleft())
+                while pending:
+                    yield self._result(*pending.popleft())
+            finally:
+                # the caller stopped early, the calls not started yet are dropped
+                for item, future in pending:
+                    future.cancel()
+
+    def _result(self, item, future):
+        try:
+            return item, future.result()
+        except Exception as e:
+            logger.error('Exception: MailChimp sync operation', exc_info=True)
+            return item, e
+
+    def _collect(self, futures, wait_all):
+        for future in as_completed(list(futures)):
+            item = futures.pop(future)
+            try:
+                yield item, future.result()
+            except Exception as e:
+                logger.error('Exception: MailChimp sync operation', exc_info=True)
+                yield item, e
+            if not wait_all:
+                return
@@ -0,0 +1,226 @@
+""" Local stand-in for the Mailchimp API, used to load-test the sync client.
+
+    Implements the endpoints `MailChimpHelperClient` talks to:
+    OAuth metadata, ecommerce stores/products/customers/orders, lists,
+    campaigns and batches. Latency, 429s and 5xx errors can be injected.
+
+    Standalone:
+        python fake_server.py --port 8765 --latency 0.05 --throttle-rate 0.01
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STORE_RESOURCE_RE = re.compile(
+    r'^/3\.0/ecommerce/stores/(?P<store>[^/]+)/(?P<kind>products|customers|orders)(?:/(?P<id>[^/]+))?/?$')
+STORE_RE = re.compile(r'^/3\.0/ecommerce/stores(?:/(?P<store>[^/]+))?/?$')
+
+
+class FakeMailChimpState:
+    """ In-memory data of the fake server plus the fault injection settings.
+    """
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, error_rate=0.0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.stores = {}
+        self.lists = {}
+        self.batches = {}
+        self.campaigns = []
+        self.calls = Counter()
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls.clear()
+
+    @property
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+
+class FakeMailChimpHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, title, detail=""):
+        self.send_json(status, {"status": status, "title": title, "detail": detail})
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError:
+            return {}
+
+    def handle_method(self, method):
+        path, _, query = self.path.partition("?")
+        # always drain the body, keep-alive connections are reused
+        data = self.read_body() if method != "GET" else {}
+        with self.state.lock:
+            self.state.calls[method] += 1
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        if self.state.throttle_rate and random.random() < self.state.throttle_rate:
+            return self.send_error_json(429, "Too Many Requests")
+        if self.state.error_rate and random.random() < self.state.error_rate:
+            return self.send_error_json(503, "Service Unavailable")
+        if path.startswith("/oauth2/metadata"):
+            host = "http://{}:{}".format(*self.server.server_address[:2])
+            return self.send_json(200, {"dc": "fake", "api_endpoint": host, "login_url": host})
+        if path.startswith("/3.0/batches/") and method == "GET":
+            return self.handle_batch_status(path.rsplit("/", 1)[-1])
+        if path.startswith("/3.0/batches"):
+            return self.handle_batch(data)
+        if path.startswith("/3.0/lists"):
+            return self.handle_lists(method, data)
+        if path.startswith("/3.0/campaigns"):
+            return self.send_json(200, {"campaigns": self.state.campaigns,
+                                        "total_items": len(self.state.campaigns)})
+        match = STORE_RESOURCE_RE.match(path)
+        if match:
+            return self.handle_store_resource(method, match.group('store'), match.group('kind'),
+                                              match.group('id'), data)
+        match = STORE_RE.match(path)
+        if match:
+            return self.handle_store(method, match.group('store'), data)
+        return self.send_error_json(404, "Resource Not Found")
+
+    def handle_store(self, method, store_id, data):
+        stores = self.state.stores
+        if method == "GET":
+            if store_id not in stores:
+                return self.send_error_json(404, "Resource Not Found")
+            return self.send_json(200, stores[store_id]["store"])
+        store_id = store_id or str(data.get("id"))
+        if method == "POST" and store_id in stores:
+            return self.send_error_json(400, "Store Exists")
+        stores[store_id] = {"store": dict(data, id=store_id), "products": {}, "customers": {}, "orders": {}}
+        return self.send_json(200, stores[store_id]["store"])
+
+    def handle_store_resource(self, method, store_id, kind, resource_id, data):
+        if store_id not in self.state.stores:
+            return self.send_error_json(404, "Resource Not Found")
+        resources = self.state.stores[store_id][kind]
+        if method == "GET":
+            if resource_id:
+                if resource_id not in resources:
+                    return self.send_error_json(404, "Resource Not Found")
+                return self.send_json(200, resources[resource_id])
+            return self.send_json(200, {kind: list(resources.values()), "total_items": len(resources)})
+        resource_id = resource_id or str(data.get("id"))
+        if method == "POST" and resource_id in resources:
+            return self.send_error_json(400, "{} Exists".format(kind[:-1].title()))
+        resources[resource_id] = dict(data, id=resource_id)
+        return self.send_json(200, resources[resource_id])
+
+    def handle_lists(self, method, data):
+        if method == "GET":
+            return self.send_json(200, {"lists": list(self.state.lists.values()),
+                                        "total_items": len(self.state.lists)})
+        list_id = uuid.uuid4().hex[:10]
+        self.state.lists[list_id] = dict(data, id=list_id)
+        return self.send_json(200, self.state.lists[list_id])
+
+    def handle_batch(self, data):
+        batch_id = uuid.uuid4().hex[:10]
+        operations = data.get("operations", [])
+        self.state.batches[batch_id] = operations
+        return self.send_json(200, {"id": batch_id, "status": "pending",
+                                    "total_operations": len(operations)})
+
+    def handle_batch_status(self, batch_id):
+        # the batches are only recorded, every operation is reported as succeeded
+        if batch_id not in self.state.batches:
+            return self.send_error_json(404, "Resource Not Found")
+        total = len(self.state.batches[batch_id])
+        return self.send_json(200, {"id": batch_id, "status": "finished", "total_operations": total,
+                                    "finished_operations": total, "errored_operations": 0})
+
+    def do_GET(self):
+        self.handle_method("GET")
+
+    def do_POST(self):
+        self.handle_method("POST")
+
+    def do_PUT(self):
+        self.handle_method("PUT")
+
+    def do_PATCH(self):
+        self.handle_method("PATCH")
+
+
+class FakeMailChimpServer:
+    """ Runs the fake API on a background thread.
+        usage:
+            with FakeMailChimpServer(latency=0.05) as server:
+                server.url  # http://127.0.0.1:<port>
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, **fault_kwargs):
+        self.state = FakeMailChimpState(**fault_kwargs)
+        self.httpd = ThreadingHTTPServer((host, port), FakeMailChimpHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = self.state
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.httpd.server_address[:2])
+
+    @property
+    def metadata_url(self):
+        return self.url + "/oauth2/metadata"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Mailchimp API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeMailChimpServer(args.host, args.port, latency=args.latency,
+                                 throttle_rate=args.throttle_rate, error_rate=args.error_rate)
+    print("Fake Mailchimp listening on {}".format(server.url))
+    server.httpd.serve_forever()
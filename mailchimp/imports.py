@@ -0,0 +1,157 @@
+import json
+import logging
+import time
+
+from django.utils import timezone
+
+from apps.products.models import Product
+
+from .client import MailChimpHelperClient
+from .executor import MailChimpSyncExecutor
+from .models import MailChimpImportJob, MailChimpSyncLedger
+
+logger = logging.getLogger('third_party_api_call_logger')
+
+PRODUCT_IMPORT_CHUNK_SIZE = 500
+
+
+#function to stream products in primary key order, one chunk at a time
+def iter_product_chunks(after_pk=0, chunk_size=PRODUCT_IMPORT_CHUNK_SIZE):
+    last_pk = after_pk
+    while True:
+        chunk = list(Product.objects.filter(pk__gt=last_pk).select_related('brand').order_by('pk')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+#function to build the mailchimp upsert payload of a product
+def get_product_data(product):
+    product_id = str(product.internal_item_number)
+    product_title = str(product.title)
+    return {
+        "id": product_id,
+        "title": product_title,
+        "vendor": str(product.brand.name) if product.brand_id else "",
+        "variants": [{
+            "id": product_id,
+            "title": product_title,
+        }]
+    }
+
+
+def get_product_operations(store_id, payloads):
+    url = MailChimpHelperClient.STORES_URL + "/" + store_id + "/products/"
+    for data in payloads.values():
+        yield {
+            "method": "PUT",
+            "path": url + data["id"],
+            "body": json.dumps(data),
+            "operation_id": data["id"],
+        }
+
+
+#function to wait for a batch and return the ids of the operations that succeeded
+def get_succeeded_ids(client, batch, operation_ids):
+    batch = client.wait_for_batch(batch["id"])
+    if batch.get('status') != 'finished':
+        raise ValueError("MailChimp batch {} did not finish in time".format(batch.get('id')))
+    if not batch.get('errored_operations'):
+        return set(operation_ids)
+    results = client.get_batch_results(batch)
+    return {operation_id for operation_id in operation_ids
+            if 200 <= (results.get(operation_id) or 0) < 300}
+
+
+class ProductCatalogImport:
+    """ Resumable import of the whole product catalog to a Mailchimp store.
+        Products are read in keyset ordered chunks and every chunk is sent as one
+        batch operation, less the products the sync ledger has with the same
+        payload for the store. The batches are sent by a `MailChimpSyncExecutor`, several
+        in flight within the account limits, and handled in chunk order. A worker
+        waits for its batch to finish; only the products whose operation succeeded
+        are marked in the ledger, the failed ones are counted and sent again by the
+        next run. The checkpoint moves only after the batch finished, so a crashed
+        import resumes with the first unfinished chunk.
+    """
+
+    def __init__(self, store, client=None, chunk_size=PRODUCT_IMPORT_CHUNK_SIZE, executor=None):
+        self.store = store
+        self.client = client or MailChimpHelperClient()
+        self.chunk_size = chunk_size
+        self.executor = executor or MailChimpSyncExecutor(client_class=type(self.client))
+
+    def get_job(self, store_id, restart=False):
+        job, created = MailChimpImportJob.objects.get_or_create(
+            job_type=MailChimpImportJob.PRODUCT_IMPORT, store_id=store_id)
+        if restart or job.status == MailChimpImportJob.COMPLETED:
+            job.last_pk = 0
+            job.processed = 0
+            job.batches = 0
+            job.failed = 0
+            job.started = timezone.now()
+        job.status = MailChimpImportJob.RUNNING
+        job.finished = None
+        job.total = Product.objects.count()
+        job.save()
+        return job
+
+    def run(self, restart=False):
+        store_id = self.client.create_store(self.store)
+        if not store_id:
+            logger.error('Could not import products, MailChimp store is missing',
+                         extra=self.client.get_log_data())
+            return None
+        job = self.get_job(store_id, restart)
+
+        def send_chunk(client, chunk):
+            payloads = {}
+            for product in chunk:
+                data = get_product_data(product)
+                payloads[data["id"]] = data
+            changed = MailChimpSyncLedger.get_changed(MailChimpSyncLedger.PRODUCT, payloads, store_id)
+            if not changed:
+                return None, 0.0, changed, set()
+            started = time.monotonic()
+            batch = client.create_batch_operations(get_product_operations(store_id, changed))
+            if not batch.get('id'):
+                raise ValueError("MailChimp did not accept the batch: {}".format(batch.get('detail', '')))
+            succeeded = get_succeeded_ids(client, batch, changed)
+            return batch, time.monotonic() - started, changed, succeeded
+
+        chunks = iter_product_chunks(job.last_pk, self.chunk_size)
+        try:
+            for chunk, result in self.executor.run_ordered(send_chunk, chunks):
+                if isinstance(result, Exception):
+                    raise result
+                batch, response_time, changed, succeeded = result
+                MailChimpSyncLedger.mark_synced_many(
+                    MailChimpSyncLedger.PRODUCT,
+                    {product_id: data for product_id, data in changed.items() if product_id in succeeded},
+                    store_id)
+                failed = sorted(set(changed) - succeeded)
+                if failed:
+                    logger.error('MailChimp product import %s: %s products failed in batch %s', store_id,
+                                 len(failed), batch['id'],
+                                 extra=self.client.get_log_data({"product_ids": failed[:100]}))
+                job.last_pk = chunk[-1].pk
+                job.processed += len(chunk)
+                job.batches += 1 if batch is not None else 0
+                job.failed += len(failed)
+                job.save(update_fields=['last_pk', 'processed', 'batches', 'failed', 'updated'])
+                extra_data = {
+                    "response_time": response_time,
+                    "progress": job.progress,
+                    "throughput": job.throughput,
+                }
+                logger.info('MailChimp product import %s: %s/%s products', store_id, job.processed, job.total,
+                            extra=self.client.get_log_data(extra_data))
+        except Exception:
+            job.status = MailChimpImportJob.FAILED
+            job.save(update_fields=['status', 'updated'])
+            raise
+        job.status = MailChimpImportJob.COMPLETED
+        job.finished = timezone.now()
+        job.save(update_fields=['status', 'finished', 'updated'])
+        return job
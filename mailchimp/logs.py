@@ -0,0 +1,120 @@
+import json
+import random
+import re
+
+from django.conf import settings
+
+REDACTED = "***"
+TRUNCATED = "...(truncated)"
+
+# keys whose values never reach the logs
+REDACTED_KEYS = frozenset((
+    'access_token', 'authorization', 'client_secret', 'code', 'password',
+    'email_address', 'email', 'phone', 'address1', 'address2',
+))
+
+# customers are keyed by their email: the `id` of customer payloads (those
+# with an `email_address` or under a `customer` key) and the customer or
+# member segment of URLs are redacted as well
+CUSTOMER_KEYS = frozenset(('customer',))
+URL_KEYS = frozenset(('path', 'url', 'request_url'))
+CUSTOMER_PATH_RE = re.compile(r'(/(?:customers|members)/)[^/?#]+')
+
+# keys whose string values are JSON documents, e.g. the `body` of the
+# operations of a batch, rendered (and redacted) as the parsed payload
+JSON_KEYS = frozenset(('body',))
+
+
+#function to mask the customer email or member hash of a Mailchimp URL
+def redact_url(url):
+    return CUSTOMER_PATH_RE.sub(r'\1' + REDACTED, str(url))
+
+
+def get_body_max_length():
+    return getattr(settings, 'MAILCHIMP_LOG_BODY_MAX_LENGTH', 2048)
+
+
+def get_success_sample_rate():
+    return getattr(settings, 'MAILCHIMP_LOG_SUCCESS_SAMPLE_RATE', 1.0)
+
+
+#function to decide if a successful call is logged, failures are always logged
+def should_log_success():
+    rate = get_success_sample_rate()
+    return rate >= 1 or random.random() < rate
+
+
+class LazyBody:
+    """ Request/response body for log records.
+        Rendered only when a handler formats the record, with sensitive keys
+        redacted and the output capped at `max_length` characters. Rendering
+        stops walking the payload once the cap is reached, so the cost does
+        not depend on the payload size.
+    """
+    __slots__ = ('data', 'max_length', '_rendered')
+
+    def __init__(self, data, max_length=None):
+        self.data = data
+        self.max_length = max_length or get_body_max_length()
+        self._rendered = None
+
+    def __str__(self):
+        if self._rendered is None:
+            parts = []
+            budget = [self.max_length]
+            self._render(self.data, parts, budget)
+            self._rendered = "".join(parts)
+            if budget[0] <= 0:
+                self._rendered = self._rendered[:self.max_length] + TRUNCATED
+        return self._rendered
+
+    __repr__ = __str__
+
+    def _write(self, parts, budget, text):
+        parts.append(text)
+        budget[0] -= len(text)
+        return budget[0] > 0
+
+    def _parse(self, key, value):
+        if not isinstance(value, str) or str(key).lower() not in JSON_KEYS:
+            return value
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            return value
+        return parsed if isinstance(parsed, (dict, list)) else value
+
+    def _render(self, value, parts, budget, customer=False):
+        if budget[0] <= 0:
+            return False
+        if isinstance(value, dict):
+            if not self._write(parts, budget, "{"):
+                return False
+            customer = customer or 'email_address' in value
+            for i, (key, item) in enumerate(value.items()):
+                prefix = ", " if i else ""
+                if not self._write(parts, budget, "{}{!r}: ".format(prefix, key)):
+                    return False
+                name = str(key).lower()
+                if name in REDACTED_KEYS or (customer and name == 'id'):
+                    if not self._write(parts, budget, repr(REDACTED)):
+                        return False
+                elif name in URL_KEYS and isinstance(item, str):
+                    if not self._render(redact_url(item), parts, budget):
+                        return False
+                elif not self._render(self._parse(key, item), parts, budget, name in CUSTOMER_KEYS):
+                    return False
+            return self._write(parts, budget, "}")
+        if isinstance(value, (list, tuple)):
+            if not self._write(parts, budget, "["):
+                return False
+            for i, item in enumerate(value):
+                if i and not self._write(parts, budget, ", "):
+                    return False
+                if not self._render(item, parts, budget):
+                    return False
+            return self._write(parts, budget, "]")
+        text = repr(value)
+        if len(text) > budget[0]:
+            text = text[:budget[0] + 1]
+        return self._write(parts, budget, text)
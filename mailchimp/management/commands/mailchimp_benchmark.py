@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from tenant_schemas.utils import schema_context
+
+from ...benchmark import MailChimpBenchmark
+from ...fake_server import FakeMailChimpServer
+
+
+class Command(BaseCommand):
+    help = "Benchmark the Mailchimp sync client against a local fake Mailchimp API"
+
+    def add_arguments(self, parser):
+        parser.add_argument('schema_name')
+        parser.add_argument('--orders', type=int, default=200)
+        parser.add_argument('--pos-orders', type=int, default=200)
+        parser.add_argument('--lines-per-order', type=int, default=3)
+        parser.add_argument('--catalog-size', type=int, default=50)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help="seconds added to every fake API response")
+        parser.add_argument('--throttle-rate', type=float, default=0.0,
+                            help="share of requests answered with 429")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="share of requests answered with 503")
+
+    def handle(self, *args, **options):
+        with FakeMailChimpServer(latency=options['latency'], throttle_rate=options['throttle_rate'],
+                                 error_rate=options['error_rate']) as server:
+            with schema_context(options['schema_name']):
+                benchmark = MailChimpBenchmark(
+                    server, orders=options['orders'], lines_per_order=options['lines_per_order'],
+                    catalog_size=options['catalog_size'], pos_orders=options['pos_orders'],
+                    concurrency=options['concurrency'])
+                results = benchmark.run()
+        columns = ('flow', 'operations', 'seconds', 'ops_per_second', 'calls_per_op', 'p95_ms')
+        self.stdout.write("  ".join("{:>20}".format(column) for column in columns))
+        for result in results:
+            self.stdout.write("  ".join("{:>20}".format(str(result[column])) for column in columns))
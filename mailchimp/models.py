@@ -0,0 +1,204 @@
+import hashlib
+import json
+
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from apps.products.models import Product
+
+
+class MailChimpSyncLedger(models.Model):
+    """ Ledger of resources already pushed to Mailchimp ecommerce.
+        Lives in the tenant schema, so every retailer keeps its own ledger.
+        `content_hash` is the hash of the last payload Mailchimp accepted,
+        a call with the same hash can be skipped.
+    """
+    STORE = 'store'
+    PRODUCT = 'product'
+    CUSTOMER = 'customer'
+    ORDER = 'order'
+
+    RESOURCE_TYPES = (
+        (STORE, _('Store')),
+        (PRODUCT, _('Product')),
+        (CUSTOMER, _('Customer')),
+        (ORDER, _('Order')),
+    )
+    resource_type = models.CharField(max_length=20, choices=RESOURCE_TYPES)
+    resource_id = models.CharField(max_length=255)
+    store_id = models.CharField(max_length=255, blank=True, default='')
+    content_hash = models.CharField(max_length=40)
+    last_synced = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('resource_type', 'store_id', 'resource_id')
+
+    def __str__(self):
+        return f'{self.resource_type}:{self.store_id}:{self.resource_id}'
+
+    @staticmethod
+    def get_content_hash(data):
+        return hashlib.sha1(
+            json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def is_synced(cls, resource_type, resource_id, data, store_id=''):
+        return cls.objects.filter(
+            resource_type=resource_type, store_id=store_id, resource_id=str(resource_id),
+            content_hash=cls.get_content_hash(data)).exists()
+
+    @classmethod
+    def mark_synced(cls, resource_type, resource_id, data, store_id=''):
+        cls.objects.update_or_create(
+            resource_type=resource_type, store_id=store_id, resource_id=str(resource_id),
+            defaults={'content_hash': cls.get_content_hash(data), 'last_synced': timezone.now()})
+
+    @classmethod
+    def get_synced_hashes(cls, resource_type, resource_ids, store_id=''):
+        """ {resource_id: content_hash} of the resources already pushed, in one query
+        """
+        return dict(cls.objects.filter(
+            resource_type=resource_type, store_id=store_id,
+            resource_id__in=[str(resource_id) for resource_id in resource_ids]
+        ).values_list('resource_id', 'content_hash'))
+
+    @classmethod
+    def get_changed(cls, resource_type, resources, store_id=''):
+        """ The entries of `resources` ({resource_id: data}) whose payload
+            differs from the last one pushed
+        """
+        synced = cls.get_synced_hashes(resource_type, resources, store_id)
+        return {resource_id: data for resource_id, data in resources.items()
+                if synced.get(str(resource_id)) != cls.get_content_hash(data)}
+
+    @classmethod
+    def mark_synced_many(cls, resource_type, resources, store_id=''):
+        """ `mark_synced` of every entry of `resources` ({resource_id: data})
+        """
+        if not resources:
+            return
+        now = timezone.now()
+        with transaction.atomic():
+            cls.objects.filter(
+                resource_type=resource_type, store_id=store_id,
+                resource_id__in=[str(resource_id) for resource_id in resources]).delete()
+            # a concurrent sync may have marked the same resources meanwhile
+            cls.objects.bulk_create([
+                cls(resource_type=resource_type, store_id=store_id, resource_id=str(resource_id),
+                    content_hash=cls.get_content_hash(data), last_synced=now)
+                for resource_id, data in resources.items()
+            ], ignore_conflicts=True)
+
+    @classmethod
+    def invalidate(cls, resource_type, resource_id=None, store_id=None):
+        entries = cls.objects.filter(resource_type=resource_type)
+        if resource_id is not None:
+            entries = entries.filter(resource_id=str(resource_id))
+        if store_id is not None:
+            entries = entries.filter(store_id=store_id)
+        entries.delete()
+
+
+@receiver(post_delete, sender=Product, dispatch_uid="invalidate_mailchimp_product_ledger")
+@receiver(post_save, sender=Product, dispatch_uid="invalidate_mailchimp_product_ledger")
+def invalidate_product_ledger(sender, instance, **kwargs):
+    # product edited, next order/import has to push it again to every store
+    MailChimpSyncLedger.invalidate(MailChimpSyncLedger.PRODUCT, instance.internal_item_number)
+
+
+class MailChimpImportJob(models.Model):
+    """ Checkpoint of a chunked import to Mailchimp.
+        `last_pk` is the highest primary key Mailchimp acknowledged, a restarted
+        job continues after it instead of starting from zero.
+    """
+    PRODUCT_IMPORT = 'product_import'
+
+    JOB_TYPES = (
+        (PRODUCT_IMPORT, _('Product Import')),
+    )
+
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+    STATUS = (
+        (RUNNING, _('Running')),
+        (COMPLETED, _('Completed')),
+        (FAILED, _('Failed')),
+    )
+    job_type = models.CharField(max_length=30, choices=JOB_TYPES)
+    store_id = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS, default=RUNNING)
+    last_pk = models.BigIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    batches = models.PositiveIntegerField(default=0)
+    # operations Mailchimp rejected inside the batches, retried by the next run
+    failed = models.PositiveIntegerField(default=0)
+    started = models.DateTimeField(default=timezone.now)
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('job_type', 'store_id')
+
+    def __str__(self):
+        return f'{self.job_type}:{self.store_id} ({self.processed}/{self.total})'
+
+    @property
+    def progress(self):
+        if not self.total:
+            return 0.0
+        return round(self.processed * 100.0 / self.total, 2)
+
+    @property
+    def throughput(self):
+        # items per second since the job started
+        elapsed = ((self.finished or timezone.now()) - self.started).total_seconds()
+        if elapsed <= 0:
+            return 0.0
+        return round(self.processed / elapsed, 2)
+
+
+class MailChimpOutbox(models.Model):
+    """ Mailchimp writes that could not be sent (circuit open or transport
+        failure), replayed later by `retry_mailchimp_outbox`.
+    """
+    path = models.CharField(max_length=500)
+    method = models.CharField(max_length=10, default="POST")
+    data = models.TextField(default="{}")
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.attempts})'
+
+    @classmethod
+    def enqueue(cls, path, data, method, error=''):
+        return cls.objects.create(path=path, method=method, data=json.dumps(data, default=str),
+                                  last_error=error)
+
+
+class MailChimpSyncCursor(models.Model):
+    """ High-water mark of an incremental sync, `(last_modified, last_id)` of
+        the last record Mailchimp acknowledged.
+    """
+    ORDERS = 'orders'
+
+    NAMES = (
+        (ORDERS, _('Orders')),
+    )
+    name = models.CharField(max_length=30, choices=NAMES, unique=True)
+    last_modified = models.DateTimeField(null=True, blank=True)
+    last_id = models.BigIntegerField(default=0)
+    synced = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}:{self.last_modified}:{self.last_id}'
@@ -0,0 +1,193 @@
+import json
+import logging
+
+from django.apps import apps
+from django.db.models import Q
+
+from .client import MailChimpHelperClient
+from .executor import MailChimpSyncExecutor
+from .models import MailChimpSyncCursor, MailChimpSyncLedger
+
+logger = logging.getLogger('third_party_api_call_logger')
+
+ORDER_SYNC_CHUNK_SIZE = 200
+
+
+def get_order_model():
+    return apps.get_model('order', 'Order')
+
+
+#function to get the field the order cursor follows, and whether it is a modification time
+#an order model with only `date_placed` cannot be followed incrementally: an order changed after
+#it was placed would never be picked up again, every run then is a full pass (see `OrderReconciliation`)
+def get_order_modified_field(model):
+    field_names = [field.name for field in model._meta.get_fields()]
+    for name in ('modified', 'date_updated'):
+        if name in field_names:
+            return name, True
+    if 'date_placed' in field_names:
+        return 'date_placed', False
+    raise LookupError("Order model has no modification or placement time field")
+
+
+#function to stream orders changed after the cursor, one chunk at a time
+#`full` streams every order, the cursor position is ignored
+def iter_changed_orders(cursor, chunk_size=ORDER_SYNC_CHUNK_SIZE, full=False):
+    model = get_order_model()
+    modified_field, _ = get_order_modified_field(model)
+    last_modified, last_id = (None, 0) if full else (cursor.last_modified, cursor.last_id)
+    queryset = model.objects.select_related('store', 'store__retailer', 'user').prefetch_related(
+        'lines__retailer_product__product__brand').order_by(modified_field, 'id')
+    while True:
+        orders = queryset
+        if last_modified is not None:
+            orders = orders.filter(
+                Q(**{modified_field + '__gt': last_modified}) |
+                Q(**{modified_field: last_modified, 'id__gt': last_id}))
+        chunk = list(orders[:chunk_size])
+        if not chunk:
+            return
+        yield modified_field, chunk
+        last_modified, last_id = getattr(chunk[-1], modified_field), chunk[-1].id
+
+
+class OrderBatch:
+    """ One chunk of orders prepared for a batch call: the orders the cursor
+        moves past once Mailchimp accepts `operations`, and the products and
+        customers (`{(resource_type, store_id): {resource_id: data}}`) to mark
+        in the sync ledger then.
+    """
+    __slots__ = ('orders', 'operations', 'ledger', 'skipped', 'complete', 'modified_field')
+
+    def __init__(self, orders):
+        self.orders = orders
+        self.operations = []
+        self.ledger = {}
+        self.skipped = 0
+        self.complete = True
+        self.modified_field = None
+
+
+class OrderReconciliation:
+    """ Pushes orders created or changed since the last run to Mailchimp.
+        Each chunk becomes one batch of upserts (products, customers, orders),
+        sent by a `MailChimpSyncExecutor` while the next chunks are prepared.
+        The cursor moves, in chunk order, once Mailchimp acknowledged the batch,
+        and stops before the first order whose store could not be resolved.
+        Orders missed by `create_order` during an outage are picked up by the
+        next run.
+        When the order model has no modification time (`date_placed` only)
+        every run is a full pass from the first order, and the orders join
+        the sync ledger so the unchanged ones are not sent again.
+    """
+
+    def __init__(self, client=None, chunk_size=ORDER_SYNC_CHUNK_SIZE, executor=None):
+        self.client = client or MailChimpHelperClient()
+        self.chunk_size = chunk_size
+        self.executor = executor or MailChimpSyncExecutor(client_class=type(self.client))
+
+    def get_customer_data(self, order):
+        if order.user_id:
+            return self.client.get_customer_data(order.user)
+        email = getattr(order, 'guest_email', '')
+        if not email:
+            return None
+        return {
+            "id": str(email),
+            "email_address": email,
+            "opt_in_status": True,
+            "first_name": "",
+            "last_name": "",
+        }
+
+    def get_operations(self, orders, full=False):
+        """ The `OrderBatch` of the leading orders of the chunk that can be sent.
+            The chunk is cut at the first order whose store could not be
+            resolved, a transient failure the cursor must not move past.
+            An order without customer (no user, no guest email) cannot be
+            pushed until it changes, it is logged and counted as skipped.
+        """
+        batch = OrderBatch(orders)
+        products = {}
+        customers = {}
+        order_payloads = {}
+        for i, order in enumerate(orders):
+            store_id = self.client.create_store(order.store)
+            if not store_id:
+                batch.orders, batch.complete = orders[:i], False
+                logger.error('MailChimp order sync stopped, store not resolved',
+                             extra=self.client.get_log_data({"order_id": order.id, "store_id": order.store_id}))
+                break
+            customer_data = self.get_customer_data(order)
+            if not customer_data:
+                batch.skipped += 1
+                logger.warning('MailChimp order sync skipped order without customer',
+                               extra=self.client.get_log_data({"order_id": order.id}))
+                continue
+            for line in order.lines.all():
+                product_data = self.client.get_line_product_data(line)
+                products.setdefault(store_id, {})[product_data["id"]] = product_data
+            customers.setdefault(store_id, {})[customer_data["id"]] = customer_data
+            order_data = self.client.get_order_data(order, customer_data["id"])
+            order_payloads.setdefault(store_id, {})[order_data["id"]] = order_data
+        for store_id, payloads in order_payloads.items():
+            if full:
+                payloads = MailChimpSyncLedger.get_changed(MailChimpSyncLedger.ORDER, payloads, store_id)
+                batch.ledger[(MailChimpSyncLedger.ORDER, store_id)] = payloads
+            for order_id, data in payloads.items():
+                batch.operations.append({"method": "PUT",
+                                         "path": MailChimpHelperClient.STORES_URL + "/" + store_id + "/orders/" + order_id,
+                                         "body": json.dumps(data)})
+        # products and customers first, orders refer to them
+        upserts = []
+        for resource_type, resources, path in ((MailChimpSyncLedger.PRODUCT, products, "/products/"),
+                                               (MailChimpSyncLedger.CUSTOMER, customers, "/customers/")):
+            for store_id, payloads in resources.items():
+                changed = MailChimpSyncLedger.get_changed(resource_type, payloads, store_id)
+                batch.ledger[(resource_type, store_id)] = changed
+                for resource_id, data in changed.items():
+                    upserts.append({"method": "PUT",
+                                    "path": MailChimpHelperClient.STORES_URL + "/" + store_id + path + resource_id,
+                                    "body": json.dumps(data)})
+        batch.operations = upserts + batch.operations
+        return batch
+
+    def iter_batches(self, cursor, full=False):
+        for modified_field, orders in iter_changed_orders(cursor, self.chunk_size, full=full):
+            batch = self.get_operations(orders, full=full)
+            batch.modified_field = modified_field
+            yield batch
+            if not batch.complete:
+                return
+
+    @staticmethod
+    def send_batch(client, batch):
+        if not batch.operations:
+            return None
+        return client.create_batch_operations(batch.operations)
+
+    def run(self):
+        cursor, created = MailChimpSyncCursor.objects.get_or_create(name=MailChimpSyncCursor.ORDERS)
+        modified_field, incremental = get_order_modified_field(get_order_model())
+        if not incremental:
+            logger.warning('MailChimp order sync runs a full pass, order model has no modification time',
+                           extra=self.client.get_log_data({"field": modified_field}))
+        batches = self.iter_batches(cursor, full=not incremental)
+        for batch, response in self.executor.run_ordered(self.send_batch, batches):
+            if isinstance(response, Exception) or (response is not None and not response.get('id')):
+                detail = response if isinstance(response, Exception) else response.get('detail', '')
+                logger.error('MailChimp order sync stopped, batch not accepted',
+                             extra=self.client.get_log_data({"exception_msg": str(detail)}))
+                return cursor
+            for (resource_type, store_id), resources in batch.ledger.items():
+                MailChimpSyncLedger.mark_synced_many(resource_type, resources, store_id)
+            if batch.orders:
+                cursor.last_modified = getattr(batch.orders[-1], batch.modified_field)
+                cursor.last_id = batch.orders[-1].id
+                cursor.synced += len(batch.orders) - batch.skipped
+                cursor.skipped += batch.skipped
+                cursor.save()
+            if not batch.complete:
+                return cursor
+        return cursor
+
@@ -0,0 +1,72 @@
+import json
+import logging
+from datetime import timedelta
+
+import requests
+from celery import shared_task
+from django.utils import timezone
+from tenant_schemas.utils import get_tenant_model, schema_context
+
+from .circuit import CircuitOpen
+from .client import MailChimpHelperClient
+from .imports import ProductCatalogImport
+from .models import MailChimpOutbox
+from .orders import OrderReconciliation
+
+logger = logging.getLogger('third_party_api_call_logger')
+
+OUTBOX_MAX_ATTEMPTS = 10
+
+
+@shared_task
+def import_products_to_mailchimp(schema_name, restart=False):
+    """ Consumer side of `KINESIS_ACTION_PRODUCT_IMPORT_MAILCHIMP`,
+        pushes the product catalog of the tenant to its default store.
+    """
+    with schema_context(schema_name):
+        retailer = get_tenant_model().objects.get(schema_name=schema_name)
+        if retailer.get_default_store:
+            ProductCatalogImport(retailer.get_default_store).run(restart=restart)
+
+
+@shared_task
+def retry_mailchimp_outbox(schema_name, limit=100):
+    """ Replays writes kept in the outbox while the Mailchimp circuit was open.
+        Stops at the first `CircuitOpen`, the remaining entries wait for the next run.
+    """
+    with schema_context(schema_name):
+        client = MailChimpHelperClient()
+        entries = MailChimpOutbox.objects.filter(next_attempt__lte=timezone.now()).order_by('id')[:limit]
+        for entry in entries:
+            error = ''
+            try:
+                response = client.get_api_response(
+                    client.get_api_endpoint() + entry.path, json.loads(entry.data), entry.method)
+                if response.status_code < MailChimpHelperClient.SERVER_ERROR_CODE and response.status_code != 429:
+                    entry.delete()
+                    continue
+                error = "HTTP {}".format(response.status_code)
+            except CircuitOpen:
+                break
+            except requests.RequestException as e:
+                error = str(e)
+            entry.attempts += 1
+            entry.last_error = error
+            if entry.attempts >= OUTBOX_MAX_ATTEMPTS:
+                logger.error('MailChimp outbox entry dropped: %s', entry, extra=client.get_log_data({
+                    "request_url": entry.path,
+                    "request_method": entry.method,
+                    "exception_msg": error,
+                }))
+                entry.delete()
+                continue
+            entry.next_attempt = timezone.now() + timedelta(minutes=2 ** entry.attempts)
+            entry.save(update_fields=['attempts', 'last_error', 'next_attempt'])
+
+
+@shared_task
+def sync_orders_to_mailchimp(schema_name):
+    """ Periodic catch-up of orders changed since the last run of the tenant.
+    """
+    with schema_context(schema_name):
+        OrderReconciliation().run()
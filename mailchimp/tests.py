@@ -0,0 +1,156 @@
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from django.utils import timezone
+from tenant_schemas.test.cases import TenantTestCase
+
+from . import orders as orders_module
+from .models import MailChimpSyncCursor, MailChimpSyncLedger
+from .orders import OrderReconciliation
+
+
+class FakeClient:
+    """ `MailChimpHelperClient` answering from memory, `accepted` says which
+        batch calls Mailchimp acknowledges
+    """
+
+    def __init__(self, accepted=None, stores=None):
+        self.accepted = accepted
+        self.stores = stores
+        self.batches = []
+
+    def create_store(self, store):
+        if self.stores is not None and store.id not in self.stores:
+            return None
+        return "store_{}".format(store.id)
+
+    def get_customer_data(self, user):
+        return {"id": str(user.id), "email_address": user.email}
+
+    def get_line_product_data(self, line):
+        return {"id": str(line.product_id), "title": "Product {}".format(line.product_id)}
+
+    def get_order_data(self, order, customer_id):
+        return {"id": str(order.id), "customer": {"id": customer_id}}
+
+    def create_batch_operations(self, operations):
+        self.batches.append(operations)
+        if self.accepted is not None and len(self.batches) not in self.accepted:
+            return {"detail": "rejected"}
+        return {"id": "batch_{}".format(len(self.batches))}
+
+    def get_log_data(self, extra_data={}):
+        return dict(extra_data)
+
+
+class SerialExecutor:
+    """ `MailChimpSyncExecutor.run_ordered` without threads """
+
+    def __init__(self, client):
+        self.client = client
+
+    def run_ordered(self, operation, items):
+        for item in items:
+            try:
+                yield item, operation(self.client, item)
+            except Exception as e:
+                yield item, e
+
+
+def make_order(order_id, modified, store_id=1, user_id=1):
+    user = SimpleNamespace(id=user_id, email="crew{}@example.com".format(user_id)) if user_id else None
+    lines = [SimpleNamespace(product_id=order_id * 10)]
+    return SimpleNamespace(
+        id=order_id, modified=modified, store=SimpleNamespace(id=store_id), store_id=store_id,
+        user_id=user_id, user=user, guest_email='', lines=SimpleNamespace(all=lambda: lines))
+
+
+class OrderReconciliationTest(TenantTestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        self.orders = [make_order(i, now + timedelta(minutes=i)) for i in range(1, 7)]
+
+    def run_sync(self, client, orders=None, chunk_size=2, incremental=True):
+        orders = self.orders if orders is None else orders
+
+        def iter_changed_orders(cursor, size, full=False):
+            for i in range(0, len(orders), size):
+                yield 'modified', orders[i:i + size]
+
+        with mock.patch.object(orders_module, 'iter_changed_orders', iter_changed_orders), \
+                mock.patch.object(orders_module, 'get_order_model', lambda: None), \
+                mock.patch.object(orders_module, 'get_order_modified_field',
+                                  lambda model: ('modified', incremental)):
+            return OrderReconciliation(client=client, chunk_size=chunk_size,
+                                       executor=SerialExecutor(client)).run()
+
+    def test_cursor_moves_past_accepted_batches(self):
+        cursor = self.run_sync(FakeClient())
+        self.assertEqual(cursor.last_id, 6)
+        self.assertEqual(cursor.last_modified, self.orders[-1].modified)
+        self.assertEqual(cursor.synced, 6)
+
+    def test_cursor_holds_at_rejected_batch(self):
+        client = FakeClient(accepted={1})
+        cursor = self.run_sync(client)
+        self.assertEqual(cursor.last_id, 2)
+        self.assertEqual(cursor.synced, 2)
+        self.assertEqual(len(client.batches), 2)
+        cursor.refresh_from_db()
+        self.assertEqual(cursor.last_id, 2)
+
+    def test_cursor_holds_before_unresolved_store(self):
+        self.orders[2] = make_order(3, self.orders[2].modified, store_id=2)
+        client = FakeClient(stores={1})
+        cursor = self.run_sync(client)
+        # the chunk is cut before order 3, the later chunks are not sent
+        self.assertEqual(cursor.last_id, 2)
+        self.assertEqual(len(client.batches), 1)
+
+    def test_cursor_holds_when_first_order_has_unresolved_store(self):
+        client = FakeClient(stores=set())
+        cursor = self.run_sync(client)
+        self.assertIsNone(cursor.last_modified)
+        self.assertEqual(cursor.last_id, 0)
+        self.assertEqual(client.batches, [])
+
+    def test_order_without_customer_is_skipped(self):
+        self.orders[1] = make_order(2, self.orders[1].modified, user_id=None)
+        cursor = self.run_sync(FakeClient())
+        self.assertEqual(cursor.last_id, 6)
+        self.assertEqual(cursor.synced, 5)
+        self.assertEqual(cursor.skipped, 1)
+
+    def test_ledger_marked_only_after_acceptance(self):
+        self.run_sync(FakeClient(accepted=set()), orders=self.orders[:2])
+        self.assertFalse(MailChimpSyncLedger.objects.exists())
+
+        client = FakeClient()
+        self.run_sync(client, orders=self.orders[:2])
+        self.assertTrue(MailChimpSyncLedger.is_synced(
+            MailChimpSyncLedger.CUSTOMER, '1', client.get_customer_data(self.orders[0].user), 'store_1'))
+
+        # the customer and products are not sent again with the next orders
+        client = FakeClient()
+        MailChimpSyncCursor.objects.all().delete()
+        self.run_sync(client, orders=self.orders[:2])
+        self.assertEqual([operation["path"].split("/")[-2] for operation in client.batches[0]],
+                         ["orders", "orders"])
+
+    def test_full_pass_skips_unchanged_orders(self):
+        self.run_sync(FakeClient(), orders=self.orders[:2], incremental=False)
+
+        # nothing changed, nothing is sent again
+        client = FakeClient()
+        self.run_sync(client, orders=self.orders[:2], incremental=False)
+        self.assertEqual(client.batches, [])
+
+        client = FakeClient()
+        get_order_data = client.get_order_data
+        client.get_order_data = lambda order, customer_id: dict(
+            get_order_data(order, customer_id), **({"financial_status": "refunded"} if order.id == 2 else {}))
+        self.run_sync(client, orders=self.orders[:2], incremental=False)
+        self.assertEqual([operation["path"] for operation in client.batches[0]],
+                         [orders_module.MailChimpHelperClient.STORES_URL + "/store_1/orders/2"])